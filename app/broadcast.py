@@ -0,0 +1,107 @@
+"""
+観戦者向けの一斉配信（/rooms/{code}/watch）。
+
+プレイヤーは部屋イベントを受けるたびに各自でパーシャルを取り直すが、観戦者は何百・何千人いる。
+そこで観戦者が 1 人以上いる部屋ごとに 1 本だけ hub を購読するタスクを立て、
+イベントが来たら（WATCH_COALESCE_MS だけまとめてから）観戦画面の断片を 1 回描画し、
+SSE のフレームに整形した同じ文字列を全員に渡す。観戦者 1 人あたりの DB・テンプレート処理は無い。
+
+観戦者は Player を作らない（セッションにも何も書かない）。
+配信は「最新の画面」だけを持つ（キューではない）ので、遅い観戦者は途中の画面を飛ばして最新に追いつく。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+from app.events import RoomHub, format_sse
+
+log = logging.getLogger(__name__)
+
+COALESCE_MS = float(os.environ.get("WATCH_COALESCE_MS", "100"))
+
+
+class Channel:
+    """1 部屋ぶんの最新フレームと、それが変わったことを待つための future。"""
+
+    def __init__(self) -> None:
+        self.seq = 0
+        self.frame: str | None = None
+        self.watchers = 0
+        self.task: asyncio.Task | None = None
+        self._changed: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def publish(self, frame: str) -> None:
+        self.seq += 1
+        self.frame = frame
+        fut, self._changed = self._changed, asyncio.get_running_loop().create_future()
+        fut.set_result(None)   # 待っている全員を一度に起こす
+
+    async def wait(self, seen: int, timeout: float) -> bool:
+        """seq が seen から進むまで待つ。timeout までに変わらなければ False。"""
+        if self.seq != seen:
+            return True
+        try:
+            # 共有の future なので、タイムアウトで取り消されないよう shield する
+            await asyncio.wait_for(asyncio.shield(self._changed), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class Broadcaster:
+    def __init__(self, hub: RoomHub, render: Callable[[str], Awaitable[str | None]],
+                 coalesce_ms: float = COALESCE_MS) -> None:
+        self._hub = hub
+        self._render = render          # code -> 観戦画面の断片（部屋が無ければ None）
+        self._coalesce = coalesce_ms / 1000
+        self._channels: dict[str, Channel] = {}
+        self.frames = 0     # 配信した（内容が変わった）フレーム数
+
+    def audience(self, code: str | None = None) -> int:
+        if code is not None:
+            ch = self._channels.get(code)
+            return ch.watchers if ch else 0
+        return sum(ch.watchers for ch in self._channels.values())
+
+    @asynccontextmanager
+    async def watch(self, code: str) -> AsyncIterator[Channel]:
+        ch = self._channels.get(code)
+        if ch is None:
+            ch = self._channels[code] = Channel()
+            ch.task = asyncio.create_task(self._pump(code, ch))
+        ch.watchers += 1
+        try:
+            yield ch
+        finally:
+            ch.watchers -= 1
+            if ch.watchers == 0 and self._channels.get(code) is ch:
+                del self._channels[code]
+                ch.task.cancel()
+
+    async def _pump(self, code: str, ch: Channel) -> None:
+        # 先に購読してから最初の描画をする（その間のイベントを取りこぼさない）
+        async with self._hub.subscribe(code) as q:
+            await self._refresh(code, ch)
+            while True:
+                await q.get()
+                await asyncio.sleep(self._coalesce)
+                while not q.empty():
+                    q.get_nowait()
+                await self._refresh(code, ch)
+
+    async def _refresh(self, code: str, ch: Channel) -> None:
+        try:
+            html = await self._render(code)
+        except Exception:
+            log.exception("watch render failed for room %s", code)
+            return
+        if html is None:
+            return
+        frame = format_sse("state", html)
+        if frame != ch.frame:
+            self.frames += 1
+            ch.publish(frame)
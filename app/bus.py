@@ -0,0 +1,224 @@
+"""
+ワーカー間のルームイベント配送。
+uvicorn --workers N のように複数プロセスで動かすと、hub（SSE）も room_cache もプロセスごとに別物になる。
+書き込み系ハンドラは hub.publish の代わりに bus.publish を呼び、
+どのワーカーで起きた変更も全ワーカーの handler(code, event, data, remote) に届ける。
+
+  - LocalBus : 単一プロセス用（既定）。手元の handler を呼ぶだけ
+  - TableBus : 共有 DB の room_event テーブルを中継に使う。各ワーカーは
+               送信分をまとめて INSERT し、id の続きだけを短い間隔で読む
+               （部屋数・人数に関係なくワーカーあたり 1 クエリ / 周期）
+
+remote=True のイベントは他ワーカー発なので、受け側はキャッシュを捨ててから hub に流す。
+
+request(code, event) は全ワーカーに頼みごと（例：締め切る前に手元のバッファを書き切る）をして、
+全員が ack(token) を返すまで待つ（スレッドから呼ぶ）。TableBus は各ワーカーが bus_peer に
+心拍を書くので、待つ相手は心拍が新しいワーカーだけ。ROOM_BUS_REQUEST_TIMEOUT_MS で諦める。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.models import BusPeer, RoomEvent
+
+log = logging.getLogger(__name__)
+
+BUS_BACKEND = os.environ.get("ROOM_BUS", "local")
+BUS_URL = os.environ.get("ROOM_BUS_URL", "")               # 未設定なら DATABASE_URL と同じ DB
+POLL_SECONDS = int(os.environ.get("ROOM_BUS_POLL_MS", "50")) / 1000
+RETAIN_SECONDS = int(os.environ.get("ROOM_BUS_RETAIN_SECONDS", "60"))
+REQUEST_TIMEOUT = int(os.environ.get("ROOM_BUS_REQUEST_TIMEOUT_MS", "1000")) / 1000
+PRUNE_INTERVAL = 30
+HEARTBEAT_INTERVAL = 1
+PEER_TTL = 5
+
+# handler(code, event, data, remote)
+Handler = Callable[[str, str, str, bool], None]
+
+
+class LocalBus:
+    def __init__(self, handler: Handler) -> None:
+        self._handler = handler
+
+    def publish(self, code: str, event: str, data: str = "") -> None:
+        """どのスレッドからでも呼べる。手元のワーカーには即座に届く。"""
+        self._handler(code, event, data, False)
+
+    def request(self, code: str, event: str, timeout: float = REQUEST_TIMEOUT) -> bool:
+        """他のワーカー全員に event を送って ack を待つ。単一プロセスでは相手がいない。"""
+        return True
+
+    def ack(self, token: str) -> None:
+        pass
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class TableBus(LocalBus):
+    def __init__(self, handler: Handler, eng: AsyncEngine,
+                 poll: float = POLL_SECONDS, retain: float = RETAIN_SECONDS) -> None:
+        super().__init__(handler)
+        self._eng = eng
+        self._poll = poll
+        self._retain = retain
+        self.origin = uuid.uuid4().hex
+        self._out: list[dict] = []
+        self._out_lock = threading.Lock()
+        self._last_id = 0
+        self._last_prune = 0.0
+        self._last_beat = 0.0
+        self._peers: set[str] = set()                      # 心拍が新しい他のワーカー
+        self._waiting: dict[str, tuple[set[str], threading.Event]] = {}   # token -> (未応答, 完了)
+        self._task: asyncio.Task | None = None
+
+    def publish(self, code: str, event: str, data: str = "") -> None:
+        super().publish(code, event, data)
+        self._queue(code, event, data)
+
+    def _queue(self, code: str, event: str, data: str) -> None:
+        with self._out_lock:
+            self._out.append({
+                "origin": self.origin, "room_code": code, "event": event,
+                "data": data, "created_at": datetime.utcnow(),
+            })
+
+    def request(self, code: str, event: str, timeout: float = REQUEST_TIMEOUT) -> bool:
+        peers = set(self._peers)
+        if not peers:
+            return True
+        token = uuid.uuid4().hex
+        done = threading.Event()
+        self._waiting[token] = (peers, done)
+        try:
+            # 頼みごとは手元の handler には流さない（呼び出し側が自分で済ませる）
+            self._queue(code, event, token)
+            return done.wait(timeout)
+        finally:
+            self._waiting.pop(token, None)
+
+    def ack(self, token: str) -> None:
+        self._queue("", "ack", token)
+
+    def _acked(self, origin: str, token: str) -> None:
+        waiting = self._waiting.get(token)
+        if waiting is None:
+            return
+        pending, done = waiting
+        pending.discard(origin)
+        if not pending:
+            done.set()
+
+    async def _heartbeat(self) -> None:
+        now = time.monotonic()
+        if now - self._last_beat < HEARTBEAT_INTERVAL:
+            return
+        self._last_beat = now
+        t = BusPeer.__table__
+        utcnow = datetime.utcnow()
+        async with self._eng.begin() as conn:
+            res = await conn.execute(update(t).where(t.c.origin == self.origin).values(seen_at=utcnow))
+            if res.rowcount == 0:
+                await conn.execute(insert(t).values(origin=self.origin, seen_at=utcnow))
+            cutoff = utcnow - timedelta(seconds=PEER_TTL)
+            await conn.execute(delete(t).where(t.c.seen_at < cutoff))
+            peers = set((await conn.execute(select(t.c.origin).where(t.c.origin != self.origin))).scalars())
+        self._peers = peers
+        # 居なくなったワーカーの応答は待たない
+        for pending, done in list(self._waiting.values()):
+            pending &= peers
+            if not pending:
+                done.set()
+
+    async def start(self) -> None:
+        async with self._eng.begin() as conn:
+            await conn.run_sync(RoomEvent.__table__.create, checkfirst=True)
+            await conn.run_sync(BusPeer.__table__.create, checkfirst=True)
+            # 起動前の履歴は流さない
+            self._last_id = (await conn.execute(select(func.max(RoomEvent.id)))).scalar() or 0
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush()   # 取り残した送信分
+        async with self._eng.begin() as conn:
+            await conn.execute(delete(BusPeer.__table__).where(BusPeer.origin == self.origin))
+
+    async def _flush(self) -> None:
+        with self._out_lock:
+            rows, self._out = self._out, []
+        if not rows:
+            return
+        async with self._eng.begin() as conn:
+            await conn.execute(insert(RoomEvent.__table__), rows)
+
+    async def _drain(self) -> None:
+        t = RoomEvent.__table__
+        async with self._eng.connect() as conn:
+            rows = (await conn.execute(
+                select(t.c.id, t.c.origin, t.c.room_code, t.c.event, t.c.data)
+                .where(t.c.id > self._last_id)
+                .order_by(t.c.id)
+            )).all()
+        for id_, origin, code, event, data in rows:
+            self._last_id = id_
+            if origin == self.origin:
+                continue   # 自分の分は publish 時に配送済み
+            if event == "ack":
+                self._acked(origin, data)
+                continue
+            try:
+                self._handler(code, event, data, True)
+            except Exception:
+                log.exception("bus handler failed for room %s", code)
+
+    async def _prune(self) -> None:
+        now = time.monotonic()
+        if now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        cutoff = datetime.utcnow() - timedelta(seconds=self._retain)
+        t = RoomEvent.__table__
+        async with self._eng.begin() as conn:
+            # 最新の 1 行は残す（AUTOINCREMENT 無しで作られた既存の表でも id が巻き戻らない）
+            newest = select(func.max(t.c.id)).scalar_subquery()
+            await conn.execute(delete(t).where(t.c.created_at < cutoff, t.c.id < newest))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._heartbeat()
+                await self._flush()
+                await self._drain()
+                await self._prune()
+            except Exception:
+                log.exception("room bus poll failed")
+            await asyncio.sleep(self._poll)
+
+
+def make_bus(handler: Handler, backend: str = BUS_BACKEND, url: str = BUS_URL) -> LocalBus:
+    if backend == "local":
+        return LocalBus(handler)
+    if backend == "table":
+        from app.db import async_engine, make_async_engine
+        return TableBus(handler, make_async_engine(url) if url else async_engine)
+    raise ValueError(f"unknown ROOM_BUS backend: {backend!r}")
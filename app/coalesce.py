@@ -0,0 +1,61 @@
+"""
+同じ読み取りの同時実行をまとめる（single-flight）。
+同じキーの処理が実行中なら、後から来た呼び出しは新しく始めずにその結果を待つ。
+終わった結果は ttl 秒だけ使い回す（fresh で「まだ使えるか」を追加で確かめられる）。
+
+例：同じ部屋の 10 人がほぼ同時に /rooms/{code}/players を取りに来ても、
+状態の読み込みと描画は 1 回だけで、できた本文（bytes）を 10 人で共有する。
+イベントループ上で使う前提（スレッドからは呼ばない）。
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    def __init__(self, ttl: float = 0.0, maxsize: int = 4096) -> None:
+        self._ttl = ttl
+        self._max = maxsize
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self._done: dict[Hashable, tuple[float, T]] = {}
+        self.shared = 0     # 実行中の処理に相乗りした回数
+        self.reused = 0     # ttl 内の結果を使い回した回数
+        self.computed = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]],
+                 fresh: Callable[[T], bool] | None = None) -> T:
+        if self._ttl:
+            hit = self._done.get(key)
+            if hit is not None:
+                at, value = hit
+                if time.monotonic() - at <= self._ttl and (fresh is None or fresh(value)):
+                    self.reused += 1
+                    return value
+                del self._done[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            # 別タスクで走らせるので、最初の呼び出し元が切断（キャンセル）しても相乗り側は巻き込まれない
+            task = self._inflight[key] = asyncio.ensure_future(self._run(key, fn))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        try:
+            value = await fn()
+            self.computed += 1
+            if self._ttl:
+                if len(self._done) >= self._max:
+                    self._done.clear()
+                self._done[key] = (time.monotonic(), value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def forget(self, key: Hashable) -> None:
+        self._done.pop(key, None)
@@ -0,0 +1,119 @@
+"""
+部屋コードの払い出し。
+6 桁の Crockford Base32（0-9 と I/L/O/U を除く英大文字、32^6 ≒ 10 億通り）で、
+通し番号 n をアフィン置換 (A·n + B) mod 32^6 で並べ替えたものを使う。
+A は奇数なので置換は全単射 ＝ 通し番号が重ならない限りコードも重ならない（再試行が要らない）。
+見た目は連番にならないが、推測困難さを保証するものではない（秘密ではなく衝突回避のため）。
+
+通し番号は先頭シャードの room_code_counter を ROOM_CODE_BLOCK 個ずつ進めて各ワーカーが予約し、
+手元のプールから O(1) で渡す。回収（app/reaper.py）で消えた部屋のコードは free_room_code に戻り、
+次の補充で優先して使われる。補充のたびに既存の部屋（乱数で作っていた頃のコード）とも突き合わせる。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import deque
+from typing import Iterable
+
+from sqlalchemy import delete, update
+from sqlalchemy import select as sa_select
+from sqlmodel import Session, col, select
+
+from app.db import insert_or_ignore
+from app.models import Room, RoomCodeCounter, FreeRoomCode
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+LENGTH = 6
+SPACE = len(ALPHABET) ** LENGTH
+BLOCK = int(os.environ.get("ROOM_CODE_BLOCK", "64"))
+SALT = os.environ.get("ROOM_CODE_SALT", "emoji-charades")
+
+# 見間違えやすい文字を寄せる（Crockford の読み替え）
+_NORMALIZE = str.maketrans({"O": "0", "I": "1", "L": "1"})
+
+
+def normalize_code(raw: str) -> str:
+    """入力された部屋コードを正規化（空白・ハイフン除去、大文字化、O→0 / I,L→1）。"""
+    s = "".join(raw.split()).replace("-", "").upper()
+    return s.translate(_NORMALIZE)
+
+
+def _affine(salt: str) -> tuple[int, int]:
+    h = hashlib.sha256(salt.encode()).digest()
+    a = int.from_bytes(h[:8], "big") % SPACE | 1   # 奇数 = 2 冪の法と互いに素
+    b = int.from_bytes(h[8:16], "big") % SPACE
+    return a, b
+
+
+def encode(n: int) -> str:
+    out = []
+    for _ in range(LENGTH):
+        n, r = divmod(n, len(ALPHABET))
+        out.append(ALPHABET[r])
+    return "".join(reversed(out))
+
+
+class CodeAllocator:
+    def __init__(self, engine, shard_engines: list, block: int = BLOCK, salt: str = SALT) -> None:
+        self._engine = engine             # カウンタと空きコード表を置く DB（先頭シャード）
+        self._shards = shard_engines      # 既存コードとの突き合わせ先
+        self._block = block
+        self._a, self._b = _affine(salt)
+        self._pool: deque[str] = deque()
+        self._lock = threading.Lock()
+
+    def code_at(self, n: int) -> str:
+        return encode((self._a * n + self._b) % SPACE)
+
+    def allocate(self) -> str:
+        """重複しないコードを 1 つ返す（プールが空のときだけ DB で補充）。"""
+        with self._lock:
+            while not self._pool:
+                self._pool.extend(self._refill())
+            return self._pool.popleft()
+
+    def release(self, codes: Iterable[str]) -> None:
+        """消えた部屋のコードを再利用に回す。"""
+        rows = [{"code": c} for c in codes]
+        if not rows:
+            return
+        with Session(self._engine) as s:
+            s.exec(insert_or_ignore(self._engine, FreeRoomCode), params=rows)
+            s.commit()
+
+    def _refill(self) -> list[str]:
+        with Session(self._engine) as s:
+            # 読んでから消すと、同時に補充した他ワーカーと同じコードを取り合う。1 文で消して取り出す
+            free = s.exec(
+                delete(FreeRoomCode)
+                .where(col(FreeRoomCode.code).in_(
+                    sa_select(FreeRoomCode.code).limit(self._block).scalar_subquery()
+                ))
+                .returning(FreeRoomCode.code)
+            ).scalars().all()
+            if free:
+                candidates = list(free)
+            else:
+                # UPDATE で先に書き込みロックを取ってから読む（他ワーカーと同じ範囲を予約しない）
+                bump = (update(RoomCodeCounter).where(RoomCodeCounter.id == 1)
+                        .values(next=RoomCodeCounter.next + self._block))
+                if not s.exec(bump).rowcount:
+                    # init_db を通っていない DB。行が無ければ作ってから（同時に作っても 1 行）進める
+                    s.exec(insert_or_ignore(self._engine, RoomCodeCounter).values(id=1, next=0))
+                    s.exec(bump)
+                end = s.get(RoomCodeCounter, 1).next
+                if end > SPACE:
+                    raise RuntimeError("room code space exhausted")
+                candidates = [self.code_at(n) for n in range(end - self._block, end)]
+            s.commit()
+        taken = self._taken(candidates)
+        return [c for c in candidates if c not in taken]
+
+    def _taken(self, candidates: list[str]) -> set[str]:
+        taken: set[str] = set()
+        for eng in self._shards:
+            with Session(eng) as s:
+                taken.update(s.exec(select(Room.code).where(col(Room.code).in_(candidates))).all())
+        return taken
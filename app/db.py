@@ -1,19 +1,186 @@
+import os
+import zlib
+
 from sqlmodel import SQLModel, create_engine, Session
-from sqlalchemy import event
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+# README の .env と同じ DATABASE_URL を読む（未設定ならローカルの SQLite）
+DB_URL = os.environ.get("DATABASE_URL", "sqlite:///./emoji.db")
+# 部屋をコードのハッシュで複数 DB に振り分ける（カンマ区切り。未設定なら DATABASE_URL の 1 本だけ）
+# 例: DATABASE_SHARDS=sqlite:///./emoji-0.db,sqlite:///./emoji-1.db
+# 一度運用を始めたら並び順・本数は変えないこと（部屋の置き場所が変わる）
+SHARD_URLS = [u.strip() for u in os.environ.get("DATABASE_SHARDS", "").split(",") if u.strip()] or [DB_URL]
+
+# ---- SQLite 本番プロファイル（DB_* で上書き可） ----
+SQLITE_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "WAL")       # 読み手が書き手を待たない
+SQLITE_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")      # WAL なら NORMAL で十分安全
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", "-65536"))   # 負数は KiB 指定（64MiB）
+
+# ---- コネクションプール ----
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))     # Postgres 用
+
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return _is_sqlite(url) and make_url(url).database in (None, "", ":memory:")
 
-DB_URL = "sqlite:///./emoji.db"
-engine = create_engine(DB_URL, connect_args={"check_same_thread": False})
 
-@event.listens_for(engine, "connect")
-def _fk_pragma(dbapi_conn, _):
+def _engine_kwargs(url: str) -> dict:
+    if _is_memory_sqlite(url):
+        # インメモリ DB は接続ごとに別物になるのでプール設定は付けない
+        return {"connect_args": {"check_same_thread": False}}
+    if _is_sqlite(url):
+        return {
+            "connect_args": {
+                "check_same_thread": False,
+                "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+            },
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+        }
+    # Postgres など：同じモデルのまま URL を差し替えるだけで動く
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def _sqlite_pragmas(dbapi_conn, _):
     cur = dbapi_conn.cursor()
     cur.execute("PRAGMA foreign_keys=ON")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cur.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
     cur.close()
 
+
+def make_engine(url: str = DB_URL):
+    eng = create_engine(url, **_engine_kwargs(url))
+    if _is_sqlite(url):
+        event.listen(eng, "connect", _sqlite_pragmas)
+    return eng
+
+
+def async_url(url: str) -> str:
+    """同じ DB を非同期ドライバで開く URL（sqlite → aiosqlite, postgresql → psycopg）。"""
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if backend == "sqlite":
+        return u.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    if backend == "postgresql" and u.get_driver_name() in ("psycopg2", "pg8000"):
+        return u.set(drivername="postgresql+psycopg").render_as_string(hide_password=False)
+    return url
+
+
+def make_async_engine(url: str = DB_URL):
+    eng = create_async_engine(async_url(url), **_engine_kwargs(url))
+    if _is_sqlite(url):
+        event.listen(eng.sync_engine, "connect", _sqlite_pragmas)
+    return eng
+
+
+engines = [make_engine(u) for u in SHARD_URLS]
+# ホットなエンドポイント（async def）用。スレッドプールを経由せずイベントループ上で待つ
+async_engines = [make_async_engine(u) for u in SHARD_URLS]
+# 部屋に紐づかないもの（バスの中継テーブルなど）は先頭のシャードに置く
+engine = engines[0]
+async_engine = async_engines[0]
+
+
+def shard_of(code: str) -> int:
+    # プロセスをまたいで同じ値になるよう hash() ではなく crc32 を使う
+    return zlib.crc32(code.upper().encode()) % len(SHARD_URLS)
+
+
+def engine_for(code: str):
+    return engines[shard_of(code)]
+
+
+def async_engine_for(code: str):
+    return async_engines[shard_of(code)]
+
+
+def async_session(code: str | None = None) -> AsyncSession:
+    # コミット後も属性をそのまま読めるように expire しない
+    eng = async_engine_for(code) if code is not None else async_engine
+    return AsyncSession(eng, expire_on_commit=False)
+
+def insert_or_ignore(eng, model):
+    """主キー・一意制約が重なる行は黙って飛ばす INSERT（SQLite / Postgres の方言で組み立てる）。"""
+    dialect = postgresql if eng.dialect.name == "postgresql" else sqlite
+    return dialect.insert(model).on_conflict_do_nothing()
+
+# 既存の DB ファイルに後から足した列: (table, column, 型の後ろに付ける制約, 追加直後に流す埋め戻し SQL)
+# 型はモデルの列から DB の方言でコンパイルする（SQLite の DATETIME は Postgres では TIMESTAMP）
+_ADDED_COLUMNS = [
+    ("room", "current_round_id", "",
+     "UPDATE room SET current_round_id = "
+     "(SELECT MAX(round.id) FROM round WHERE round.room_code = room.code)"),
+    ("room", "last_activity_at", "",
+     "UPDATE room SET last_activity_at = COALESCE("
+     "(SELECT MAX(round.created_at) FROM round WHERE round.room_code = room.code), room.created_at)"),
+    # 結果まで進んだ部屋の現在ラウンドと、それより前のラウンドは採点済み
+    ("round", "scored_at", "",
+     "UPDATE round SET scored_at = created_at WHERE id NOT IN "
+     "(SELECT current_round_id FROM room WHERE status != 'result' AND current_round_id IS NOT NULL)"),
+    ("room", "member_version", "NOT NULL DEFAULT 0", None),
+    # 既存の結果は参加者を持たない（履歴はヒント・票・加点に出てくる人で組み立てる）
+    ("roundresult", "players", "", None),
+]
+
+def _added_column_ddl(dialect, table: str, column: str, extra: str) -> str:
+    col_type = SQLModel.metadata.tables[table].c[column].type.compile(dialect=dialect)
+    return f"{col_type} {extra}".strip()
+
+def migrate(eng=None) -> None:
+    """
+    create_all は既存テーブルに列や索引を足さないので、ここで追従させる（冪等）。
+    古い emoji.db をそのまま起動しても新しいスキーマになる。
+    """
+    eng = eng or engine
+    insp = inspect(eng)
+    tables = set(insp.get_table_names())
+    with eng.begin() as conn:
+        for table, column, extra, backfill in _ADDED_COLUMNS:
+            if table not in tables:
+                continue
+            if column in {c["name"] for c in insp.get_columns(table)}:
+                continue
+            ddl = _added_column_ddl(eng.dialect, table, column, extra)
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+            if backfill:
+                conn.exec_driver_sql(backfill)
+        for t in SQLModel.metadata.sorted_tables:
+            for idx in t.indexes:
+                idx.create(conn, checkfirst=True)
+
 def init_db() -> None:
     from app import models
-    SQLModel.metadata.create_all(engine)
+    for eng in engines:
+        SQLModel.metadata.create_all(eng)
+        migrate(eng)
+    # 部屋コードのカウンタ行は先に作っておく（複数ワーカーが同時に最初の INSERT をしない）
+    with engine.begin() as conn:
+        conn.execute(insert_or_ignore(engine, models.RoomCodeCounter).values(id=1, next=0))
 
 def get_session():
     with Session(engine) as session:
-        yield session
\ No newline at end of file
+        yield session
@@ -0,0 +1,160 @@
+"""
+絵文字の判定と個数カウント（ヒント入力の検証用）。
+
+許容するコードポイントは import 時に区間表（開始位置でソート・隣接区間はマージ済み）へ
+まとめ、bisect で O(log 区間数) で引く。個数は見た目の1文字＝書記素クラスタ単位で数える：
+  - ZWJ で繋がった並び（👨‍👩‍👧）は 1 個
+  - 肌色修飾（👍🏽）・異体字セレクタ（❤️）・タグ列（🏴󠁧󠁢󠁥󠁮󠁧󠁿）は直前の絵文字に含める
+  - 地域指示子 2 つ（🇯🇵）で国旗 1 個
+  - キーキャップ（1️⃣ / #⃣）は 1 個
+"""
+from __future__ import annotations
+
+from bisect import bisect_right
+from typing import Iterable
+
+MAX_EMOJI = 3
+
+# 許容する「絵文字ベース文字」の範囲
+_EMOJI_BASE_RANGES = [
+    (0x00A9, 0x00A9), (0x00AE, 0x00AE),   # © ®
+    (0x203C, 0x203C), (0x2049, 0x2049),   # ‼ ⁉
+    (0x2122, 0x2122), (0x2139, 0x2139),   # ™ ℹ
+    (0x2194, 0x21AA),    # 矢印
+    (0x2300, 0x23FF),    # Misc Technical（⌚ ⏰ など）
+    (0x24C2, 0x24C2),    # Ⓜ
+    (0x25A0, 0x25FF),    # Geometric Shapes
+    (0x2600, 0x26FF),    # Misc symbols
+    (0x2700, 0x27BF),    # Dingbats
+    (0x2900, 0x297F),    # 補助矢印（⤴ ⤵）
+    (0x2B00, 0x2BFF),    # Arrows 等
+    (0x3030, 0x3030), (0x303D, 0x303D),
+    (0x3297, 0x3297), (0x3299, 0x3299),   # ㊗ ㊙
+    (0x1F000, 0x1F02F),  # 麻雀牌
+    (0x1F0A0, 0x1F0FF),  # トランプ
+    (0x1F100, 0x1F1FF),  # Enclosed Alphanumeric Supplement（地域指示子を含む）
+    (0x1F200, 0x1F2FF),  # Enclosed Ideographic Supplement（🈁 など）
+    (0x1F300, 0x1F5FF),  # Misc Symbols & Pictographs
+    (0x1F600, 0x1F64F),  # Emoticons
+    (0x1F680, 0x1F6FF),  # Transport & Map
+    (0x1F700, 0x1F8FF),  # Alchemical / Geometric Ext / Arrows-C
+    (0x1F900, 0x1F9FF),  # Supplemental Symbols & Pictographs
+    (0x1FA00, 0x1FAFF),  # Chess / Symbols & Pictographs Extended-A
+    (0x1FB00, 0x1FBFF),  # Legacy Computing
+]
+
+_ZWJ = 0x200D
+_VS15, _VS16 = 0xFE0E, 0xFE0F
+_KEYCAP = 0x20E3
+_KEYCAP_BASES = frozenset(map(ord, "#*0123456789"))
+_SKIN_TONE = (0x1F3FB, 0x1F3FF)
+_REGIONAL = (0x1F1E6, 0x1F1FF)
+_TAG = (0xE0020, 0xE007E)
+_TAG_END = 0xE007F
+
+
+def _compile(ranges: Iterable[tuple[int, int]]) -> tuple[list[int], list[int]]:
+    starts: list[int] = []
+    ends: list[int] = []
+    for a, b in sorted(ranges):
+        if ends and a <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], b)
+        else:
+            starts.append(a)
+            ends.append(b)
+    return starts, ends
+
+
+_STARTS, _ENDS = _compile(_EMOJI_BASE_RANGES)
+
+
+def is_emoji_base(cp: int) -> bool:
+    i = bisect_right(_STARTS, cp) - 1
+    return i >= 0 and cp <= _ENDS[i]
+
+
+def _in(cp: int, r: tuple[int, int]) -> bool:
+    return r[0] <= cp <= r[1]
+
+
+class EmojiError(ValueError):
+    pass
+
+
+def count_emoji(s: str) -> int:
+    """
+    s に含まれる絵文字の個数（書記素クラスタ数）を返す。
+    絵文字以外（文字・数字・空白など）が混ざっていたら EmojiError。
+    """
+    cps = [ord(ch) for ch in s]
+    n = len(cps)
+    i = 0
+    count = 0
+    while i < n:
+        cp = cps[i]
+        if _in(cp, _REGIONAL):
+            # 国旗は地域指示子 2 つで 1 個
+            i += 2 if (i + 1 < n and _in(cps[i + 1], _REGIONAL)) else 1
+            count += 1
+            continue
+        if cp in _KEYCAP_BASES:
+            j = i + 1
+            if j < n and cps[j] == _VS16:
+                j += 1
+            if not (j < n and cps[j] == _KEYCAP):
+                raise EmojiError(s)   # 素の数字・記号
+            i = j + 1
+            count += 1
+            continue
+        if not is_emoji_base(cp):
+            raise EmojiError(s)
+        i += 1
+        # 直前の絵文字にくっつく修飾を読み飛ばす
+        while i < n:
+            cp = cps[i]
+            if cp in (_VS15, _VS16) or _in(cp, _SKIN_TONE):
+                i += 1
+            elif _in(cp, _TAG):
+                while i < n and _in(cps[i], _TAG):
+                    i += 1
+                if not (i < n and cps[i] == _TAG_END):
+                    raise EmojiError(s)
+                i += 1
+            elif cp == _ZWJ and i + 1 < n and is_emoji_base(cps[i + 1]) and not _in(cps[i + 1], _REGIONAL):
+                i += 2
+            else:
+                break
+        count += 1
+    return count
+
+
+def validate_emoji_payload(raw: str, max_count: int = MAX_EMOJI) -> str:
+    """
+    入力が「絵文字のみ、かつ最大 max_count 個」であることを検証。
+    返り値は保存用の正規化文字列（前後空白除去のみ）。
+    NG の場合は ValueError を投げる。
+    """
+    s = (raw or "").strip()
+    if not s:
+        raise ValueError("絵文字を入力してください。")
+    try:
+        n = count_emoji(s)
+    except EmojiError:
+        raise ValueError("絵文字のみで入力してください（文字や数字は不可）。") from None
+    if n > max_count:
+        raise ValueError(f"絵文字は最大{max_count}つまでです。")
+    return s
+
+
+def validate_many(payloads: Iterable[str], max_count: int = MAX_EMOJI) -> list[tuple[str | None, str | None]]:
+    """
+    まとめて検証する（お題パックの取り込みなど）。
+    入力順に (正規化後の文字列, None) か (None, エラーメッセージ) を返す。
+    """
+    out: list[tuple[str | None, str | None]] = []
+    for raw in payloads:
+        try:
+            out.append((validate_emoji_payload(raw, max_count), None))
+        except ValueError as e:
+            out.append((None, str(e)))
+    return out
@@ -0,0 +1,81 @@
+"""
+ルーム単位のプッシュ配信（Server-Sent Events）。
+ハンドラは状態を変えたら hub.publish(code, "phase") のように通知するだけ。
+購読側（/rooms/{code}/events）は受け取ったイベントをそのまま SSE で流す。
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+QUEUE_MAX = 32          # 1購読者あたりの未送信イベント上限
+KEEPALIVE_SECONDS = 15  # プロキシに切られないためのコメント送信間隔
+
+
+class RoomHub:
+    def __init__(self) -> None:
+        self._subs: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @asynccontextmanager
+    async def subscribe(self, code: str) -> AsyncIterator[asyncio.Queue]:
+        # 配信はイベントループ上で行うので、最初の購読時にループを覚えておく
+        self._loop = asyncio.get_running_loop()
+        q: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_MAX)
+        with self._lock:
+            self._subs[code].add(q)
+        try:
+            yield q
+        finally:
+            with self._lock:
+                subs = self._subs.get(code)
+                if subs is not None:
+                    subs.discard(q)
+                    if not subs:
+                        del self._subs[code]
+
+    def subscribers(self, code: str) -> int:
+        with self._lock:
+            return len(self._subs.get(code, ()))
+
+    def publish(self, code: str, event: str, data: str = "") -> None:
+        """
+        どのスレッドからでも呼べる（同期ハンドラはスレッドプールで動くため）。
+        購読者がいなければ何もしない。
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(code, event, data)
+        else:
+            loop.call_soon_threadsafe(self._deliver, code, event, data)
+
+    def _deliver(self, code: str, event: str, data: str) -> None:
+        with self._lock:
+            subs = list(self._subs.get(code, ()))
+        item = (event, data)
+        for q in subs:
+            # イベントは「再取得の合図」なので、同じものが未送信なら積まない
+            if item in q._queue:  # type: ignore[attr-defined]
+                continue
+            if q.full():
+                q.get_nowait()  # 遅い購読者は古いものから捨てる
+            q.put_nowait(item)
+
+
+def format_sse(event: str, data: str = "") -> str:
+    lines = (data or event).splitlines() or [""]
+    body = "".join(f"data: {line}\n" for line in lines)
+    return f"event: {event}\n{body}\n"
+
+
+hub = RoomHub()
@@ -0,0 +1,65 @@
+"""
+署名つきの本人情報（「自分は誰か」「ホストか」を DB を引かずに答える）。
+
+create_room / join で (player_id, 部屋コード, ホストか, 名前, 部屋の世代, 参加者 version) に
+署名してセッションに入れておく。書き込み系のハンドラは部屋の行（どうせ読む）の
+member_version・created_at とトークンの値が一致していればトークンをそのまま信用し、
+Player を引き直さない。参加者が増減して version が変わったときだけ DB で確かめ直して発行し直す。
+
+created_at（部屋の世代）も照合するのは、回収した部屋のコードが再利用されるため
+（app/codes.py）。同じコードの新しい部屋に古いトークンを持ち込んでも通らない。
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from datetime import datetime
+
+from itsdangerous import BadSignature, URLSafeSerializer
+
+IDENTITY_SECRET = os.environ.get("IDENTITY_SECRET") or os.environ.get("SESSION_SECRET", "change-me")
+SESSION_KEY = "identity"
+
+_serializer = URLSafeSerializer(IDENTITY_SECRET, salt="emoji-charades.identity")
+
+
+@dataclass(frozen=True, slots=True)
+class Identity:
+    """Player の代わりに使える最小限の本人情報（id / room_code / name / is_host）。"""
+    id: int
+    room_code: str
+    name: str
+    is_host: bool
+    epoch: int        # 部屋の created_at（マイクロ秒）
+    version: int      # 発行時の room.member_version
+
+    def valid_for(self, code: str, epoch: int, version: int) -> bool:
+        return self.room_code == code and self.epoch == epoch and self.version == version
+
+
+def room_epoch(created_at: datetime | None) -> int:
+    if created_at is None:
+        return 0
+    return int(created_at.replace(tzinfo=None).timestamp() * 1_000_000)
+
+
+def issue(session: dict, player, created_at: datetime | None, version: int) -> Identity:
+    """player（Player / PlayerView）の本人情報に署名してセッションに入れる。"""
+    ident = Identity(player.id, player.room_code, player.name, bool(player.is_host),
+                     room_epoch(created_at), version or 0)
+    session[SESSION_KEY] = _serializer.dumps(
+        [ident.id, ident.room_code, ident.name, ident.is_host, ident.epoch, ident.version]
+    )
+    return ident
+
+
+def read(session: dict) -> Identity | None:
+    """署名を確かめて取り出す（無い・壊れている・改ざんされていれば None）。"""
+    token = session.get(SESSION_KEY)
+    if not token:
+        return None
+    try:
+        pid, code, name, is_host, epoch, version = _serializer.loads(token)
+    except (BadSignature, ValueError, TypeError):
+        return None
+    return Identity(int(pid), str(code), str(name), bool(is_host), int(epoch), int(version))
@@ -0,0 +1,341 @@
+"""
+ヒント・投票の書き込みをまとめてコミットする（write-behind / group commit）。
+
+締切間際は部屋の全員が 1 秒ほどの間にヒントや票を送ってくる。1 件ずつ
+セッションを開いてコミットすると SQLite は 1 票ごとに fsync する。そこで、
+  - ハンドラはキャッシュ上の部屋の状態で検証し、ここに積んで（キャッシュにも反映して）すぐ返す
+  - 裏のタスクが最初の 1 件から INGEST_FLUSH_MS 待つか INGEST_MAX_ROWS 件たまった時点で、
+    シャードごとに 1 トランザクション・1 本の複数行 UPSERT で書く
+1 ラウンド 1 人 1 件の一意制約（uq_one_hint_per_round / uq_one_vote_per_round）はそのまま効く。
+同じ人の出し直しはバッファ内で後勝ちに潰してから ON CONFLICT DO UPDATE で上書きする。
+同じラウンドで他人と同じ絵文字は、書き込みのトランザクション内で（部屋の行をロックしてから）
+DB と突き合わせて後着を落とす。ハンドラのキャッシュでの検証は他ワーカーの分を知らない。
+同じトランザクションで部屋のフェーズと現在ラウンドも確かめ、締め切られた後の分は落とす。
+
+締め切る側（lock_hints / close_vote / スケジューラ）は drain(code) でその部屋の
+受け付け済みの分を書き切ってから集計する（受け付け済みの票が集計から漏れない）。
+書き込み中のバッチがあれば終わるまで待つ（シャードごとのロック）。
+複数ワーカーのときは他ワーカーのバッファにも残っているので、バスの request(code, "flush") で
+全ワーカーに drain させ、ack が揃ってから締める（app/bus.py）。
+
+新しいヒントの id は書くまで決まらないので、キャッシュには仮の id（既存より大きい）で入れ、
+書いた後に本物の id で入れ直す。バッチが制約違反（IntegrityError）で失敗したら 1 件ずつ書き直し、
+それでも違反するもの（部屋が回収された等）はログに残して捨てる。ロック待ちの打ち切りなど
+それ以外の失敗では捨てずにバッファへ積み直し、次の周期で書き直す。捨てた分は受け付け時に
+キャッシュへ入れてあるので、その部屋は dropped として返し、呼び出し側でキャッシュを捨てさせる。
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, col, select
+from starlette.concurrency import run_in_threadpool
+
+from app.models import GameStatus, Hint, Room, Vote
+from app.state import HintView, VoteView
+
+log = logging.getLogger(__name__)
+
+FLUSH_MS = float(os.environ.get("INGEST_FLUSH_MS", "50"))
+MAX_ROWS = int(os.environ.get("INGEST_MAX_ROWS", "256"))
+DRAIN_RETRIES = 3
+
+# 書いた結果（コード, 本物の id のヒント, 票, 捨てた分があったか）
+Flushed = list[tuple[str, list[HintView], list[VoteView], bool]]
+
+_provisional_ids = itertools.count(1 << 53)
+
+
+def provisional_hint_id() -> int:
+    """書く前のヒントにキャッシュ上で付ける仮 id（DB の id より大きい＝提出順で後ろに並ぶ）。"""
+    return next(_provisional_ids)
+
+
+def _upsert(eng, model, rows: list[dict], keys: list[str], fields: list[str]):
+    dialect = postgresql if eng.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(model).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=keys, set_={f: getattr(stmt.excluded, f) for f in fields}
+    )
+
+
+class _Shard:
+    def __init__(self) -> None:
+        # (round_id, player_id) -> (code, 絵文字, 受付時刻) / (round_id, voter_id) -> (code, 投票先)
+        self.hints: dict[tuple[int, int], tuple[str, str, datetime]] = {}
+        self.votes: dict[tuple[int, int], tuple[str, int]] = {}
+        self.write_lock = threading.Lock()   # 取り出し〜コミットまで（drain はこれを待つ）
+
+    def __len__(self) -> int:
+        return len(self.hints) + len(self.votes)
+
+
+class IngestBuffer:
+    def __init__(self, engines: list, shard_of: Callable[[str], int],
+                 on_flushed: Callable[[Flushed], None] = lambda flushed: None,
+                 flush_ms: float = FLUSH_MS, max_rows: int = MAX_ROWS) -> None:
+        self._engines = engines
+        self._shard_of = shard_of
+        self._on_flushed = on_flushed
+        self._interval = flush_ms / 1000
+        self._max = max_rows
+        self._shards = [_Shard() for _ in engines]
+        self._lock = threading.Lock()         # バッファ本体
+        self._task: asyncio.Task | None = None
+        self._has_rows: asyncio.Event | None = None
+        self._full: asyncio.Event | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.batches = 0
+        self.rows = 0
+
+    # ---------- 受け付け（イベントループ上から） ----------
+    def add_hint(self, code: str, hint: HintView) -> None:
+        shard = self._shards[self._shard_of(code)]
+        with self._lock:
+            shard.hints[(hint.round_id, hint.player_id)] = (code, hint.content_emoji, datetime.utcnow())
+            n = len(shard)
+        self._wake(n)
+
+    def add_vote(self, code: str, vote: VoteView) -> None:
+        shard = self._shards[self._shard_of(code)]
+        with self._lock:
+            shard.votes[(vote.round_id, vote.voter_id)] = (code, vote.target_player_id)
+            n = len(shard)
+        self._wake(n)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._shards)
+
+    def _wake(self, n: int) -> None:
+        if self._has_rows is None:
+            return
+        self._has_rows.set()
+        if n >= self._max:
+            self._full.set()
+
+    # ---------- 書き出し（スレッドから） ----------
+    def drain(self, code: str) -> Flushed:
+        """code の部屋の分を今すぐ書く（締め切り前に呼ぶ）。他の部屋の分は裏のタスクに任せる。"""
+        i = self._shard_of(code)
+        out = self.flush_shard(i, code)
+        for _ in range(DRAIN_RETRIES):
+            if not self._has(i, code):
+                break
+            # 一時的な失敗で積み直された。締める前にもう一度だけ待って書く
+            time.sleep(self._interval)
+            out += self.flush_shard(i, code)
+        else:
+            if self._has(i, code):
+                log.warning("room %s closing with unwritten submissions still queued", code)
+        return out
+
+    def _has(self, i: int, code: str) -> bool:
+        shard = self._shards[i]
+        with self._lock:
+            return any(row[0] == code for row in shard.hints.values()) or \
+                any(row[0] == code for row in shard.votes.values())
+
+    def flush_shard(self, i: int, code: str | None = None) -> Flushed:
+        shard = self._shards[i]
+        with shard.write_lock:
+            with self._lock:
+                if code is None:
+                    hints, shard.hints = shard.hints, {}
+                    votes, shard.votes = shard.votes, {}
+                else:
+                    hints = {k: v for k, v in shard.hints.items() if v[0] == code}
+                    votes = {k: v for k, v in shard.votes.items() if v[0] == code}
+                    for k in hints:
+                        del shard.hints[k]
+                    for k in votes:
+                        del shard.votes[k]
+            if not (hints or votes):
+                return []
+            return self._write(i, hints, votes)
+
+    def flush_all(self) -> Flushed:
+        out: Flushed = []
+        for i in range(len(self._shards)):
+            out.extend(self.flush_shard(i))
+        return out
+
+    def _write(self, i: int, hints: dict, votes: dict) -> Flushed:
+        eng = self._engines[i]
+        dropped: set[str] = set()
+        written: list = []
+        retry_hints: dict = {}
+        retry_votes: dict = {}
+        try:
+            try:
+                written = self._commit(eng, hints, votes, dropped)
+            except IntegrityError:
+                # 1 件の不整合（回収済みの部屋など）でバッチ全体を落とさないよう 1 件ずつやり直す
+                log.warning("ingest batch of %d rows failed; retrying one by one",
+                            len(hints) + len(votes), exc_info=True)
+                singles = [({k: v}, {}) for k, v in hints.items()] + [({}, {k: v}) for k, v in votes.items()]
+                for h, v in singles:
+                    try:
+                        written += self._commit(eng, h, v, dropped)
+                    except IntegrityError as e:
+                        key, row = next(iter((h or v).items()))
+                        log.warning("ingest dropped %r %r: %s", key, row, e.orig)
+                        dropped.add(row[0])
+                    except Exception:
+                        log.warning("ingest row failed; requeued", exc_info=True)
+                        retry_hints.update(h)
+                        retry_votes.update(v)
+            except Exception:
+                # ロック待ちの打ち切り（database is locked）などの一時的な失敗。受け付け済みなので積み直す
+                log.warning("ingest batch of %d rows failed; requeued",
+                            len(hints) + len(votes), exc_info=True)
+                retry_hints, retry_votes = dict(hints), dict(votes)
+        finally:
+            if retry_hints or retry_votes:
+                self._requeue(i, retry_hints, retry_votes)
+            # 書けず・積み直しもしなかった行（想定外の失敗で途中で抜けた場合も）の部屋はキャッシュを捨てさせる
+            done = ({(h.round_id, h.player_id) for h in written if isinstance(h, HintView)},
+                    {(v.round_id, v.voter_id) for v in written if isinstance(v, VoteView)})
+            for rows, ok, retry in ((hints, done[0], retry_hints), (votes, done[1], retry_votes)):
+                dropped.update(row[0] for k, row in rows.items() if k not in ok and k not in retry)
+        self.batches += 1
+        self.rows += len(hints) + len(votes) - len(retry_hints) - len(retry_votes)
+
+        by_code: dict[str, tuple[list[HintView], list[VoteView]]] = {code: ([], []) for code in dropped}
+        for view in written:
+            if isinstance(view, HintView):
+                code = hints[(view.round_id, view.player_id)][0]
+                by_code.setdefault(code, ([], []))[0].append(view)
+            else:
+                code = votes[(view.round_id, view.voter_id)][0]
+                by_code.setdefault(code, ([], []))[1].append(view)
+        return [(code, h, v, code in dropped) for code, (h, v) in by_code.items()]
+
+    def _requeue(self, i: int, hints: dict, votes: dict) -> None:
+        """書けなかった分をバッファに戻す（その間に出し直された分があればそちらが勝つ）。"""
+        shard = self._shards[i]
+        with self._lock:
+            for k, row in hints.items():
+                shard.hints.setdefault(k, row)
+            for k, row in votes.items():
+                shard.votes.setdefault(k, row)
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake, 0)
+
+    def _commit(self, eng, hints: dict, votes: dict, dropped: set[str]) -> list:
+        """検証して 1 トランザクションで書く。検証で落とした行の部屋はコミットできたら dropped に足す。"""
+        written: list = []
+        rejected: set[str] = set()
+        codes = {row[0] for row in hints.values()} | {row[0] for row in votes.values()}
+        with Session(eng) as s:
+            # 先に部屋の行を更新して書き込みロックを取る。同じ部屋を書く他ワーカーの flush と
+            # 直列になるので、下の重複チェックの後で他人が同じ絵文字を書き込むことはない
+            s.exec(update(Room).where(col(Room.code).in_(codes)).values(last_activity_at=datetime.utcnow()))
+            # 受け付けた後で（他ワーカーで）締め切られた・次のラウンドに進んだ分は書かない
+            phase = {code: (status, rid) for code, status, rid in s.exec(
+                select(Room.code, Room.status, Room.current_round_id).where(col(Room.code).in_(codes))
+            )}
+            hints = self._open(hints, phase, GameStatus.hint, rejected)
+            votes = self._open(votes, phase, GameStatus.vote, rejected)
+            hint_rows = self._accept_hints(s, hints, rejected) if hints else []
+            vote_rows = [{"round_id": r, "voter_id": v, "target_player_id": t}
+                         for (r, v), (_, t) in votes.items()]
+            if hint_rows:
+                stmt = _upsert(eng, Hint, hint_rows, ["round_id", "player_id"], ["content_emoji"])
+                stmt = stmt.returning(Hint.id, Hint.round_id, Hint.player_id, Hint.content_emoji)
+                written += [HintView(*row) for row in s.exec(stmt).all()]
+            if vote_rows:
+                s.exec(_upsert(eng, Vote, vote_rows, ["round_id", "voter_id"], ["target_player_id"]))
+                written += [VoteView(r["round_id"], r["voter_id"], r["target_player_id"]) for r in vote_rows]
+            s.commit()
+        dropped |= rejected
+        return written
+
+    @staticmethod
+    def _open(rows: dict, phase: dict, status: GameStatus, dropped: set[str]) -> dict:
+        out = {}
+        for (round_id, pid), row in rows.items():
+            if phase.get(row[0]) == (status, round_id):
+                out[(round_id, pid)] = row
+            else:
+                log.info("ingest rejected late %s from player %s in room %s", status.value, pid, row[0])
+                dropped.add(row[0])
+        return out
+
+    def _accept_hints(self, s: Session, hints: dict, dropped: set[str]) -> list[dict]:
+        """
+        同じラウンドで他人がすでに使っている絵文字のヒントを落とす（受け付け時の検証は
+        そのワーカーのキャッシュしか見ていない）。DB の分と、このバッチの受付順で先着を優先する。
+        """
+        current: dict[tuple[int, int], str] = {}     # (round_id, player_id) -> 絵文字
+        owner: dict[tuple[int, str], int] = {}       # (round_id, 絵文字) -> player_id
+        for r, p, e in s.exec(select(Hint.round_id, Hint.player_id, Hint.content_emoji)
+                              .where(col(Hint.round_id).in_({r for r, _ in hints}))):
+            current[(r, p)] = e
+            owner[(r, e)] = p
+        rows = []
+        for (r, p), (code, e, at) in sorted(hints.items(), key=lambda kv: kv[1][2]):
+            if owner.get((r, e), p) != p:
+                log.info("ingest rejected duplicate hint %r in room %s", e, code)
+                dropped.add(code)
+                continue
+            old = current.get((r, p))
+            if old is not None:
+                owner.pop((r, old), None)
+            current[(r, p)] = e
+            owner[(r, e)] = p
+            rows.append({"round_id": r, "player_id": p, "content_emoji": e, "created_at": at})
+        return rows
+
+    # ---------- 裏のタスク ----------
+    async def start(self) -> None:
+        if self._task is None:
+            self._has_rows = asyncio.Event()
+            self._full = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 受け付け済みの分は書き切ってから終わる（積み直された分も何度か試す）
+        for _ in range(DRAIN_RETRIES + 1):
+            flushed = await run_in_threadpool(self.flush_all)
+            if flushed:
+                self._on_flushed(flushed)
+            if not self.pending():
+                return
+            await asyncio.sleep(self._interval)
+        log.error("ingest stopped with %d unwritten submissions", self.pending())
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_rows.wait()
+            # 最初の 1 件から flush_ms だけ待って相乗りさせる（max_rows に達したらすぐ）
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self._interval)
+            except asyncio.TimeoutError:
+                pass
+            self._has_rows.clear()
+            self._full.clear()
+            try:
+                flushed = await run_in_threadpool(self.flush_all)
+                if flushed:
+                    self._on_flushed(flushed)
+            except Exception:
+                log.exception("ingest flush failed")
@@ -1,97 +1,108 @@
 from fastapi import FastAPI, Request, Form, HTTPException, Query
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.responses import RedirectResponse, Response, HTMLResponse
+from starlette.responses import RedirectResponse, Response, HTMLResponse, StreamingResponse, PlainTextResponse
 from math import ceil
+import logging
 import os
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from app.db import init_db, engine
-from app.models import Room, Round, Player, GameStatus, Hint, Vote
+from app.db import init_db, engine, engines, engine_for, async_session, shard_of
+from app.models import Room, Round, Player, GameStatus, Hint, Vote, RoundResult
+from app.events import hub, format_sse, KEEPALIVE_SECONDS
+from app.broadcast import Broadcaster
+from app.bus import make_bus
+from app.reaper import RoomReaper
+from app.ingest import IngestBuffer, provisional_hint_id
+from app.codes import CodeAllocator, normalize_code
+from app.identity import Identity, issue as issue_identity, read as read_identity, room_epoch
+from app.scheduler import DeadlineScheduler
+from app.state import room_cache, RoomState, PlayerView, HintView, VoteView
+from app.pages import vote_page_model, result_page_model, history_page_model
+from app.render import templates, fragments, precompile, env as template_env
+from app.topics import topics, DEFAULT_LANG
+from app.metrics import MetricsMiddleware, registry as metrics_registry
+from app.coalesce import SingleFlight
+from app.profiler import ProfilerMiddleware, sampler, token_ok as profile_token_ok
+from app.emoji import validate_emoji_payload
 from starlette.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
 from sqlmodel import Session, select, col
-from sqlalchemy import inspect, func
-import random, string
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import inspect, func, update
+import random
 from collections import Counter
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from collections import Counter
 from typing import Optional
-import re
+from dataclasses import dataclass
+import asyncio
 
 HINT_SECONDS = 120       # ヒント受付 60秒
 VOTE_SECONDS = 60       # 投票 60秒
 WOLF_ESCAPE_POINTS = 3
 CITIZEN_CORRECT_POINTS = 1
 
-# ====================================お題プリセット=====================================
-TOPIC_PAIRS = [
-    ("ラーメン", "つけ麺"),("寿司", "刺身"),("カレー", "ハヤシライス"),
-    ("ピザ", "カルツォーネ"),("ハンバーガー", "ホットドッグ"),("焼肉", "焼き鳥"),
-    ("天ぷら", "フライ"),("たこ焼き", "お好み焼き"),("うどん", "そば"),
-    ("コーヒー", "紅茶"),("パン", "ごはん"),("牛乳", "豆乳"),("リンゴ", "ナシ"),
-    ("イチゴ", "サクランボ"),("猫", "トラ"),("犬", "オオカミ"),("ペンギン", "アザラシ"),
-    ("ゾウ", "サイ"),("キリン", "シマウマ"),("ライオン", "チーター"),("海", "湖"),
-    ("山", "丘"),("砂漠", "サバンナ"),("川", "滝"),("雷", "花火"),("虹", "オーロラ"),
-    ("雪だるま", "スノーボール"),("新幹線", "特急"),("飛行機", "ヘリコプター"),
-    ("自転車", "バイク"),("ロケット", "人工衛星"),("船", "ヨット"),("タクシー", "バス"),
-    ("サッカー", "フットサル"),("野球", "ソフトボール"),("バスケ", "3x3"),
-    ("テニス", "バドミントン"),("スキー", "スノボ"),("将棋", "チェス"),("本屋", "図書館"),
-]
-
-# 許容する「絵文字ベース文字」の範囲
-_EMOJI_BASE_RANGES = [
-    (0x1F600, 0x1F64F),  # Emoticons
-    (0x1F300, 0x1F5FF),  # Misc Symbols & Pictographs
-    (0x1F680, 0x1F6FF),  # Transport & Map
-    (0x1F1E6, 0x1F1FF),  # Regional Indicator (国旗)
-    (0x2600,  0x26FF),   # Misc symbols
-    (0x2700,  0x27BF),   # Dingbats
-    (0x1F900, 0x1F9FF),  # Supplemental Symbols & Pictographs
-    (0x1FA70, 0x1FAFF),  # Symbols & Pictographs Extended-A
-    (0x2B00,  0x2BFF),   # Arrows 等
-    (0x25A0,  0x25FF),   # Geometric Shapes
-]
-
-EMOJI_RE = re.compile(
-    r'^[\u2600-\u27BF\u2300-\u23FF\u2B00-\u2BFF'
-    r'\U0001F000-\U0001F02F\U0001F0A0-\U0001F0FF'
-    r'\U0001F100-\U0001F64F\U0001F680-\U0001F6FF'
-    r'\U0001F700-\U0001F77F\U0001F780-\U0001F7FF'
-    r'\U0001F800-\U0001F8FF\U0001F900-\U0001F9FF'
-    r'\U0001FA00-\U0001FAFF\U0001FB00-\U0001FBFF]+$'
-)
-
-# 許容する修飾（数にカウントしない）
-_ZWJ = "\u200D"
-_VARIATION = "\uFE0F"
-_SKIN_TONES = tuple(chr(c) for c in range(0x1F3FB, 0x1F3FF + 1))
-
 app = FastAPI()
 app.add_middleware(
     SessionMiddleware,
     secret_key=os.environ.get("SESSION_SECRET", "change-me")  # 本番は環境変数で
 )
+app.add_middleware(ProfilerMiddleware)   # /_dev/profile で有効化したときだけ動く
+# 一番外側に置く（セッション処理も含めて計測する）
+app.add_middleware(MetricsMiddleware)
+
+log = logging.getLogger(__name__)
 
 def _now():
     return datetime.utcnow()
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="app/templates")
 
 @app.on_event("startup")
 def on_startup():
     init_db()
+    precompile(template_env)
+    topics.open()
+
+def _on_room_event(code: str, event: str, data: str, remote: bool) -> None:
+    if event == "flush":
+        # 他ワーカーがこの部屋を締める前の頼み：手元の受け付け分を書き切ってから応答する
+        asyncio.get_running_loop().create_task(_flush_for_peer(code, data))
+        return
+    if remote:
+        # 他ワーカーでの変更：手元のキャッシュは古いので捨て、次の読み込みで DB から取り直す
+        room_cache.invalidate(code)
+    hub.publish(code, event, data)
+
+async def _flush_for_peer(code: str, token: str) -> None:
+    try:
+        _on_ingested(await run_in_threadpool(ingest.drain, code))
+    except Exception:
+        log.exception("flush for peer failed for room %s", code)
+    finally:
+        bus.ack(token)
+
+# 部屋の変更通知はここを通す（ROOM_BUS=table なら他ワーカーにも届く）
+bus = make_bus(_on_room_event)
+
+@app.on_event("startup")
+async def start_bus():
+    await bus.start()
+
+@app.on_event("shutdown")
+async def stop_bus():
+    await bus.stop()
 
 @app.get("/")
 def index(req: Request):
-    return templates.TemplateResponse("lobby.html", {"request": req})
+    return templates.TemplateResponse("lobby.html", {"request": req, "languages": topics.languages()})
 
-def _gen_code(n=6):
-    return "".join(random.choices(string.ascii_uppercase + string.digits, k=n))
+# 部屋コードは払い出し器から受け取る（重複しないので作成時の再試行は要らない）
+room_codes = CodeAllocator(engine, engines)
 
 @app.get("/_dev/seed")
 def dev_seed():
-    code = _gen_code()
-    with Session(engine) as session:
+    code = room_codes.allocate()
+    with Session(engine_for(code)) as session:
         room = Room(code=code, status=GameStatus.lobby)
         session.add(room)
         session.commit()
@@ -102,24 +113,68 @@ def dev_seed():
 
 @app.get("/_dev/rooms")
 def dev_rooms():
-    with Session(engine) as session:
-        rows = session.exec(select(Room)).all()
-    return {"rooms": [r.code for r in rows], "count": len(rows)}
+    codes = []
+    for eng in engines:
+        with Session(eng) as session:
+            codes += session.exec(select(Room.code)).all()
+    return {"rooms": codes, "count": len(codes)}
 
 @app.get("/ping")
 def ping():
     return {"pong": True}
 
+@app.get("/metrics")
+async def metrics():
+    # Prometheus のテキスト形式
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+def _require_profile_token(req: Request, token: str | None) -> None:
+    if not profile_token_ok(req.headers.get("X-Profile-Token") or token):
+        # PROFILE_TOKEN 未設定・不一致ともに存在しない扱い
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/_dev/profile")
+def profile_download(req: Request, format: str = Query(default="collapsed"),
+                     limit: int = Query(default=40, ge=1, le=500), token: str | None = Query(default=None)):
+    """溜まったサンプルを返す。format=collapsed（flamegraph 用）/ top / status"""
+    _require_profile_token(req, token)
+    if format == "status":
+        return sampler.status()
+    if format == "top":
+        return PlainTextResponse(sampler.top(limit))
+    return PlainTextResponse(sampler.collapsed(), headers={
+        "Content-Disposition": 'attachment; filename="profile.collapsed.txt"',
+    })
+
+@app.post("/_dev/profile")
+def profile_start(req: Request, rate: float = Query(default=1.0, ge=0, le=1), route: str | None = Query(default=None),
+                  interval_ms: float = Query(default=5, ge=1, le=1000), token: str | None = Query(default=None)):
+    """サンプリング開始（設定の変更も同じ）。route は /rooms/{code}/phase のようなテンプレートで指定"""
+    _require_profile_token(req, token)
+    sampler.start(rate=rate, route=route, interval_ms=interval_ms)
+    return sampler.status()
+
+@app.delete("/_dev/profile")
+def profile_stop(req: Request, reset: bool = Query(default=False), token: str | None = Query(default=None)):
+    _require_profile_token(req, token)
+    sampler.stop()
+    if reset:
+        sampler.reset()
+    return sampler.status()
+
 @app.get("/_dev/tables")
 def list_tables():
     return {"tables": inspect(engine).get_table_names()}
 
 @app.post("/rooms")
-def create_room(req: Request, name: str = Form(...)):
-    code = _gen_code()
-    with Session(engine) as session:
+def create_room(req: Request, name: str = Form(...), lang: str = Form(DEFAULT_LANG)):
+    code = room_codes.allocate()
+    if lang not in topics.languages():
+        lang = DEFAULT_LANG
+    with Session(engine_for(code)) as session:
         # 1) Room を作成→確定
-        room = Room(code=code, status=GameStatus.lobby)
+        room = Room(code=code, status=GameStatus.lobby, lang=lang)
+        created_at = room.created_at   # コミット後に読み直さないよう控えておく
         session.add(room)
         session.commit()
 
@@ -129,10 +184,11 @@ def create_room(req: Request, name: str = Form(...)):
         try:
             session.flush()
             host_id = host.id
+            issue_identity(req.session, host, created_at, 0)
             session.commit()
         except Exception as e:
             session.rollback()
-            print("[create_room] commit error:", repr(e))
+            log.warning("create_room: host insert failed for %s: %r", code, e)
             raise HTTPException(status_code=400, detail="名前が重複しています。別名で再試行してください。")
         
         req.session["user_name"] = name.strip()
@@ -142,10 +198,20 @@ def create_room(req: Request, name: str = Form(...)):
         # 303 リダイレクトで /rooms/{code} へ
         return RedirectResponse(url=f"/rooms/{code}", status_code=303)
     
+def _resolve_join_code(raw: str) -> str:
+    """入力された部屋コードを正規形にする。乱数で作っていた頃の部屋（O / I / L / U を含む）は入力どおり。"""
+    raw = raw.strip().upper()
+    code = normalize_code(raw)
+    if code != raw:
+        with Session(engine_for(code)) as session:
+            if session.get(Room, code) is None:
+                return raw
+    return code
+
 @app.post("/join")
 def join(req: Request, code: str = Form(...), name: str = Form(...)):
-    code = code.strip().upper()
-    with Session(engine) as session:
+    code = _resolve_join_code(code)
+    with Session(engine_for(code)) as session:
         room = session.get(Room, code)
         if not room:
             raise HTTPException(status_code=404, detail="Room not found")
@@ -155,10 +221,15 @@ def join(req: Request, code: str = Form(...), name: str = Form(...)):
         try:
             session.flush()
             player_id = player.id
+            view = PlayerView.of(player)
+            version = _bump_members(session, code)
+            issue_identity(req.session, view, room.created_at, version)
             session.commit()
         except Exception:
             session.rollback()
             raise HTTPException(status_code=400, detail="この部屋に同名の参加者がいます。別名で再試行してください")
+    room_cache.put_player(code, view)
+    bus.publish(code, "players")
     
     # with を出た後は「整数の id」だけを使う（Detached 回避）
     req.session["user_name"] = name.strip()
@@ -170,38 +241,48 @@ def join(req: Request, code: str = Form(...), name: str = Form(...)):
     
 @app.get("/rooms/{code}")
 def room_page(code: str, req: Request):
-    with Session(engine) as session:
-        room = session.get(Room, code)
-        if not room:
-            raise HTTPException(status_code=404, detail="Room not found")
-        players = session.exec(
-            select(Player).where(Player.room_code == code).order_by(Player.id)
-        ).all()
+    room = _room_state_or_404(code)
+    me = _me_in(room, req)
+    is_host = bool(me and me.is_host)
 
-        me = _get_me(session, code, req)
-        is_host = bool(me and me.is_host and me.room_code == code)
-      
     return templates.TemplateResponse("room.html", {
         "request": req,
         "room": room,
-        "players": players,
+        "players": room.player_list(),
         "is_host":is_host,
     })
 
+@dataclass(frozen=True)
+class _Partial:
+    version: int
+    etag: str
+    body: bytes
+    status: str
+
+# 部分テンプレートの応答を (ルート, 部屋) ごとに共有する。同時に来た同じ読み取りは 1 回の読み込み・描画で済ませ、
+# 直後の取得も version が変わっていなければ PARTIAL_COALESCE_TTL 秒まで同じ本文を返す
+partials: SingleFlight[_Partial] = SingleFlight(ttl=float(os.environ.get("PARTIAL_COALESCE_TTL", "0.5")))
+
+async def _shared_partial(name: str, code: str, template: str, context) -> _Partial:
+    async def build() -> _Partial:
+        room = await _aroom_state_or_404(code)
+        # 同じ部屋・同じ version なら描画済みの HTML を使い回す
+        html = fragments.render(template, room, **context(room))
+        return _Partial(room.version, _room_etag(room), html.encode(), room.status_value)
+    return await partials.do((name, code), build,
+                             fresh=lambda p: p.version == room_cache.version_of(code))
+
 @app.get("/rooms/{code}/players")
-def room_players_partial(code: str, req: Request):
-    with Session(engine) as session:
-        room = _get_room_or_404(session, code)
-        players = session.exec(
-            select(Player).where(Player.room_code == code).order_by(Player.id)
-        ).all()
-        status = room.status.value if isinstance(room.status, GameStatus) else str(room.status)
+async def room_players_partial(code: str, req: Request):
+    part = await _shared_partial("players", code, "_players.html",
+                                 lambda room: {"players": room.player_list()})
+    etag = part.etag
+    if _not_modified(req, etag):
+        return _not_modified_response(etag)
+    status = part.status
 
-    resp = templates.TemplateResponse("_players.html", {
-        "request": req,
-        "room"   : room,
-        "players": players,
-    })
+    resp = HTMLResponse(part.body)
+    _set_etag(resp, etag)
 
     #（任意）ロビー中にフェーズが進んだら自動遷移させたい場合だけ付ける
     if status == "hint":
@@ -220,63 +301,132 @@ def _get_room_or_404(session: Session, code: str) -> Room:
         raise HTTPException(status_code=404, detail="Room not found")
     return room
 
-@app.get("/rooms/{code}/hint")
-def hint_page(code: str, req: Request):
-    with Session(engine) as session:
-        room = _get_room_or_404(session, code)
-        # 最新ラウンド取得（今は1ラウンド制なので max(id) でOK）
-        rnd = _latest_round(session, code)
-        if not rnd:
-            # 直接URL叩かれたとき用に救済
-            return RedirectResponse(url=f"/rooms/{code}", status_code=303)
+def _room_state_or_404(code: str) -> RoomState:
+    # 読み取り系はキャッシュから（ミス時のみ DB を読む）
+    room = room_cache.get(code)
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    return room
 
-        players = session.exec(
-            select(Player).where(Player.room_code == code).order_by(Player.id)
-        ).all()
-        hints = session.exec(
-            select(Hint).where(Hint.round_id == rnd.id)
-        ).all()
-        
-        me = _get_me(session, code, req)
-        is_host = bool(me and me.is_host and me.room_code == code)
+# ==================== 条件付き GET（ETag = 部屋の version） ====================
+_BOOT_ID = f"{random.getrandbits(32):08x}"   # 再起動で version が巻き戻っても古い ETag と衝突しない
+
+def _room_etag(room: RoomState, *extra) -> str:
+    tail = "".join(f"-{x}" for x in extra)
+    return f'W/"{_BOOT_ID}-{room.version}{tail}"'
+
+def _not_modified(req: Request, etag: str) -> bool:
+    inm = req.headers.get("if-none-match")
+    if not inm:
+        return False
+    return inm.strip() == "*" or etag in (t.strip() for t in inm.split(","))
+
+def _not_modified_response(etag: str) -> Response:
+    # DB もテンプレートも通さずに返す
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
-        my_topic = None
+def _set_etag(resp: Response, etag: str) -> None:
+    resp.headers["ETag"] = etag
+    # 保存はしてよいが毎回再検証させる（ブラウザが If-None-Match を付けて来る）
+    resp.headers["Cache-Control"] = "no-cache"
+
+async def _aroom_state_or_404(code: str) -> RoomState:
+    # async def のエンドポイント用。キャッシュミス時も aiosqlite で読むのでループを塞がない
+    room = await room_cache.aget(code)
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    return room
+
+def _me_in(room: RoomState, req: Request) -> PlayerView | None:
+    """_get_me のキャッシュ版。この部屋の参加者の中からだけ探す。"""
+    ident = read_identity(req.session)
+    if ident and ident.room_code == room.code and ident.epoch == room_epoch(room.created_at):
+        me = room.players.get(ident.id)
         if me:
-            my_topic = rnd.spy_topic if (rnd.spy_player_id == me.id) else rnd.topic
+            return me
+    pid = req.session.get("player_id")
+    me = room.players.get(pid) if pid else None
+    if not me:
+        name = req.session.get("user_name")
+        if name:
+            me = next((p for p in room.players.values() if p.name == name), None)
+    return me
+
+async def _aroom_and_me(code: str, req: Request) -> tuple[RoomState, PlayerView | None]:
+    """キャッシュ上の部屋と本人。本人が見当たらなければ一度だけ読み直す（他ワーカーで参加した直後など）。"""
+    room = await _aroom_state_or_404(code)
+    me = _me_in(room, req)
+    if me is None:
+        room_cache.invalidate(code)
+        room = await _aroom_state_or_404(code)
+        me = _me_in(room, req)
+    return room, me
+
+async def _ajoin_by_name(code: str, name: str, req: Request) -> PlayerView:
+    """フォームの名前で参加者を探し、いなければその場で参加させる（submit_hint の救済用）。"""
+    async with async_session(code) as session:
+        player = (await session.exec(
+            select(Player).where(Player.room_code == code, Player.name == name)
+        )).first()
+        if player:
+            return PlayerView.of(player)
+        room = await _aget_room_or_404(session, code)
+        player = Player(room_code=code, name=name, is_host=False)
+        session.add(player)
+        await session.flush()
+        joined = PlayerView.of(player)
+        version = await _abump_members(session, code)
+        issue_identity(req.session, joined, room.created_at, version)
+        await session.commit()
+    room_cache.put_player(code, joined)
+    bus.publish(code, "players")
+    req.session["user_name"] = joined.name
+    req.session["room_code"] = code
+    req.session["player_id"] = joined.id
+    return joined
+
+def _my_topic(room: RoomState, me: PlayerView | None) -> str | None:
+    rnd = room.current_round
+    if not (me and rnd):
+        return None
+    return rnd.spy_topic if (rnd.spy_player_id == me.id) else rnd.topic
+
+@app.get("/rooms/{code}/hint")
+def hint_page(code: str, req: Request):
+    room = _room_state_or_404(code)
+    rnd = room.current_round
+    if not rnd:
+        # 直接URL叩かれたとき用に救済
+        return RedirectResponse(url=f"/rooms/{code}", status_code=303)
+
+    me = _me_in(room, req)
+    is_host = bool(me and me.is_host)
 
     return templates.TemplateResponse("hint.html", {
         "request": req,
         "room": room,
         "round": rnd,
-        "players": players,
-        "hints": hints,
+        "players": room.player_list(),
+        "hints": room.hint_list(),
         "me": me,
         "is_host": is_host,
-        "hint_deadline_ms": int(room.hint_deadline.timestamp() * 1000) if room.hint_deadline else 0,
-        "my_topic": my_topic,
+        "hint_deadline_ms": _epoch_ms(room.hint_deadline),
+        "my_topic": _my_topic(room, me),
+        **_clock_context(room),
     })
 
 @app.get("/rooms/{code}/hints")
-def hint_list_partial(code: str, req: Request):
-    with Session(engine) as s:
-        room = _get_room_or_404(s, code)
-        rnd = _latest_round(s, code)
-        hints = []
-        if rnd:
-            hints = s.exec(
-                select(Hint).where(Hint.round_id == rnd.id).order_by(Hint.id)
-            ).all()
-        # ★ status は文字列に確定させてから with を出る
-        status = room.status.value if isinstance(room.status, GameStatus) else str(room.status)
+async def hint_list_partial(code: str, req: Request):
+    part = await _shared_partial("hints", code, "_hints.html",
+                                 lambda room: {"hints": room.hint_list()})
+    etag = part.etag
+    if _not_modified(req, etag):
+        return _not_modified_response(etag)
+    status = part.status
 
     # 部分テンプレを返す
-    resp = templates.TemplateResponse("_hints.html", {
-        "request": req,
-        "room"   : room,  
-        "hints": hints,
-    })
-    # キャッシュ抑止（念のため）
-    resp.headers["Cache-Control"] = "no-store"
+    resp = HTMLResponse(part.body)
+    _set_etag(resp, etag)
     # フェーズが進んでいたら自動遷移（任意）
     if status == "vote":
         resp.headers["HX-Redirect"] = f"/rooms/{code}/vote"
@@ -285,9 +435,43 @@ def hint_list_partial(code: str, req: Request):
     return resp
 
 
-def _get_me(session: Session, code: str, req: Request) -> Player | None:
+def _bump_members(session: Session, code: str) -> int:
+    """参加者が増えたことを記録し、新しい member_version を返す（同時参加でも取りこぼさない）。"""
+    return session.exec(
+        update(Room).where(Room.code == code)
+        .values(member_version=Room.member_version + 1, last_activity_at=_now())
+        .returning(Room.member_version)
+    ).scalar_one()
+
+async def _abump_members(session: AsyncSession, code: str) -> int:
+    return (await session.exec(
+        update(Room).where(Room.code == code)
+        .values(member_version=Room.member_version + 1, last_activity_at=_now())
+        .returning(Room.member_version)
+    )).scalar_one()
+
+def _identity_for(room: Room, req: Request) -> Identity | None:
+    """署名つきトークンが今の部屋（世代・参加者 version）に対して有効なら、それが本人。DB は引かない。"""
+    ident = read_identity(req.session)
+    if ident and ident.valid_for(room.code, room_epoch(room.created_at), room.member_version or 0):
+        return ident
+    return None
+
+def _get_me(session: Session, room: Room, req: Request) -> Identity | None:
+    me = _identity_for(room, req)
+    if me:
+        return me
+    # トークンが無い / 参加者が変わった → DB で確かめ直して発行し直す
+    player = _lookup_me(session, room.code, req)
+    if not player:
+        return None
+    return issue_identity(req.session, player, room.created_at, room.member_version)
+
+def _lookup_me(session: Session, code: str, req: Request) -> Player | None:
     pid = req.session.get("player_id")
     me = session.get(Player, pid) if pid else None
+    if me and me.room_code != code:
+        me = None   # 別の部屋（シャードが違えば別人）の id
     if not me:
         # 保険: 名前で一致を試す（同名対策で room_code も条件に）
         name = req.session.get("user_name")
@@ -297,90 +481,69 @@ def _get_me(session: Session, code: str, req: Request) -> Player | None:
             ).first()
     return me
 
+async def _aget_room_or_404(session: AsyncSession, code: str) -> Room:
+    room = await session.get(Room, code)
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    return room
+
 @app.get("/_dev/whoami")
 def whoami(req: Request):
     return dict(req.session)
 
 @app.get("/rooms/{code}/vote")
 def vote_page(code: str, req: Request):
-    with Session(engine) as s:
-        room = _get_room_or_404(s, code)
-        rnd = _latest_round(s, code)
-        if not rnd:
-            return RedirectResponse(url=f"/rooms/{code}", status_code=303)
-
-        hints = s.exec(select(Hint).where(Hint.round_id == rnd.id)).all()
-        players = s.exec(select(Player).where(Player.room_code == code).order_by(Player.id)).all()
-
-        me = _get_me(s, code, req)
-        me_id = me.id if me else None
-        is_host = bool(me and me.is_host and me.room_code == code)
-
-        # 自分以外を候補にする
-        candidates = s.exec(
-            select(Player)
-            .where(Player.room_code == code, Player.id != me_id)
-            .order_by(Player.id)
-        ).all()
-
-        # この部屋の参加者なら投票できる（ホストも投票可にするならそのまま）
-        can_vote = bool(me and me.room_code == code)
-
-        my_topic = None
-        if me:
-            my_topic = rnd.spy_topic if (rnd.spy_player_id == me.id) else rnd.topic
+    room = _room_state_or_404(code)
+    if not room.current_round:
+        return RedirectResponse(url=f"/rooms/{code}", status_code=303)
 
+    me = _me_in(room, req)
     return templates.TemplateResponse("vote.html", {
         "request": req,
         "room": room,
-        "round": rnd,
-        "players": players,
-        "hints": hints,
-        "is_host": is_host,
-        "me_id": me_id,
-        "candidates": candidates,
-        "can_vote": can_vote,
-        "vote_deadline_ms": int(room.vote_deadline.timestamp() * 1000) if room.vote_deadline else 0,
-        "my_topic": my_topic,
+        "is_host": bool(me and me.is_host),
+        "vote_deadline_ms": _epoch_ms(room.vote_deadline),
+        "my_topic": _my_topic(room, me),
+        **vote_page_model(room, me),
+        **_clock_context(room),
     })
 
     
 @app.post("/rooms/{code}/vote")
-def submit_vote(code: str, req: Request, target_player_id: int = Form(...)):
-    with Session(engine) as session:
-        room = _get_room_or_404(session, code)
-        rnd = _latest_round(session, code)
-        if not rnd:
-            raise HTTPException(status_code=400, detail="round not found")
-        
-        me = _get_me(session, code, req)
-        if not me:
-            raise HTTPException(status_code=403, detail="not joined")
-        
-        # 自分以外に投票（自分投票を禁ずる場合）
-        if target_player_id == me.id:
-            raise HTTPException(status_code=400, detail="cannnot vote for yourself")
-        
-        target = session.get(Player, target_player_id)
-        if not (target and target.room_code == code):
+async def submit_vote(code: str, req: Request, target_player_id: int = Form(...)):
+    # 検証はキャッシュ上の状態で行い、書き込みは ingest がまとめてコミットする
+    room, me = await _aroom_and_me(code, req)
+    rnd = room.current_round
+    if not rnd:
+        raise HTTPException(status_code=400, detail="round not found")
+    if not me:
+        raise HTTPException(status_code=403, detail="not joined")
+    # 締め切った後の票は受け付けない（キャッシュが古くても flush 側で落ちる）
+    if room.status != GameStatus.vote:
+        return RedirectResponse(url=f"/rooms/{code}/{room.status_value}", status_code=303)
+
+    # 自分以外に投票（自分投票を禁ずる場合）
+    if target_player_id == me.id:
+        raise HTTPException(status_code=400, detail="cannnot vote for yourself")
+
+    if target_player_id not in room.players:
+        room_cache.invalidate(code)
+        room = await _aroom_state_or_404(code)
+        if target_player_id not in room.players:
             raise HTTPException(status_code=404, detail="target not found")
-        
-        # 1ラウンド1票
-        existing = session.exec(
-            select(Vote).where(Vote.round_id == rnd.id, Vote.voter_id == me.id)
-        ).first()
-        if existing:
-            existing.target_player_id = target_player_id
-        else:
-            session.add(Vote(round_id=rnd.id, voter_id=me.id, target_player_id=target_player_id))
-        session.commit()
+
+    # 1ラウンド1票（出し直しは上書き）
+    vote = VoteView(round_id=rnd.id, voter_id=me.id, target_player_id=target_player_id)
+    ingest.add_vote(code, vote)
+    room_cache.put_vote(code, vote)
     return RedirectResponse(url=f"/rooms/{code}/vote", status_code=303)
 
 @app.post("/rooms/{code}/close_vote")
 def close_vote(code: str, req: Request):
-    with Session(engine) as s:
+    _drain_ingest(code)
+    with Session(engine_for(code)) as s:
         room = _get_room_or_404(s, code)
-        me = _get_me(s, code, req)
+        me = _get_me(s, room, req)
         if not (me and me.is_host and me.room_code == code):
             raise HTTPException(status_code=403, detail="Only host can close vote")
 
@@ -392,63 +555,51 @@ def close_vote(code: str, req: Request):
         if not rnd:
             raise HTTPException(status_code=400, detail="round not found")
         
-        # ワードウルフ集計
-        _tally_wordwolf_and_apply_scores(s, rnd)
-        room.status = GameStatus.result
+        # ワードウルフ集計（スケジューラと同時でも一度だけ）
+        closed = _close_votes(s, code, rnd)
         s.commit()
+    if closed:
+        scheduler.cancel(code)
+        room_cache.refresh(code)
+        bus.publish(code, "phase", "result")
 
     return RedirectResponse(url=f"/rooms/{code}/result", status_code=303)
 
 @app.get("/rooms/{code}/result")
 def result_page(code: str, req: Request):
-    with Session(engine) as session:
-        room = _get_room_or_404(session, code)
-        rnd = _latest_round(session, code)
-        players = session.exec(select(Player).where(Player.room_code == code).order_by(Player.score.desc(), Player.id)).all()
-        
-        hints = []
-        if rnd:
-            hints = session.exec(
-                select(Hint)
-                .where(Hint.round_id == rnd.id)
-                .order_by(Hint.id)
-            ).all()
-        hints_by_player = {h.player_id: h for h in hints}
-
-        # 今ラウンドの投票一覧（誰が誰に入れたか）とタリー
-        votes = session.exec(
-            select(Vote)
-            .where(Vote.round_id == (rnd.id if rnd else -1))
-        ).all() if rnd else []
-        tally = Counter(v.target_player_id for v in votes)
-
-        me = _get_me(session, code, req)
-        is_host = bool(me and me.is_host and me.room_code == code)
-        spy = session.get(Player, rnd.spy_player_id) if (rnd and rnd.spy_player_id) else None
-
-        # 勝敗判定
-        spy_id = rnd.spy_player_id if rnd else None
-        correct_voters = {v.voter_id for v in votes if v.target_player_id == spy_id}
-        wolf_won = (len(correct_voters) == 0)   # 正解者０ならウルフの勝ち
-
+    room = _room_state_or_404(code)
+    me = _me_in(room, req)
     return templates.TemplateResponse("result.html", {
         "request": req,
         "room": room,
-        "round": rnd,
-        "players": players,
-        "vote": votes,
-        "tally": dict(tally),
-        "is_host": is_host,
-        "spy": spy,
-        "hints_by_player": hints_by_player,
-        "wolf_won": wolf_won,
-        "correct_voters": list(correct_voters)
+        "is_host": bool(me and me.is_host),
+        **result_page_model(room),
+    })
+
+@app.get("/rooms/{code}/history")
+def room_history(code: str, req: Request, limit: int = Query(default=20, ge=1, le=100)):
+    """ラウンドごとの結果（RoundResult を新しい順に）と累計スコアの順位表。"""
+    room = _room_state_or_404(code)
+    with Session(engine_for(code)) as s:
+        results = s.exec(
+            select(RoundResult)
+            .where(RoundResult.room_code == code)
+            .order_by(col(RoundResult.round_id).desc())
+            .limit(limit)
+        ).all()
+    return templates.TemplateResponse("history.html", {
+        "request": req,
+        "room": room,
+        "leaderboard": sorted(room.player_list(), key=lambda p: (-p.score, p.id)),
+        "rounds": history_page_model(room, results),
     })
 
 def _latest_round(session: Session, code: str) -> Round | None:
-    return session.exec(
-        select(Round).where(Round.room_code == code).order_by(col(Round.id).desc())
-    ).first()
+    # Room.current_round_id を辿るだけ（ORDER BY は不要。Room は大抵 identity map に載っている）
+    room = session.get(Room, code)
+    if not (room and room.current_round_id):
+        return None
+    return session.get(Round, room.current_round_id)
 
 def _players_in_room(session: Session, code: str) -> list[Player]:
     return session.exec(
@@ -468,77 +619,182 @@ def _players_in_room(session: Session, code: str) -> list[Player]:
 #         if p:
 #             p.score += int(pts)
 
-def _maybe_autoadvance(session: Session, room: Room):
+def _close_hints(session: Session, code: str, now: datetime) -> bool:
     """
-    部屋のフェーズを締め切り or 全員完了で自動進行させる。
-    HINT_SECONDS / VOTE_SECONDS を使用。
+    hint → vote に進める。状態を条件にした UPDATE なので、
+    スケジューラとホストの lock_hints が競合しても進行は一度だけ。
     """
-    now = _now()
-    rnd = _latest_round(session, room.code)
-    if not rnd:
-        return
-    
-    players = _players_in_room(session, room.code)
-    num_players = len(players)
+    res = session.exec(
+        update(Room)
+        .where(Room.code == code, Room.status == GameStatus.hint)
+        .values(status=GameStatus.vote, vote_deadline=now + timedelta(seconds=VOTE_SECONDS),
+                last_activity_at=now)
+    )
+    return res.rowcount == 1
+
+def _close_votes(session: Session, code: str, rnd: Round) -> bool:
+    """vote → result に進めて集計する（同一トランザクション内で一度だけ）。"""
+    res = session.exec(
+        update(Room)
+        .where(Room.code == code, Room.status == GameStatus.vote)
+        .values(status=GameStatus.result, last_activity_at=_now())
+    )
+    if res.rowcount != 1:
+        return False
+    _tally_wordwolf_and_apply_scores(session, rnd)
+    return True
 
-    # HINT フェーズ：締め切り or 全員提出で VOTE へ
-    if room.status == GameStatus.hint:
-        # デッドライン未設定なら設定（保険）
-        if not room.hint_deadline:
-            room.hint_deadline = now + timedelta(seconds=HINT_SECONDS)
-        
-        # 提出者数
-        submitted = session.exec(
-            select(func.count(Hint.id)).where(Hint.round_id == rnd.id)
-        ).one()
-
-        # 全員提出（２人以上のとき）
-        should_close = (
-            (room.hint_deadline and now >= room.hint_deadline) or
-            (num_players >= 2 and submitted >= num_players)
-        )
+def _advance_due(code: str) -> datetime | None:
+    """
+    スケジューラから呼ばれる。締め切り or 全員完了なら部屋のフェーズを進める。
+    戻り値は次に評価すべき締切（進行が不要になったら None）。
+    """
+    with Session(engine_for(code)) as session:
+        room = session.get(Room, code)
+        if not room:
+            return None
+        now = _now()
+        rnd = _latest_round(session, code)
+        if not rnd:
+            return None
+        num_players = len(_players_in_room(session, code))
 
-        if should_close:
-            room.status = GameStatus.vote
-            room.vote_deadline = now + timedelta(seconds=VOTE_SECONDS)
+        # HINT フェーズ：締め切り or 全員提出で VOTE へ
+        if room.status == GameStatus.hint:
+            # デッドライン未設定なら設定（保険）
+            if not room.hint_deadline:
+                room.hint_deadline = now + timedelta(seconds=HINT_SECONDS)
+                session.commit()
+
+            submitted = session.exec(
+                select(func.count(Hint.id)).where(Hint.round_id == rnd.id)
+            ).one()
+            # 全員提出（２人以上のとき）
+            should_close = (
+                now >= room.hint_deadline or
+                (num_players >= 2 and submitted >= num_players)
+            )
+            if not should_close:
+                return room.hint_deadline
+            # 締めると決まってから、受け付け済みの分を（全ワーカーで）書き切る。
+            # 読み取りのトランザクションは先に閉じる（古いスナップショットのまま書くと SQLite が拒む）
             session.commit()
-            return
-    
-    # VOTE フェーズ：締め切り or 全員投票で RESULT へ（集計も実施）
-    elif room.status == GameStatus.vote:
-        if not room.vote_deadline:
-            room.vote_deadline = now + timedelta(seconds=VOTE_SECONDS)
-        
-        voted = session.exec(
-            select(func.count(func.distinct(Vote.voter_id))).where(Vote.round_id == rnd.id)
-        ).one()
-
-        # 全員提出（２人以上のとき）
-        should_close = (
-            (room.vote_deadline and now >= room.vote_deadline) or
-            (num_players >= 2 and voted >= num_players)
-        )
-    
-        if should_close:
-            # _tally_and_apply_scores(session, rnd.id)
-            _tally_wordwolf_and_apply_scores(session, rnd.id)
-            room.status = GameStatus.result
+            _drain_ingest(code)
+            if _close_hints(session, code, now):
+                session.commit()
+                room_cache.refresh(code)
+                bus.publish(code, "phase", "vote")
+                bus.publish(code, "deadline")
+            session.refresh(room)
+            return room.vote_deadline
+
+        # VOTE フェーズ：締め切り or 全員投票で RESULT へ（集計も実施）
+        if room.status == GameStatus.vote:
+            if not room.vote_deadline:
+                room.vote_deadline = now + timedelta(seconds=VOTE_SECONDS)
+                session.commit()
+
+            voted = session.exec(
+                select(func.count(func.distinct(Vote.voter_id))).where(Vote.round_id == rnd.id)
+            ).one()
+            should_close = (
+                now >= room.vote_deadline or
+                (num_players >= 2 and voted >= num_players)
+            )
+            if not should_close:
+                return room.vote_deadline
             session.commit()
-            return
+            _drain_ingest(code)
+            if _close_votes(session, code, rnd):
+                session.commit()
+                room_cache.refresh(code)
+                bus.publish(code, "phase", "result")
+            return None
+
+    return None
+
+scheduler = DeadlineScheduler(_advance_due, now=_now)
+
+def _active_deadlines() -> list[tuple[str, datetime | None]]:
+    # 再起動時に進行中の部屋を拾い直す
+    out = []
+    for eng in engines:
+        with Session(eng) as s:
+            rooms = s.exec(
+                select(Room).where(col(Room.status).in_([GameStatus.hint, GameStatus.vote]))
+            ).all()
+            out += [
+                (r.code, r.hint_deadline if r.status == GameStatus.hint else r.vote_deadline)
+                for r in rooms
+            ]
+    return out
+
+@app.on_event("startup")
+async def start_scheduler():
+    await scheduler.start(_active_deadlines())
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    await scheduler.stop()
+
+def _on_reaped(codes: list[str]) -> None:
+    for code in codes:
+        scheduler.cancel(code)
+        room_cache.invalidate(code)
+        topics.forget(code)
+
+reaper = RoomReaper(engines, _on_reaped, release=room_codes.release, now=_now)
+
+@app.on_event("startup")
+async def start_reaper():
+    await reaper.start()
+
+@app.on_event("shutdown")
+async def stop_reaper():
+    await reaper.stop()
+
+def _on_ingested(flushed) -> None:
+    # 本物の id で入れ直し（途中でキャッシュが読み直されていても戻る）、コミット済みになってから知らせる
+    for code, hints, votes, dropped in flushed:
+        if dropped:
+            # 書けずに捨てた分が受け付け時にキャッシュへ入っている。DB から読み直させる
+            room_cache.invalidate(code)
+        else:
+            for h in hints:
+                room_cache.put_hint(code, h)
+            for v in votes:
+                room_cache.put_vote(code, v)
+        if hints or dropped:
+            bus.publish(code, "hints")
+        if votes or dropped:
+            # 投票の進み具合（観戦画面・他ワーカーのキャッシュ）向け
+            bus.publish(code, "votes")
+        # 全員提出済みなら締切を待たずに進める（件数は DB で数えるのでコミット後に）
+        scheduler.poke(code)
+
+def _drain_ingest(code: str) -> None:
+    """締める前に、この部屋の受け付け済みヒント・票を全ワーカーで書き切る（スレッドから呼ぶ）。"""
+    _on_ingested(ingest.drain(code))
+    if not bus.request(code, "flush"):
+        log.warning("room %s: closing before every worker confirmed its flush", code)
+
+ingest = IngestBuffer(engines, shard_of, _on_ingested)
+
+@app.on_event("startup")
+async def start_ingest():
+    await ingest.start()
+
+@app.on_event("shutdown")
+async def stop_ingest():
+    await ingest.stop()
 
 @app.get("/rooms/{code}/phase")
-def phase_pulse(code: str, at: str | None = Query(default=None)):
+async def phase_pulse(code: str, at: str | None = Query(default=None)):
     """
     クライアントの現在のフェーズ（at）と部屋の実フェーズが異なるときだけHX-Redirect を返す。
-    呼ばれるたびに _maybe_autoadbance で自動進行も評価。
+    読み取り専用。自動進行は DeadlineScheduler が受け持つ。
     """
-    with Session(engine) as s:
-        room = _get_room_or_404(s, code)
-        # ★ ここで自動更新を評価
-        _maybe_autoadvance(s, room)
-        # 再取得（進んでいるかもしれない）
-        s.refresh(room)
-        status = room.status.value if isinstance(room.status, GameStatus) else str(room.status)
+    status = (await _aroom_state_or_404(code)).status_value
     
     if at and at == status:
         return Response(status_code=204)
@@ -552,11 +808,105 @@ def phase_pulse(code: str, at: str | None = Query(default=None)):
     resp.headers["HX-Redirect"] = targets.get(status, f"/rooms/{code}")
     return resp
 
+@app.get("/rooms/{code}/events")
+async def room_events(code: str, req: Request):
+    """
+    部屋のイベント（phase / players / hints / votes / deadline）を SSE で流す。
+    クライアントは受け取ったら該当パーシャルや /phase を取り直す。
+    """
+    if not await room_cache.aget(code):
+        raise HTTPException(status_code=404, detail="Room not found")
+
+    async def stream():
+        async with hub.subscribe(code) as q:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(q.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await req.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event, data)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",   # nginx のバッファリング抑止
+    })
+
+# ---------- 観戦（Player を作らずに見るだけ） ----------
+def _watch_context(room: RoomState) -> dict:
+    ctx = {
+        "players": room.player_list(),
+        "hints": room.hint_list(),
+        **_clock_context(room),
+        "server_now_ms": "",   # 同じ断片を後から来た観戦者にも配るので、サーバ時刻は入れない
+    }
+    if room.status == GameStatus.result:
+        ctx.update(result_page_model(room))
+    return ctx
+
+async def _render_watch(code: str) -> str | None:
+    room = await room_cache.aget(code)
+    if not room:
+        return None
+    return fragments.render("_watch.html", room, **_watch_context(room))
+
+broadcaster = Broadcaster(hub, _render_watch)
+
+@app.get("/watch")
+async def watch_lookup(code: str = Query(...)):
+    """ロビーの観戦フォーム用。入力されたコードを正規化して観戦ページへ。"""
+    raw = code.strip().upper()
+    for candidate in dict.fromkeys((normalize_code(raw), raw)):
+        if await room_cache.aget(candidate):
+            return RedirectResponse(url=f"/rooms/{candidate}/watch", status_code=303)
+    raise HTTPException(status_code=404, detail="Room not found")
+
+@app.get("/rooms/{code}/watch")
+async def watch_page(code: str, req: Request):
+    """読み取り専用の観戦ページ。閲覧者によって変わる部分が無いので、ページごと (部屋, version) で使い回す。"""
+    room = await _aroom_state_or_404(code)
+    etag = _room_etag(room, "watch")
+    if _not_modified(req, etag):
+        return _not_modified_response(etag)
+    resp = HTMLResponse(fragments.render("watch.html", room, **_watch_context(room)))
+    _set_etag(resp, etag)
+    return resp
+
+@app.get("/rooms/{code}/watch/events")
+async def watch_events(code: str, req: Request):
+    """
+    観戦画面を SSE の state イベントで丸ごと流す。描画は部屋ごとに 1 回（app/broadcast.py）で、
+    ここでは同じフレームを書き出すだけ。
+    """
+    if not await room_cache.aget(code):
+        raise HTTPException(status_code=404, detail="Room not found")
+
+    async def stream():
+        async with broadcaster.watch(code) as ch:
+            yield "retry: 3000\n\n"
+            seen = 0
+            while True:
+                if not await ch.wait(seen, KEEPALIVE_SECONDS):
+                    if await req.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                seen = ch.seq
+                yield ch.frame
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
 @app.post("/rooms/{code}/start")
 def start_game(code: str, req: Request):
-    with Session(engine) as s:
+    with Session(engine_for(code)) as s:
         room = _get_room_or_404(s, code)
-        me = _get_me(s, code, req)
+        me = _get_me(s, room, req)
         if not (me and me.is_host and me.room_code == code):
             raise HTTPException(status_code=403, detail="Only host can start the game")
         
@@ -565,13 +915,17 @@ def start_game(code: str, req: Request):
         room.hint_deadline = _now() + timedelta(seconds=HINT_SECONDS)
         room.vote_deadline = None
         s.commit()
+        scheduler.schedule(code, room.hint_deadline)
+    room_cache.refresh(code)
+    bus.publish(code, "phase", "hint")
+    bus.publish(code, "deadline")
     return RedirectResponse(url=f"/rooms/{code}/hint", status_code=303)
 
 @app.post("/rooms/{code}/next_rounds")
 def next_round(code: str, req: Request):
-    with Session(engine) as s:
+    with Session(engine_for(code)) as s:
         room = _get_room_or_404(s, code)
-        me = _get_me(s, code, req)
+        me = _get_me(s, room, req)
         if not (me and me.is_host and me.room_code == code):
             raise HTTPException(status_code=403, detail="Only host can start the game")
         
@@ -581,24 +935,34 @@ def next_round(code: str, req: Request):
         room.hint_deadline = _now() + timedelta(seconds=HINT_SECONDS)
         room.vote_deadline = None
         s.commit()
+        scheduler.schedule(code, room.hint_deadline)
+    room_cache.refresh(code)
+    bus.publish(code, "phase", "hint")
+    bus.publish(code, "deadline")
     return RedirectResponse(url=f"/rooms/{code}/hint", status_code=303)
 
 @app.post("/rooms/{code}/lock_hints")
 def lock_hints(code: str, req: Request):
-    with Session(engine) as s:
+    _drain_ingest(code)
+    with Session(engine_for(code)) as s:
         room = _get_room_or_404(s, code)
-        me = _get_me(s, code, req)
+        me = _get_me(s, room, req)
         if not (me and me.is_host and me.room_code == code):
             raise HTTPException(status_code=403, detail="Only host can start the game")
     
         if room.status != GameStatus.hint:
             return RedirectResponse(url=f"/rooms/{code}/{room.status.value}", status_code=303)
     
-        # 投票フェーズへ
-        room.status = GameStatus.vote
-        # 自動締め切りを使っている場合はここで期限もセット
-        room.vote_deadline = _now() + timedelta(seconds=VOTE_SECONDS)
+        # 投票フェーズへ（期限もここでセット）
+        closed = _close_hints(s, code, _now())
         s.commit()
+        s.refresh(room)
+        vote_deadline = room.vote_deadline
+    if closed:
+        scheduler.schedule(code, vote_deadline)
+        room_cache.refresh(code)
+        bus.publish(code, "phase", "vote")
+        bus.publish(code, "deadline")
     
     # htmx経由ならHX-Redirect、通常フォームなら303
     if req.headers.get("HX-Request") == "true":
@@ -608,15 +972,14 @@ def lock_hints(code: str, req: Request):
 
 @app.get("/rooms/{code}/timeleft")
 def timeleft(code: str, phase: str = Query(...)):
-    with Session(engine) as s:
-        room = _get_room_or_404(s, code)
-        now = _now()
-        if phase == "hint":
-            dl = room.hint_deadline
-        elif phase == "vote":
-            dl = room.vote_deadline
-        else:
-            raise HTTPException(status_code=400, detail="unknown phase")
+    room = _room_state_or_404(code)
+    now = _now()
+    if phase == "hint":
+        dl = room.hint_deadline
+    elif phase == "vote":
+        dl = room.vote_deadline
+    else:
+        raise HTTPException(status_code=400, detail="unknown phase")
     
     secs = max(0, ceil((dl - now).total_seconds())) if dl else 0
     return HTMLResponse(f'<span id="nountdown" data-phase="{phase}">{secs}</span>')
@@ -634,56 +997,32 @@ def _phase_and_remaining(room: Room) -> tuple[str, int]:
     return status, remaining
 
 @app.get("/rooms/{code}/clock")
-def clock_partial(code: str, req: Request):
-    with Session(engine) as s:
-        room = _get_room_or_404(s, code)
-        if room.status == GameStatus.hint:
-            deadline = room.hint_deadline
-        elif room.status == GameStatus.vote:
-            deadline = room.vote_deadline
-        else:
-            deadline = None
-    
-    remain = max(0, int((deadline - _now()).total_seconds())) if deadline else 0
-    return templates.TemplateResponse("_clock.html",{
-        "request": req,
-        "remain": remain
-    })
-
-def _is_emoji_base(ch: str) -> bool:
-    cp = ord(ch)
-    for a, b in _EMOJI_BASE_RANGES:
-        if a <= cp <= b:
-            return True
-    return False
-
-def _is_emoji_allowed_char(ch: str) -> bool:
-    # ベース or 修飾（ZWJ/VS-16/肌色）
-    return _is_emoji_base(ch) or ch == _ZWJ or ch == _VARIATION or ch in _SKIN_TONES
-
-def validate_emoji_payload(raw: str) -> str:
+async def clock_partial(code: str, req: Request):
     """
-    入力が「絵文字のみ、かつ最大3個」であることを検証。
-    返り値は保存用の正規化文字列（前後空白除去のみ）。
-    NG の場合は ValueError を投げる。
+    カウントダウンの再同期用。ブラウザは締切とサーバ時刻から自分で毎秒減らすので、
+    取りに来るのはページ表示時とフェーズ/締切が変わったとき（SSE）だけ。
+    サーバ時刻を含むので ETag は付けずキャッシュもさせない。
     """
-    s = (raw or "").strip()
-    if not s:
-        raise ValueError("絵文字を入力してください。")
-
-    # すべて許容文字か？
-    if any(not _is_emoji_allowed_char(ch) for ch in s):
-        raise ValueError("絵文字のみで入力してください（文字や数字は不可）。")
+    room = await _aroom_state_or_404(code)
+    resp = templates.TemplateResponse("_clock.html", {
+        "request": req,
+        **_clock_context(room),
+    })
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
 
-    # ベース絵文字（修飾を除いた“個数”）を数える
-    base_count = sum(1 for ch in s if _is_emoji_base(ch))
-    if base_count == 0:
-        raise ValueError("絵文字を入力してください。")
-    if base_count > 3:
-        raise ValueError("絵文字は最大3つまでです。")
+def _epoch_ms(dt: datetime | None) -> int:
+    # DB の日時は naive UTC。timestamp() はローカル時刻扱いになるので UTC を明示する
+    return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000) if dt else 0
 
-    # （簡易）空白や改行は既に除去、保存はそのまま
-    return s
+def _clock_context(room: RoomState) -> dict:
+    deadline = room.deadline
+    now = _now()
+    return {
+        "remain": max(0, int((deadline - now).total_seconds())) if deadline else 0,
+        "deadline_ms": _epoch_ms(deadline),
+        "server_now_ms": _epoch_ms(now),
+    }
 
 def _start_wordwolf_round(session, code: str) -> Round:
     players = session.exec(
@@ -693,9 +1032,14 @@ def _start_wordwolf_round(session, code: str) -> Round:
         raise HTTPException(status_code=400, detail="プレイヤーが足りません")
     
     spy = random.choice(players)
-    
-    # 似たお題ペアを選び、どっちを多数派にするかランダムで入れ替え
-    base, alt = random.choice(TOPIC_PAIRS)
+    room = session.get(Room, code)
+
+    # 部屋の言語のお題辞書から、この部屋でまだ出ていないペアを引く
+    seen = {t for pair in session.exec(
+        select(Round.topic, Round.spy_topic).where(Round.room_code == code)
+    ) for t in pair}
+    base, alt = topics.draw(code, room.lang, seen)
+    # どっちを多数派にするかランダムで入れ替え
     if random.random() < 0.5:
         topic_main, spy_topic = base, alt
     else:
@@ -709,103 +1053,114 @@ def _start_wordwolf_round(session, code: str) -> Round:
     )
 
     session.add(rnd)
+    session.flush()
+    room.current_round_id = rnd.id
+    room.last_activity_at = _now()
     session.commit()
     session.refresh(rnd)
     return rnd
 
-def _is_emoji_only(s: str) -> bool:
-    s = s.strip()
-    if not s:
-        return False
-    # 英数字などが混ざっていたら却下
-    if any(ch.isalnum() for ch in s):
-        return False
-    # 主な絵文字ブロック以外が含まれていたら却下（簡易）
-    return bool(EMOJI_RE.match(s))
-
-def _approx_emoji_count(s: str) -> int:
-    # 簡易カウント（合成は大目に数える可能性あり）
-    return sum(1 for ch in s if not ch.isspace())
-
 @app.post("/rooms/{code}/hint")
-def submit_hint(code: str, req: Request, emoji: str = Form(...), name: Optional[str] = Form(None)):
-    emoji = (emoji or "").strip()
-    if not emoji:
-        raise HTTPException(status_code=400, detail="emoji is required")
-    
-    # ★ バリデーション：絵文字のみ＆最大3つ（簡易）
-    if not _is_emoji_only(emoji):
-        raise HTTPException(status_code=400, detail="絵文字のみで入力してください")
-    if _approx_emoji_count(emoji) > 3:
-        raise HTTPException(status_code=400, detail="絵文字は最大3つまでです")
-    
-    with Session(engine) as session:
-        room = _get_room_or_404(session, code)
-        rnd = _latest_round(session, code)
-        if not rnd:
-            raise HTTPException(status_code=400, detail="round not found")
-        
-        me = _get_me(session, code, req)
-        if me:
-            player = me
-        else:
-            nm = (name or "").strip()
-            if not nm:
-                raise HTTPException(status_code=401, detail="Please join the room first")
-            player = session.exec(
-                select(Player).where(Player.room_code == code, Player.name == nm)
-            ).first()
-            if not player:
-                player = Player(room_code=code, name=nm, is_host=False)
-                session.add(player)
-                session.commit()
-                req.session["user_name"] = player.name
-                req.session["room_code"] = code
-                req.session["player_id"] = player.id
-        
-        # 同一ラウンド・他人のヒント重複禁止
-        dup = session.exec(
-            select(Hint).where(
-                Hint.round_id == rnd.id,
-                Hint.content_emoji == emoji,
-                Hint.player_id != player.id
-            )
-        ).first()
-        if dup:
-            raise HTTPException(status_code=400, detail="その絵文字セットはすでに使われています。")
-        
-        existing = session.exec(
-            select(Hint).where(Hint.round_id == rnd.id, Hint.player_id == player.id)
-        ).first()
-        if existing:
-            existing.content_emoji = emoji
-        else:
-            session.add(Hint(round_id=rnd.id, player_id=player.id, content_emoji=emoji))
-        session.commit()
+async def submit_hint(code: str, req: Request, emoji: str = Form(...), name: Optional[str] = Form(None)):
+    # ★ バリデーション：絵文字のみ＆最大3つ（ZWJ・肌色・国旗は1個として数える）
+    try:
+        emoji = validate_emoji_payload(emoji)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
+    room, me = await _aroom_and_me(code, req)
+    rnd = room.current_round
+    if not rnd:
+        raise HTTPException(status_code=400, detail="round not found")
+
+    if not me:
+        nm = (name or "").strip()
+        if not nm:
+            raise HTTPException(status_code=401, detail="Please join the room first")
+        me = await _ajoin_by_name(code, nm, req)
+
+    # 締め切った後のヒントは受け付けない（キャッシュが古くても flush 側で落ちる）
+    if room.status != GameStatus.hint:
+        target = f"/rooms/{code}/{room.status_value}"
+        if req.headers.get("HX-Request") == "true":
+            return Response(status_code=204, headers={"HX-Redirect": target})
+        return RedirectResponse(url=target, status_code=303)
+
+    # 同一ラウンド・他人のヒント重複禁止（受け付け済みで未コミットの分もキャッシュに入っている）
+    if any(h.content_emoji == emoji and h.player_id != me.id for h in room.hints.values()):
+        raise HTTPException(status_code=400, detail="その絵文字セットはすでに使われています。")
+
+    # 1ラウンド1ヒント（出し直しは上書き。id は書き込み後に本物へ差し替わる）
+    prev = room.hints.get(me.id)
+    hint = HintView(
+        id=prev.id if prev and prev.round_id == rnd.id else provisional_hint_id(),
+        round_id=rnd.id, player_id=me.id, content_emoji=emoji,
+    )
+    ingest.add_hint(code, hint)
+    room_cache.put_hint(code, hint)
+
     if req.headers.get("HX-Request") == "true":
-        return Response(status_code=204, header={"HX-Redirect": f"/rooms/{code}/hint"})
+        return Response(status_code=204, headers={"HX-Redirect": f"/rooms/{code}/hint"})
     return RedirectResponse(url=f"/rooms/{code}/hint", status_code=303)
 
-def _tally_wordwolf_and_apply_scores(session: Session, rnd: Round):
-    votes = session.exec(select(Vote).where(Vote.round_id == rnd.id)).all()
-    if not votes:
-        if rnd.spy_player_id:
-            spy = session.get(Player, rnd.spy_player_id)
-            if spy:
-                spy.score += WOLF_ESCAPE_POINTS
-        return
-    
-    wolves = {rnd.spy_player_id}    # TODO: 複数狼化したら Assignment で置換
-    correct_voters = {v.voter_id for v in votes if v.target_player_id in wolves}
+def _tally_wordwolf_and_apply_scores(session: Session, rnd: Round) -> bool:
+    """
+    集計と加点を SQL でまとめて行い、結果を RoundResult に残す（呼び出し側のトランザクション内）。
+      1) round.scored_at が空のときだけ印を付ける（取れなければ採点済み → 何もしない）
+      2) 今ラウンドの票を 1 回で読む（人数ぶんの行。得票数・正解者はここから出す）
+      3) 加点は 1 本の UPDATE（正解者へ +1、正解者 0 ならウルフへ +3）
+      4) 勝敗・得票・加点・ヒントを RoundResult に 1 行で書く
+    """
+    claimed = session.exec(
+        update(Round)
+        .where(Round.id == rnd.id, col(Round.scored_at).is_(None))
+        .values(scored_at=_now())
+    ).rowcount
+    if claimed != 1:
+        return False
 
-    if correct_voters:
-        for p in session.exec(select(Player).where(Player.id.in_(correct_voters))):
-            p.score += CITIZEN_CORRECT_POINTS
-    
+    spy_id = rnd.spy_player_id    # TODO: 複数狼化したら Assignment で置換
+    votes = session.exec(
+        select(Vote.voter_id, Vote.target_player_id).where(Vote.round_id == rnd.id).order_by(Vote.id)
+    ).all()
+    tally = Counter(t for _, t in votes)
+    correct = [v for v, t in votes if t == spy_id]
+
+    if correct:
+        session.exec(
+            update(Player)
+            .where(col(Player.id).in_(correct))
+            .values(score=Player.score + CITIZEN_CORRECT_POINTS)
+        )
+        deltas = [[v, CITIZEN_CORRECT_POINTS] for v in correct]
+    elif spy_id:
+        # 誰も当てられない（票が無い場合も含む）→ ウルフ +3
+        session.exec(
+            update(Player)
+            .where(Player.id == spy_id)
+            .values(score=Player.score + WOLF_ESCAPE_POINTS)
+        )
+        deltas = [[spy_id, WOLF_ESCAPE_POINTS]]
     else:
-        # 誰も当てられない　→　各狼　+3 （現状は単狼=spy のみ）
-        for p in session.exec(select(Player).where(Player.id.in_(wolves))):
-            p.score += WOLF_ESCAPE_POINTS
-    
-    spy_id = rnd.spy_player_id
+        deltas = []
+
+    hints = session.exec(
+        select(Hint.player_id, Hint.content_emoji).where(Hint.round_id == rnd.id).order_by(Hint.id)
+    ).all()
+    players = session.exec(
+        select(Player.id, Player.name).where(Player.room_code == rnd.room_code).order_by(Player.id)
+    ).all()
+    session.add(RoundResult(
+        round_id=rnd.id,
+        room_code=rnd.room_code,
+        topic=rnd.topic,
+        spy_topic=rnd.spy_topic,
+        spy_player_id=spy_id,
+        wolf_won=not correct,
+        tally=[[pid, n] for pid, n in tally.items()],
+        deltas=deltas,
+        votes=[[v, t] for v, t in votes],
+        hints=[[pid, e] for pid, e in hints],
+        players=[[pid, name] for pid, name in players],
+    ))
+    return True
@@ -0,0 +1,215 @@
+"""
+ルート単位の計測と Prometheus テキスト形式での公開（/metrics）。
+
+  - MetricsMiddleware（ASGI）がリクエストごとに件数・レイテンシ（ヒストグラム）を
+    ルートのテンプレート（/rooms/{code}/phase など）単位で記録する
+  - SQLAlchemy の cursor イベントで DB クエリ数・時間を、Jinja の Template.render で描画時間を
+    いま処理中のリクエストに足し込む（contextvar 経由。スレッドプール・aiosqlite でも引き継がれる）
+  - SLOW_REQUEST_MS を超えたリクエストは発行した SQL ごとログに出す（0 で無効）
+
+リクエスト外（スケジューラ・リーパーなど）のクエリは route="-" として数える。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+MAX_SQL_CAPTURE = 50   # 遅いリクエスト 1 件あたりに覚えておく SQL の上限
+# 接続しっぱなしの SSE。遅いリクエストとしては扱わない
+STREAMING_ROUTES = {"/rooms/{code}/events", "/rooms/{code}/watch/events"}
+
+
+@dataclass
+class RequestStats:
+    db_queries: int = 0
+    db_seconds: float = 0.0
+    render_seconds: float = 0.0
+    capture_sql: bool = False
+    sql: list[tuple[float, str]] = field(default_factory=list)
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # 最後は +Inf
+        self.sum = 0.0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.sum += v
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests: dict[tuple[str, str, int], int] = {}
+        self.latency: dict[tuple[str, str], Histogram] = {}
+        self.queries: dict[str, Histogram] = {}
+        self.db_seconds: dict[str, float] = {}
+        self.render_seconds: dict[str, float] = {}
+        self.background_queries = 0
+        self.background_db_seconds = 0.0
+
+    def observe_request(self, route: str, method: str, status: int,
+                        seconds: float, st: RequestStats) -> None:
+        with self._lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            h = self.latency.get((route, method))
+            if h is None:
+                h = self.latency[(route, method)] = Histogram(BUCKETS)
+            h.observe(seconds)
+            q = self.queries.get(route)
+            if q is None:
+                q = self.queries[route] = Histogram(QUERY_BUCKETS)
+            q.observe(st.db_queries)
+            self.db_seconds[route] = self.db_seconds.get(route, 0.0) + st.db_seconds
+            self.render_seconds[route] = self.render_seconds.get(route, 0.0) + st.render_seconds
+
+    def observe_background_query(self, seconds: float) -> None:
+        with self._lock:
+            self.background_queries += 1
+            self.background_db_seconds += seconds
+
+    def render(self) -> str:
+        out: list[str] = []
+        with self._lock:
+            out.append("# HELP http_requests_total Requests by route template, method and status.")
+            out.append("# TYPE http_requests_total counter")
+            for (route, method, status), n in sorted(self.requests.items()):
+                out.append(f'http_requests_total{{route="{route}",method="{method}",status="{status}"}} {n}')
+            _hist(out, "http_request_duration_seconds", "Request latency.",
+                  {f'route="{r}",method="{m}"': h for (r, m), h in sorted(self.latency.items())})
+            _hist(out, "http_request_db_queries", "DB queries issued per request.",
+                  {f'route="{r}"': h for r, h in sorted(self.queries.items())})
+            out.append("# HELP http_request_db_seconds_total Time spent in DB queries.")
+            out.append("# TYPE http_request_db_seconds_total counter")
+            for r, v in sorted(self.db_seconds.items()):
+                out.append(f'http_request_db_seconds_total{{route="{r}"}} {v:.6f}')
+            out.append(f'http_request_db_seconds_total{{route="-"}} {self.background_db_seconds:.6f}')
+            out.append("# HELP db_queries_background_total DB queries outside any request.")
+            out.append("# TYPE db_queries_background_total counter")
+            out.append(f"db_queries_background_total {self.background_queries}")
+            out.append("# HELP http_request_render_seconds_total Time spent rendering templates.")
+            out.append("# TYPE http_request_render_seconds_total counter")
+            for r, v in sorted(self.render_seconds.items()):
+                out.append(f'http_request_render_seconds_total{{route="{r}"}} {v:.6f}')
+        return "\n".join(out) + "\n"
+
+
+def _hist(out: list[str], name: str, help_: str, series: dict[str, Histogram]) -> None:
+    out.append(f"# HELP {name} {help_}")
+    out.append(f"# TYPE {name} histogram")
+    for labels, h in series.items():
+        acc = 0
+        for bound, n in zip(h.bounds, h.counts):
+            acc += n
+            out.append(f'{name}_bucket{{{labels},le="{bound}"}} {acc}')
+        acc += h.counts[-1]
+        out.append(f'{name}_bucket{{{labels},le="+Inf"}} {acc}')
+        out.append(f"{name}_sum{{{labels}}} {h.sum:.6f}")
+        out.append(f"{name}_count{{{labels}}} {acc}")
+
+
+registry = Registry()
+
+
+# ---------- SQLAlchemy ----------
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    st = _current.get()
+    if st is None:
+        registry.observe_background_query(elapsed)
+        return
+    st.db_queries += 1
+    st.db_seconds += elapsed
+    if st.capture_sql and len(st.sql) < MAX_SQL_CAPTURE:
+        st.sql.append((elapsed, statement))
+
+
+# ---------- Jinja ----------
+class TimedTemplate(Template):
+    """render() の時間をいまのリクエストに足す（include された子は親の時間に含まれる）。"""
+
+    def render(self, *args, **kwargs) -> str:
+        t0 = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            st = _current.get()
+            if st is not None:
+                st.render_seconds += time.perf_counter() - t0
+
+
+# ---------- ASGI ----------
+def _route_of(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path_format", None) or getattr(route, "path", "?")
+    path = scope.get("path", "")
+    if path.startswith("/static/"):
+        return "/static"
+    return "unmatched"   # ラベルの種類を増やさないよう、生のパスは使わない
+
+
+class MetricsMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        st = RequestStats(capture_sql=SLOW_REQUEST_MS > 0)
+        token = _current.set(st)
+        status = 500
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _current.reset(token)
+            route = _route_of(scope)
+            registry.observe_request(route, scope["method"], status, elapsed, st)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS and route not in STREAMING_ROUTES:
+                log.warning(
+                    "slow request %s %s (%s) %.1fms db=%d/%.1fms render=%.1fms\n%s",
+                    scope["method"], scope.get("path"), route, elapsed * 1000,
+                    st.db_queries, st.db_seconds * 1000, st.render_seconds * 1000,
+                    "\n".join(f"  {t * 1000:7.2f}ms  {sql}" for t, sql in st.sql),
+                )
@@ -4,7 +4,7 @@ from enum import Enum
 from typing import Optional
 
 from sqlmodel import SQLModel, Field
-from sqlalchemy import UniqueConstraint     #Unique制約用
+from sqlalchemy import UniqueConstraint, Index, Column, JSON     #Unique制約・複合索引用・JSON列
 
 class GameStatus(str, Enum):
     lobby = "lobby"
@@ -20,6 +20,12 @@ class Room(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     hint_deadline: Optional[datetime] = None
     vote_deadline: Optional[datetime] = None
+    # 最新ラウンドへのポインタ（_start_wordwolf_round が更新）。round.id を指すが循環FKを避けて制約は付けない
+    current_round_id: Optional[int] = None
+    # 最後にフェーズが動いた / 参加者が増えた時刻（app/reaper.py が放置部屋の判定に使う）
+    last_activity_at: Optional[datetime] = Field(default_factory=datetime.utcnow, index=True)
+    # 参加者が増減するたびに +1（app/identity.py のトークンはこれが変わるまで DB を引かずに信用する）
+    member_version: int = 0
 
 class Player(SQLModel, table=True):
     __table_args__ = (
@@ -33,16 +39,21 @@ class Player(SQLModel, table=True):
     connected_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Round(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_round_room_code_id", "room_code", "id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     room_code: str = Field(foreign_key="room.code", index=True)
     topic: str = ""                     # 多数派お題
     spy_topic: str = ""                 # 少数派お題
     spy_player_id: Optional[int] = Field(default=None, foreign_key="player.id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    scored_at: Optional[datetime] = None  # 採点済みの印（二重加点防止）
 
 class Hint(SQLModel, table=True):
     __table_args__ = (
         UniqueConstraint("round_id", "player_id", name="uq_one_hint_per_round"),
+        Index("ix_hint_round_content", "round_id", "content_emoji"),   # 同一ラウンドの重複ヒント検査
     )
     id: Optional[int] = Field(default=None, primary_key=True)
     round_id: int = Field(foreign_key="round.id", index=True)
@@ -53,8 +64,59 @@ class Hint(SQLModel, table=True):
 class Vote(SQLModel, table=True):
     __table_args__ = (
         UniqueConstraint("round_id", "voter_id", name="uq_one_vote_per_round"),
+        Index("ix_vote_round_target", "round_id", "target_player_id"),  # 集計
     )
     id: Optional[int] = Field(default=None, primary_key=True)
     round_id: int = Field(foreign_key="round.id", index=True)
     voter_id: int = Field(foreign_key= "player.id")
     target_player_id: int = Field(foreign_key="player.id")
+
+class RoundResult(SQLModel, table=True):
+    """採点時に書く結果スナップショット（結果ページ・履歴はここを 1 行読むだけ）"""
+    __table_args__ = (
+        Index("ix_roundresult_room_round", "room_code", "round_id"),   # 部屋の履歴（新しい順）
+    )
+    round_id: int = Field(foreign_key="round.id", primary_key=True)
+    room_code: str = Field(foreign_key="room.code")
+    topic: str = ""
+    spy_topic: str = ""
+    spy_player_id: Optional[int] = None
+    wolf_won: bool = False
+    # JSON のキーは文字列になってしまうので [player_id, 値] の組で持つ
+    tally: list = Field(default_factory=list, sa_column=Column(JSON))           # [[target_id, 得票数]]
+    deltas: list = Field(default_factory=list, sa_column=Column(JSON))          # [[player_id, 加点]]
+    votes: list = Field(default_factory=list, sa_column=Column(JSON))           # [[voter_id, target_id]]
+    hints: list = Field(default_factory=list, sa_column=Column(JSON))           # [[player_id, 絵文字]]
+    # 採点時の参加者 [[player_id, 名前]]（後から参加・退出した人で過去のラウンドが変わらないように）
+    players: Optional[list] = Field(default=None, sa_column=Column(JSON))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class RoomEvent(SQLModel, table=True):
+    """ワーカー間のイベント中継（app/bus.py の TableBus）。短期間で消える"""
+    __tablename__ = "room_event"
+    # 受け手は id の続きを読むので、表が空になっても id を使い回さない
+    __table_args__ = {"sqlite_autoincrement": True}
+    id: Optional[int] = Field(default=None, primary_key=True)
+    origin: str                         # 送信元ワーカー
+    room_code: str
+    event: str
+    data: str = ""
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+class BusPeer(SQLModel, table=True):
+    """TableBus で動いているワーカー（心拍が途絶えたら居ないものとみなす）"""
+    __tablename__ = "bus_peer"
+    origin: str = Field(primary_key=True)
+    seen_at: datetime = Field(default_factory=datetime.utcnow)
+
+class RoomCodeCounter(SQLModel, table=True):
+    """部屋コードの払い出し位置（app/codes.py。先頭シャードに 1 行だけ）"""
+    __tablename__ = "room_code_counter"
+    id: int = Field(default=1, primary_key=True)
+    next: int = 0
+
+class FreeRoomCode(SQLModel, table=True):
+    """回収済みの部屋から戻ってきたコード（次の払い出しで優先して使う）"""
+    __tablename__ = "free_room_code"
+    code: str = Field(primary_key=True)
+    freed_at: datetime = Field(default_factory=datetime.utcnow)
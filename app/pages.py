@@ -0,0 +1,95 @@
+"""
+ページ単位の表示モデル。
+RoomState（= 1部屋ぶんのスナップショット、ロードは定数回のクエリ）から、
+テンプレートがそのまま引ける辞書を組み立てる。テンプレート側で
+players | selectattr(...) のような線形探索をしないで済むようにするのが目的。
+"""
+from __future__ import annotations
+
+from collections import Counter
+from typing import Iterable
+
+from app.models import RoundResult
+from app.state import RoomState, PlayerView, VoteView
+
+LEFT_PLAYER = "（退出したプレイヤー）"
+
+
+def vote_page_model(room: RoomState, me: PlayerView | None) -> dict:
+    players = room.player_list()
+    me_id = me.id if me else None
+    return {
+        "round": room.current_round,
+        "players": players,
+        "players_by_id": room.players,
+        "hints": room.hint_list(),
+        "me_id": me_id,
+        # 自分以外を候補にする
+        "candidates": [p for p in players if p.id != me_id],
+        # この部屋の参加者なら投票できる（ホストも投票可）
+        "can_vote": me is not None,
+    }
+
+
+def result_page_model(room: RoomState) -> dict:
+    rnd = room.current_round
+    res = room.result
+    if res is not None:
+        # 採点時に書いた RoundResult をそのまま使う
+        spy_id = res.spy_player_id
+        votes = [VoteView(res.round_id, v, t) for v, t in res.votes]
+        tally = res.tally
+        deltas = res.deltas
+        wolf_won = res.wolf_won
+        correct_voters = {v for v, t in res.votes if t == spy_id}
+    else:
+        # RoundResult 導入前に結果まで進んだラウンドは票から組み立てる（加点表示は無し）
+        spy_id = rnd.spy_player_id if rnd else None
+        votes = list(room.votes.values())
+        tally = dict(Counter(v.target_player_id for v in votes))
+        correct_voters = {v.voter_id for v in votes if v.target_player_id == spy_id}
+        wolf_won = not correct_voters   # 正解者０ならウルフの勝ち
+        deltas = {}
+
+    return {
+        "round": rnd,
+        "players": sorted(room.player_list(), key=lambda p: (-p.score, p.id)),
+        "players_by_id": room.players,
+        "vote": votes,
+        "tally": tally,
+        "deltas": deltas,
+        "spy": room.players.get(spy_id) if spy_id else None,
+        "hints_by_player": room.hints,
+        "wolf_won": wolf_won,
+        "correct_voters": correct_voters,
+    }
+
+
+def history_page_model(room: RoomState, results: Iterable[RoundResult]) -> list[dict]:
+    """
+    履歴の各ラウンドを、その RoundResult に残した参加者・ヒント・得票・加点だけで組み立てる
+    （今の参加者で並べると、後から来た人が昔のラウンドに出て、抜けた人が消える）。
+    """
+    rounds = []
+    for r in results:
+        hints = dict(r.hints)
+        tally = dict(r.tally)
+        deltas = dict(r.deltas)
+        if r.players is not None:
+            names = dict(r.players)
+        else:
+            # 参加者を残す前の結果：このラウンドに出てくる人だけ（名前は今の参加者から引く）
+            ids = set(hints) | set(tally) | set(deltas) | {pid for pair in r.votes for pid in pair}
+            if r.spy_player_id:
+                ids.add(r.spy_player_id)
+            names = {pid: room.players[pid].name if pid in room.players else LEFT_PLAYER
+                     for pid in sorted(ids)}
+        rounds.append({
+            "result": r,
+            "spy_name": names.get(r.spy_player_id, LEFT_PLAYER) if r.spy_player_id else None,
+            "rows": [
+                {"name": name, "hint": hints.get(pid, ""), "votes": tally.get(pid, 0), "delta": deltas.get(pid)}
+                for pid, name in names.items()
+            ],
+        })
+    return rounds
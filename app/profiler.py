@@ -0,0 +1,215 @@
+"""
+稼働中のサーバ向けのサンプリングプロファイラ（既定では無効）。
+
+/_dev/profile で有効化すると、対象になったリクエスト（全体の rate 割合、または route を指定）が
+処理中のあいだだけ、別スレッドが interval ごとに全スレッドのスタックを採る。
+数えるのは、対象リクエストの処理中のスレッドだけ。イベントループのスレッドは
+スタックにそのリクエストの ProfilerMiddleware のフレーム（リクエストごとに別物）があるとき、
+スレッドプールのワーカーはそのルートのエンドポイント関数を実行中のときに数える。
+同時に動いている対象外のルームやルートの処理、バックグラウンドのタスクは混ざらない
+（rate < 1 で同じルートの対象外リクエストが同時に同期ハンドラを動かしていると、そこは見分けられない）。
+待ち状態（selector / Condition.wait / キュー待ち）のスレッドは数えない。
+
+結果は "ルート;外側の関数;…;内側の関数 件数" の collapsed 形式でメモリに溜まり、
+flamegraph.pl や speedscope にそのまま渡せる。?format=top なら自己時間・累積時間の上位を表で返す。
+
+エンドポイントは PROFILE_TOKEN（未設定なら 404）を X-Profile-Token ヘッダか ?token= で渡したときだけ使える。
+"""
+from __future__ import annotations
+
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from itertools import count
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+MAX_DEPTH = 64
+# 接続しっぱなしのルートは route で名指ししたときだけ対象にする
+LONG_LIVED = {"/rooms/{code}/events", "/rooms/{code}/watch/events"}
+
+# 最内フレームがこれらなら「待っているだけ」とみなす
+_IDLE = {
+    ("selectors.py", "select"), ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"), ("thread.py", "_worker"), ("_base.py", "wait"),
+}
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+def token_ok(given: str | None) -> bool:
+    return bool(PROFILE_TOKEN) and given is not None and hmac.compare_digest(given, PROFILE_TOKEN)
+
+
+class StackSampler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.enabled = False
+        self.rate = 1.0
+        self.route: str | None = None
+        self.interval = 0.005
+        self.samples: Counter[str] = Counter()
+        self.sampled_requests = 0
+        self.started_at: float | None = None
+        # rid -> (route, ProfilerMiddleware のフレーム, エンドポイントの code)
+        self._inflight: dict[int, tuple[str, object, object]] = {}
+        self._ids = count(1)
+        self._thread: threading.Thread | None = None
+        self._wake = threading.Event()
+
+    # ---------- 操作 ----------
+    def start(self, rate: float = 1.0, route: str | None = None, interval_ms: float = 5) -> None:
+        with self._lock:
+            self.rate = min(max(rate, 0.0), 1.0)
+            self.route = route or None
+            self.interval = max(interval_ms, 1) / 1000
+            self.enabled = True
+            if self.started_at is None:
+                self.started_at = time.time()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            self.enabled = False
+            self._inflight.clear()
+        self._wake.set()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.samples.clear()
+            self.sampled_requests = 0
+            self.started_at = time.time() if self.enabled else None
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled, "rate": self.rate, "route": self.route,
+                "interval_ms": self.interval * 1000, "sampled_requests": self.sampled_requests,
+                "samples": sum(self.samples.values()), "started_at": self.started_at,
+            }
+
+    # ---------- リクエスト側（ProfilerMiddleware から） ----------
+    def want(self, route: str) -> bool:
+        if not self.enabled:
+            return False
+        if self.route is not None and route != self.route:
+            return False
+        if self.route is None and route in LONG_LIVED:
+            return False
+        return self.rate >= 1.0 or random.random() < self.rate
+
+    def enter(self, route: str, frame=None, endpoint_code=None) -> int:
+        rid = next(self._ids)
+        with self._lock:
+            self._inflight[rid] = (route, frame, endpoint_code)
+            self.sampled_requests += 1
+        self._wake.set()
+        return rid
+
+    def exit(self, rid: int) -> None:
+        with self._lock:
+            self._inflight.pop(rid, None)
+
+    # ---------- サンプリング ----------
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while self.enabled:
+            with self._lock:
+                # フレームは _inflight が参照を持っている間は生きているので id で照合してよい
+                frames = {id(f): route for route, f, _ in self._inflight.values() if f is not None}
+                codes = {c: route for route, _, c in self._inflight.values() if c is not None}
+            if not (frames or codes):
+                self._wake.wait(0.5)
+                self._wake.clear()
+                continue
+            batch = []
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE:
+                    continue
+                # 対象のリクエストを処理中のスレッドだけを、そのルートに数える
+                label = None
+                stack = []
+                f = frame
+                while f is not None:
+                    if label is None:
+                        label = frames.get(id(f)) or codes.get(f.f_code)
+                    if len(stack) < MAX_DEPTH:
+                        stack.append(_frame_name(f.f_code))
+                    f = f.f_back
+                if label is not None:
+                    batch.append(label + ";" + ";".join(reversed(stack)))
+            with self._lock:
+                self.samples.update(batch)
+            time.sleep(self.interval)
+
+    # ---------- 出力 ----------
+    def collapsed(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {n}\n" for stack, n in self.samples.most_common())
+
+    def top(self, limit: int = 40) -> str:
+        own: Counter[str] = Counter()
+        cumulative: Counter[str] = Counter()
+        with self._lock:
+            items = list(self.samples.items())
+        total = sum(n for _, n in items) or 1
+        for stack, n in items:
+            frames = stack.split(";")[1:]
+            if frames:
+                own[frames[-1]] += n
+            for name in set(frames):
+                cumulative[name] += n
+        lines = [f"{'own%':>6} {'cum%':>6}  function", ]
+        for name, n in own.most_common(limit):
+            lines.append(f"{n * 100 / total:6.1f} {cumulative[name] * 100 / total:6.1f}  {name}")
+        lines.append("")
+        lines.append(f"{'cum%':>6}  function (inclusive)")
+        for name, n in cumulative.most_common(limit):
+            lines.append(f"{n * 100 / total:6.1f}  {name}")
+        return "\n".join(lines) + "\n"
+
+
+sampler = StackSampler()
+
+
+class ProfilerMiddleware:
+    """有効なときだけルートを解決して対象リクエストを sampler に登録する。"""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    def _route_of(self, scope) -> tuple[str, object]:
+        """(ルートのテンプレート, エンドポイント関数の code)。"""
+        from starlette.routing import Match
+        router = scope["app"].router
+        for route in router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                endpoint = getattr(route, "endpoint", None)
+                return (getattr(route, "path_format", None) or getattr(route, "path", "?"),
+                        getattr(endpoint, "__code__", None))
+        return "unmatched", None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not sampler.enabled:
+            await self.app(scope, receive, send)
+            return
+        route, endpoint_code = self._route_of(scope)
+        if route.startswith("/_dev/profile") or not sampler.want(route):
+            await self.app(scope, receive, send)
+            return
+        rid = sampler.enter(route, sys._getframe(), endpoint_code)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            sampler.exit(rid)
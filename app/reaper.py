@@ -0,0 +1,194 @@
+"""
+放置された部屋の回収。
+COALESCE(last_activity_at, created_at) が ROOM_TTL_SECONDS より古い部屋を探し、
+終わったラウンド（ヒント・投票つき）を追記専用のアーカイブに書き出してから
+round_result → vote → hint → round → player → room の順に消す。
+
+削除は REAPER_BATCH 部屋ずつ短いトランザクションに分け、チャンクの間で手を離すので
+同じ DB で進行中のゲームの書き込みを長く待たせない。
+アーカイブは 1 部屋 1 行の JSON を gzip メンバーとして追記する（zcat でそのまま読める）。
+書き出し後・削除前に落ちた部屋は次回もう一度書き出されるので、読む側は code で重複を除くこと。
+消した部屋のコードは release で払い出し器（app/codes.py）に戻し、新しい部屋で再利用する。
+"""
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Iterable
+
+from sqlalchemy import delete, func
+from sqlmodel import Session, col, select
+from starlette.concurrency import run_in_threadpool
+
+from app.models import Room, Round, RoundResult, Player, Hint, Vote, GameStatus
+
+log = logging.getLogger(__name__)
+
+TTL_SECONDS = int(os.environ.get("ROOM_TTL_SECONDS", str(6 * 3600)))
+INTERVAL_SECONDS = int(os.environ.get("REAPER_INTERVAL_SECONDS", "300"))
+BATCH = int(os.environ.get("REAPER_BATCH", "50"))
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "./archive")
+CHUNK_PAUSE = 0.05   # チャンク間で他の書き込みに譲る秒数
+
+
+def _last_activity():
+    return func.coalesce(Room.last_activity_at, Room.created_at)
+
+
+def _iso(dt: datetime | None) -> str | None:
+    return dt.isoformat(timespec="seconds") if dt else None
+
+
+def idle_codes(session: Session, cutoff: datetime, limit: int) -> list[str]:
+    return session.exec(
+        select(Room.code).where(_last_activity() < cutoff).order_by(_last_activity()).limit(limit)
+    ).all()
+
+
+def export_rooms(session: Session, codes: list[str]) -> list[dict]:
+    """部屋ごとに参加者と終わったラウンドをまとめる（部屋数によらずクエリ 5 本）。"""
+    rooms = session.exec(select(Room).where(col(Room.code).in_(codes))).all()
+    players = session.exec(select(Player).where(col(Player.room_code).in_(codes))).all()
+    rounds = session.exec(
+        select(Round).where(col(Round.room_code).in_(codes)).order_by(Round.id)
+    ).all()
+    round_ids = [r.id for r in rounds]
+    hints = session.exec(select(Hint).where(col(Hint.round_id).in_(round_ids)).order_by(Hint.id)).all()
+    votes = session.exec(select(Vote).where(col(Vote.round_id).in_(round_ids))).all()
+
+    rooms_by_code = {room.code: room for room in rooms}
+    out: dict[str, dict] = {}
+    for room in rooms:
+        out[room.code] = {
+            "code": room.code,
+            "lang": room.lang,
+            "created_at": _iso(room.created_at),
+            "last_activity_at": _iso(room.last_activity_at),
+            "players": [],
+            "rounds": [],
+        }
+    for p in players:
+        out[p.room_code]["players"].append([p.id, p.name, p.is_host, p.score])
+    by_round: dict[int, dict] = {}
+    for r in rounds:
+        room = rooms_by_code[r.room_code]
+        # 結果まで行っていない現在ラウンドは残さない
+        if r.id == room.current_round_id and room.status != GameStatus.result:
+            continue
+        by_round[r.id] = {
+            "id": r.id, "topic": r.topic, "spy_topic": r.spy_topic,
+            "spy": r.spy_player_id, "at": _iso(r.created_at),
+            "hints": [], "votes": [],
+        }
+        out[r.room_code]["rounds"].append(by_round[r.id])
+    for h in hints:
+        if h.round_id in by_round:
+            by_round[h.round_id]["hints"].append([h.player_id, h.content_emoji])
+    for v in votes:
+        if v.round_id in by_round:
+            by_round[v.round_id]["votes"].append([v.voter_id, v.target_player_id])
+    return list(out.values())
+
+
+def append_archive(records: Iterable[dict], directory: str = ARCHIVE_DIR,
+                   now: datetime | None = None) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"rooms-{(now or datetime.utcnow()):%Y%m%d}.jsonl.gz")
+    body = "".join(
+        json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records
+    ).encode()
+    with open(path, "ab") as f:
+        f.write(gzip.compress(body))
+        f.flush()
+        os.fsync(f.fileno())
+    return path
+
+
+def delete_rooms(session: Session, codes: list[str], cutoff: datetime) -> list[str]:
+    """
+    codes のうち、まだ放置のままの部屋だけ消す（書き出し中に誰か戻ってきた部屋は残す）。
+    呼び出し側で commit すること。
+    """
+    codes = session.exec(
+        select(Room.code).where(col(Room.code).in_(codes), _last_activity() < cutoff)
+    ).all()
+    if not codes:
+        return []
+    rounds = select(Round.id).where(col(Round.room_code).in_(codes))
+    session.exec(delete(RoundResult).where(col(RoundResult.room_code).in_(codes)))
+    session.exec(delete(Vote).where(col(Vote.round_id).in_(rounds)))
+    session.exec(delete(Hint).where(col(Hint.round_id).in_(rounds)))
+    session.exec(delete(Round).where(col(Round.room_code).in_(codes)))
+    session.exec(delete(Player).where(col(Player.room_code).in_(codes)))
+    session.exec(delete(Room).where(col(Room.code).in_(codes)))
+    return list(codes)
+
+
+def reap_chunk(eng, cutoff: datetime, batch: int = BATCH, directory: str = ARCHIVE_DIR) -> list[str]:
+    """1 チャンク分を書き出して消す。消した部屋コードを返す（空なら終わり）。"""
+    with Session(eng) as s:
+        codes = idle_codes(s, cutoff, batch)
+        if not codes:
+            return []
+        append_archive(export_rooms(s, codes), directory)
+        removed = delete_rooms(s, codes, cutoff)
+        s.commit()
+    return removed
+
+
+class RoomReaper:
+    def __init__(self, engines: list, on_reaped: Callable[[list[str]], None] = lambda codes: None,
+                 release: Callable[[list[str]], None] = lambda codes: None,
+                 ttl: float = TTL_SECONDS, interval: float = INTERVAL_SECONDS,
+                 batch: int = BATCH, directory: str = ARCHIVE_DIR,
+                 now: Callable[[], datetime] = datetime.utcnow) -> None:
+        self._engines = engines
+        self._on_reaped = on_reaped
+        self._release = release   # 消した部屋のコードを返す（DB に書くのでスレッドプールで呼ぶ）
+        self._ttl = ttl
+        self._interval = interval
+        self._batch = batch
+        self._dir = directory
+        self._now = now
+        self._task: asyncio.Task | None = None
+
+    async def run_once(self) -> int:
+        cutoff = self._now() - timedelta(seconds=self._ttl)
+        total = 0
+        for eng in self._engines:
+            while True:
+                removed = await run_in_threadpool(reap_chunk, eng, cutoff, self._batch, self._dir)
+                if not removed:
+                    break
+                total += len(removed)
+                self._on_reaped(removed)
+                await run_in_threadpool(self._release, removed)
+                await asyncio.sleep(CHUNK_PAUSE)
+        if total:
+            log.info("reaped %d idle rooms", total)
+        return total
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                log.exception("room reaper failed")
+            await asyncio.sleep(self._interval)
+
+    async def start(self) -> None:
+        if self._ttl > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
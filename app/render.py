@@ -0,0 +1,87 @@
+"""
+テンプレートの事前コンパイルと部分テンプレートの断片キャッシュ。
+
+  - 起動時に app/templates 以下を全部コンパイルしておく（初回リクエストでのコンパイル待ちを無くす）。
+    コンパイル結果はバイトコードとしてディスクにも置くので、再起動・ワーカー追加時は読み込むだけ。
+  - _players.html / _hints.html のように「部屋の状態だけで決まる」部分テンプレートは
+    (テンプレート名, 部屋コード, version) をキーに描画結果を覚えておく。
+    同じ部屋を見ている 8 人が続けて取りに来ても描画は 1 回で済む。
+    version は書き込みのたびに変わるので、古い描画結果は自然に使われなくなる（LRU で追い出す）。
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from app.metrics import TimedTemplate
+from app.state import RoomState
+
+TEMPLATE_DIR = "app/templates"
+BYTECODE_DIR = os.environ.get("TEMPLATE_CACHE_DIR", ".jinja_cache")
+# 開発中にテンプレートを編集しながら動かすなら 1（更新日時を毎回確認する）
+AUTO_RELOAD = os.environ.get("TEMPLATE_AUTO_RELOAD", "0") == "1"
+FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", "2048"))
+
+
+def make_env(directory: str = TEMPLATE_DIR, bytecode_dir: str = BYTECODE_DIR) -> Environment:
+    os.makedirs(bytecode_dir, exist_ok=True)
+    env = Environment(
+        loader=FileSystemLoader(directory),
+        autoescape=True,
+        auto_reload=AUTO_RELOAD,
+        bytecode_cache=FileSystemBytecodeCache(bytecode_dir),
+        cache_size=-1,   # コンパイル済みテンプレートは追い出さない（数は固定）
+    )
+    env.template_class = TimedTemplate   # 描画時間を /metrics に出す
+    return env
+
+
+def precompile(env: Environment) -> int:
+    """全テンプレートを読み込んでおく。返り値は件数。"""
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+class FragmentCache:
+    def __init__(self, env: Environment, maxsize: int = FRAGMENT_CACHE_SIZE) -> None:
+        self._env = env
+        self._max = maxsize
+        self._entries: OrderedDict[tuple[str, str, int], str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, name: str, room: RoomState, **context) -> str:
+        """
+        room の状態だけで決まる部分テンプレートを描画する。
+        context は room から組み立てたもの（閲覧者ごとに変わる値を渡さないこと）。
+        """
+        key = (name, room.code, room.version)
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+        html = self._env.get_template(name).render(room=room, **context)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max:
+                self._entries.popitem(last=False)
+        return html
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+env = make_env()
+templates = Jinja2Templates(env=env)
+fragments = FragmentCache(env)
@@ -0,0 +1,127 @@
+"""
+締切スケジューラ。
+Room.hint_deadline / Room.vote_deadline をヒープで管理し、締切が来た部屋
+（または poke された部屋）についてだけフェーズ進行を評価する。
+ポーリングのたびに評価していた頃と違い、評価回数はクライアント数ではなく部屋数に比例する。
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+log = logging.getLogger(__name__)
+
+# advance(code) はフェーズ進行を評価し、次に見るべき締切（無ければ None）を返す
+AdvanceFn = Callable[[str], Optional[datetime]]
+
+
+class DeadlineScheduler:
+    def __init__(self, advance: AdvanceFn, now: Callable[[], datetime] = datetime.utcnow) -> None:
+        self._advance = advance
+        self._now = now
+        self._heap: list[tuple[datetime, str]] = []
+        self._due: dict[str, datetime] = {}   # code -> 有効な締切（ヒープ上の古い要素はこれと照合して捨てる）
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    # ---------- 登録（どのスレッドからでも可） ----------
+    def schedule(self, code: str, deadline: datetime | None) -> None:
+        if deadline is None:
+            self.cancel(code)
+            return
+        with self._lock:
+            self._due[code] = deadline
+            heapq.heappush(self._heap, (deadline, code))
+        self._notify()
+
+    def poke(self, code: str) -> None:
+        """全員提出などで「今すぐ評価してほしい」ときに呼ぶ。"""
+        self.schedule(code, self._now())
+
+    def cancel(self, code: str) -> None:
+        with self._lock:
+            self._due.pop(code, None)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._due)
+
+    def _notify(self) -> None:
+        loop, wake = self._loop, self._wake
+        if loop is None or wake is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            wake.set()
+        else:
+            loop.call_soon_threadsafe(wake.set)
+
+    # ---------- 実行 ----------
+    def _pop_due(self) -> tuple[list[str], float | None]:
+        """締切を過ぎた部屋コードと、次の締切までの秒数を返す。"""
+        now = self._now()
+        due: list[str] = []
+        with self._lock:
+            while self._heap:
+                dl, code = self._heap[0]
+                if self._due.get(code) != dl:
+                    heapq.heappop(self._heap)   # 上書き済み・取消済み
+                    continue
+                if dl > now:
+                    return due, (dl - now).total_seconds()
+                heapq.heappop(self._heap)
+                del self._due[code]
+                due.append(code)
+        return due, None
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            # 先に clear しておけば、評価中に入った schedule/poke を取りこぼさない
+            self._wake.clear()
+            due, wait = self._pop_due()
+            for code in due:
+                try:
+                    nxt = await run_in_threadpool(self._advance, code)
+                except Exception:
+                    log.exception("advance failed for room %s", code)
+                    continue
+                if nxt is not None:
+                    with self._lock:
+                        known = self._due.get(code)
+                    # 処理中に別の締切/poke が入っていればそちらを優先
+                    if known is None:
+                        self.schedule(code, nxt)
+            if due:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, initial: Iterable[tuple[str, datetime | None]] = ()) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        for code, dl in initial:
+            self.schedule(code, dl or self._now())
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
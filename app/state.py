@@ -0,0 +1,362 @@
+"""
+プロセス内のルーム状態キャッシュ。
+部屋のフェーズ・締切・現在ラウンド・参加者・ヒント・投票を保持し、
+ポーリング系のエンドポイントは SQLite に触れずにここから答える。
+
+書き込み系ハンドラは DB コミット後に put_* / refresh で反映（write-through）する。
+put_* にはコミット前（flush 後）に作ったビューを渡す（コミット後の ORM は expire 済みのため）。
+しばらく参照されない部屋は追い出す。
+
+書き込みのたびに部屋の version が単調増加する（ETag 用）。値はプロセス全体の
+カウンタから払い出すので、追い出し→再読み込みをしても過去の値と衝突しない。
+"""
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from sqlmodel import Session, select
+from sqlalchemy import and_
+
+from app.coalesce import SingleFlight
+from app.db import engine_for, async_session
+from app.models import Room, Round, RoundResult, Player, Hint, Vote, GameStatus
+
+IDLE_SECONDS = int(os.environ.get("ROOM_CACHE_IDLE_SECONDS", "600"))
+# 複数ワーカーで動かす場合、他ワーカーの書き込みを拾うために鮮度の上限を設ける（0 = 無期限）
+MAX_AGE_SECONDS = float(os.environ.get("ROOM_CACHE_MAX_AGE", "0"))
+SWEEP_INTERVAL = 30
+
+
+@dataclass(frozen=True)
+class PlayerView:
+    id: int
+    room_code: str
+    name: str
+    is_host: bool
+    score: int
+
+    @classmethod
+    def of(cls, p: Player) -> "PlayerView":
+        return cls(id=p.id, room_code=p.room_code, name=p.name, is_host=p.is_host, score=p.score)
+
+
+@dataclass(frozen=True)
+class RoundView:
+    id: int
+    topic: str
+    spy_topic: str
+    spy_player_id: Optional[int]
+
+    @classmethod
+    def of(cls, r: Round) -> "RoundView":
+        return cls(id=r.id, topic=r.topic, spy_topic=r.spy_topic, spy_player_id=r.spy_player_id)
+
+
+@dataclass(frozen=True)
+class HintView:
+    id: int
+    round_id: int
+    player_id: int
+    content_emoji: str
+
+    @classmethod
+    def of(cls, h: Hint) -> "HintView":
+        return cls(id=h.id, round_id=h.round_id, player_id=h.player_id, content_emoji=h.content_emoji)
+
+
+@dataclass(frozen=True)
+class VoteView:
+    round_id: int
+    voter_id: int
+    target_player_id: int
+
+    @classmethod
+    def of(cls, v: Vote) -> "VoteView":
+        return cls(round_id=v.round_id, voter_id=v.voter_id, target_player_id=v.target_player_id)
+
+
+@dataclass(frozen=True)
+class RoundResultView:
+    round_id: int
+    spy_player_id: Optional[int]
+    wolf_won: bool
+    tally: dict[int, int]                    # target_id -> 得票数
+    deltas: dict[int, int]                   # player_id -> 加点
+    votes: tuple[tuple[int, int], ...]       # (voter_id, target_id)
+    hints: tuple[tuple[int, str], ...]       # (player_id, 絵文字)
+
+    @classmethod
+    def of(cls, r: RoundResult) -> "RoundResultView":
+        return cls(
+            round_id=r.round_id, spy_player_id=r.spy_player_id, wolf_won=r.wolf_won,
+            tally={pid: n for pid, n in r.tally}, deltas={pid: d for pid, d in r.deltas},
+            votes=tuple((v, t) for v, t in r.votes), hints=tuple((pid, e) for pid, e in r.hints),
+        )
+
+
+@dataclass
+class RoomState:
+    """テンプレートには room としてそのまま渡せる（code / status / 締切を持つ）。"""
+    code: str
+    status: GameStatus
+    round: int
+    lang: str
+    hint_deadline: Optional[datetime]
+    vote_deadline: Optional[datetime]
+    created_at: Optional[datetime] = None                          # 部屋の世代（コードは再利用される）
+    current_round: Optional[RoundView] = None
+    result: Optional[RoundResultView] = None                       # 現在ラウンドが採点済みなら
+    players: dict[int, PlayerView] = field(default_factory=dict)   # id 昇順
+    hints: dict[int, HintView] = field(default_factory=dict)       # player_id -> 今ラウンドのヒント（id 昇順）
+    votes: dict[int, VoteView] = field(default_factory=dict)       # voter_id -> 今ラウンドの票
+    version: int = 0
+    loaded_at: float = field(default_factory=time.monotonic)
+    touched_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def status_value(self) -> str:
+        return self.status.value if isinstance(self.status, GameStatus) else str(self.status)
+
+    @property
+    def deadline(self) -> Optional[datetime]:
+        if self.status == GameStatus.hint:
+            return self.hint_deadline
+        if self.status == GameStatus.vote:
+            return self.vote_deadline
+        return None
+
+    def player_list(self) -> list[PlayerView]:
+        return list(self.players.values())
+
+    def hint_list(self) -> list[HintView]:
+        return sorted(self.hints.values(), key=lambda h: h.id)
+
+
+def load_room_state(session: Session, code: str) -> RoomState | None:
+    """
+    1部屋ぶんを2クエリで読む。
+      1) room ⟕ 現在ラウンド ⟕ その結果
+      2) player ⟕ 今ラウンドのヒント ⟕ 今ラウンドの票（1人1ヒント・1票なので行数 = 参加者数）
+    """
+    row = session.exec(
+        select(Room, Round, RoundResult)
+        .outerjoin(Round, Round.id == Room.current_round_id)
+        .outerjoin(RoundResult, RoundResult.round_id == Room.current_round_id)
+        .where(Room.code == code)
+    ).first()
+    if not row:
+        return None
+    room, rnd, res = row
+    state = RoomState(
+        code=room.code,
+        status=room.status,
+        round=room.round,
+        lang=room.lang,
+        hint_deadline=room.hint_deadline,
+        vote_deadline=room.vote_deadline,
+        created_at=room.created_at,
+        current_round=RoundView.of(rnd) if rnd else None,
+        result=RoundResultView.of(res) if res else None,
+    )
+    if rnd:
+        rows = session.exec(
+            select(Player, Hint, Vote)
+            .outerjoin(Hint, and_(Hint.player_id == Player.id, Hint.round_id == rnd.id))
+            .outerjoin(Vote, and_(Vote.voter_id == Player.id, Vote.round_id == rnd.id))
+            .where(Player.room_code == code)
+            .order_by(Player.id)
+        ).all()
+    else:
+        rows = [(p, None, None) for p in session.exec(
+            select(Player).where(Player.room_code == code).order_by(Player.id)
+        )]
+    hints = []
+    for p, h, v in rows:
+        state.players[p.id] = PlayerView.of(p)
+        if h:
+            hints.append(HintView.of(h))
+        if v:
+            state.votes[v.voter_id] = VoteView.of(v)
+    state.hints = {h.player_id: h for h in sorted(hints, key=lambda h: h.id)}
+    return state
+
+
+def _load(code: str) -> RoomState | None:
+    with Session(engine_for(code)) as s:
+        return load_room_state(s, code)
+
+
+async def _aload(code: str) -> RoomState | None:
+    # 同じローダを AsyncSession 上で動かす（run_sync は同期 Session を渡してくれる）
+    async with async_session(code) as s:
+        return await s.run_sync(load_room_state, code)
+
+
+class RoomCache:
+    def __init__(self, loader: Callable[[str], RoomState | None] = _load,
+                 aloader: Callable[[str], Awaitable[RoomState | None]] = _aload,
+                 idle_seconds: float = IDLE_SECONDS, max_age: float = MAX_AGE_SECONDS) -> None:
+        self._loader = loader
+        self._aloader = aloader
+        self._idle = idle_seconds
+        self._max_age = max_age
+        self._entries: dict[str, RoomState] = {}
+        # 部屋ごとの書き込み世代（= version）。読み込み中に書き込みが入ったら、その読み込み結果は捨てる
+        self._seq: dict[str, int] = {}
+        self._loading: dict[str, int] = {}   # 読み込み中の本数（その間は _seq を消さない）
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._aloads: SingleFlight[RoomState | None] = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _hit(self, code: str) -> RoomState | None:
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        with self._lock:
+            st = self._entries.get(code)
+            if st and not (self._max_age and now - st.loaded_at > self._max_age):
+                st.touched_at = now
+                return st
+        return None
+
+    def get(self, code: str) -> RoomState | None:
+        return self._hit(code) or self._fill(code)
+
+    async def aget(self, code: str) -> RoomState | None:
+        """get の async 版。ミス時の読み込みもイベントループをブロックしない。"""
+        st = self._hit(code)
+        if st:
+            return st
+        # 同じ部屋の読み込みが実行中なら相乗りする（ミス時の DB 読み込みは部屋ごとに 1 本）
+        return await self._aloads.do(code, lambda: self._afill(code))
+
+    async def _afill(self, code: str) -> RoomState | None:
+        self._loads(code, +1)
+        try:
+            for _ in range(3):
+                seq0 = self._seq_of(code)
+                st = await self._aloader(code)
+                if self._store(code, seq0, st):
+                    return st
+            return self._uncached(await self._aloader(code))
+        finally:
+            self._loads(code, -1)
+
+    def _fill(self, code: str) -> RoomState | None:
+        self._loads(code, +1)
+        try:
+            for _ in range(3):
+                seq0 = self._seq_of(code)
+                st = self._loader(code)
+                if self._store(code, seq0, st):
+                    return st
+            return self._uncached(self._loader(code))   # 書き込みが続いている部屋はキャッシュせずに返す
+        finally:
+            self._loads(code, -1)
+
+    def _uncached(self, st: RoomState | None) -> RoomState | None:
+        # キャッシュしない読み込み結果にも使われていない version を付ける
+        # （0 のままだと断片キャッシュのキーや ETag が他の読み込み結果と重なる）
+        if st is not None:
+            with self._lock:
+                st.version = next(self._counter)
+        return st
+
+    def _loads(self, code: str, delta: int) -> None:
+        with self._lock:
+            n = self._loading.get(code, 0) + delta
+            if n:
+                self._loading[code] = n
+            else:
+                self._loading.pop(code, None)
+
+    def version_of(self, code: str) -> int:
+        """いまの version（読み込み済みでなければ 0）。DB には触れない。"""
+        return self._seq_of(code)
+
+    def _seq_of(self, code: str) -> int:
+        with self._lock:
+            return self._seq.get(code, 0)
+
+    def _store(self, code: str, seq0: int, st: RoomState | None) -> bool:
+        with self._lock:
+            if self._seq.get(code, 0) != seq0:
+                return False   # 読み込み中に書き込みがあった → 読み直し
+            if st is None:
+                self._entries.pop(code, None)
+            else:
+                st.version = self._seq.setdefault(code, next(self._counter))
+                self._entries[code] = st
+            return True
+
+    def _bump(self, code: str) -> RoomState | None:
+        # 呼び出し側で self._lock を保持していること
+        v = self._seq[code] = next(self._counter)
+        st = self._entries.get(code)
+        if st:
+            st.version = v
+        return st
+
+    # ---------- write-through ----------
+    # 読み手はロック無しで dict を走査するので、更新は差し替え（copy-on-write）で行う
+    def put_player(self, code: str, player: PlayerView) -> None:
+        with self._lock:
+            st = self._bump(code)
+            if st:
+                st.players = dict(sorted({**st.players, player.id: player}.items()))
+
+    def put_hint(self, code: str, hint: HintView) -> None:
+        with self._lock:
+            st = self._bump(code)
+            if st and st.current_round and st.current_round.id == hint.round_id:
+                st.hints = {**st.hints, hint.player_id: hint}
+
+    def put_vote(self, code: str, vote: VoteView) -> None:
+        with self._lock:
+            st = self._bump(code)
+            if st and st.current_round and st.current_round.id == vote.round_id:
+                st.votes = {**st.votes, vote.voter_id: vote}
+
+    def refresh(self, code: str) -> RoomState | None:
+        """フェーズ変更・スコア反映など、まとめて変わるときは DB から読み直す。"""
+        with self._lock:
+            self._bump(code)
+            self._entries.pop(code, None)
+        return self._fill(code)
+
+    def invalidate(self, code: str) -> None:
+        with self._lock:
+            self._bump(code)
+            self._entries.pop(code, None)
+
+    # ---------- 追い出し ----------
+    def _maybe_sweep(self, now: float) -> None:
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        self.evict_idle(now)
+
+    def evict_idle(self, now: float | None = None) -> int:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            idle = [c for c, st in self._entries.items() if now - st.touched_at > self._idle]
+            for c in idle:
+                del self._entries[c]
+                self._seq.pop(c, None)
+            # キャッシュに無い部屋への invalidate / put_* でも _seq は作られる（回収した部屋など）。
+            # 読み込み中でなければ世代を覚えておく必要は無い
+            for c in [c for c in self._seq if c not in self._entries and c not in self._loading]:
+                del self._seq[c]
+        return len(idle)
+
+
+room_cache = RoomCache()
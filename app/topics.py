@@ -0,0 +1,254 @@
+"""
+お題辞書。
+app/topic_packs/<lang>.tsv（category, difficulty, topic, spy_topic のタブ区切り。# はコメント）を
+言語ごとのパックとして読み込み、部屋ごとに重複なしで引く。
+
+  - TSV 本体は mmap で開くだけ。行頭オフセットの索引は (category, difficulty) ごとに並べて
+    サイドカー <pack>.tsv.idx に書き出し、次回からはそれも mmap する。
+    起動時に読むのはヘッダ（バケット数ぶん）だけなので、パックが何万行あっても起動時間・メモリは増えない。
+    索引は TSV のサイズ・更新日時が変わったら作り直す（書けない場所ならメモリ上に作る）。
+  - 1 回の抽選は O(バケット数)：バケットを「重み × 残り枚数」で選び、その中から
+    疎な Fisher–Yates（引いた位置だけ dict に覚える）で 1 枚引く。
+  - 山札は部屋ごと（言語が変わったら作り直す）。引き切ったら作り直す（そこから先は重複あり）。
+    ワーカー再起動や別ワーカーで山札が無い場合に備え、呼び出し側は部屋の既出お題を seen で渡す。
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import random
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+
+TOPIC_DIR = os.environ.get("TOPIC_DIR", "app/topic_packs")
+DEFAULT_LANG = "ja"
+MAX_ROOMS = 10000   # 山札を覚えておく部屋数（LRU）
+_MAGIC = "TPX1"
+
+
+def _parse_weights(spec: str) -> dict[str, float]:
+    # "food=2,sport=0.5" → {"food": 2.0, "sport": 0.5}
+    out: dict[str, float] = {}
+    for part in spec.split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            out[k.strip()] = float(v)
+    return out
+
+
+# 既定はすべて 1（= 残っているペアから一様）
+CATEGORY_WEIGHTS = _parse_weights(os.environ.get("TOPIC_CATEGORY_WEIGHTS", ""))
+DIFFICULTY_WEIGHTS = _parse_weights(os.environ.get("TOPIC_DIFFICULTY_WEIGHTS", ""))
+
+
+@dataclass(frozen=True)
+class Bucket:
+    category: str
+    difficulty: int
+    start: int    # 索引上の先頭位置
+    count: int
+
+
+def build_index(path: str) -> tuple[list[Bucket], array]:
+    """TSV を 1 回なめて、バケットごとにまとめた行頭オフセットを作る。"""
+    groups: dict[tuple[str, int], array] = {}
+    off = 0
+    with open(path, "rb") as f:
+        for line in f:
+            s = line.strip()
+            if s and not s.startswith(b"#"):
+                parts = s.split(b"\t")
+                if len(parts) >= 4:
+                    key = (parts[0].decode(), int(parts[1]))
+                    groups.setdefault(key, array("Q")).append(off)
+            off += len(line)
+    buckets: list[Bucket] = []
+    offsets = array("Q")
+    for (cat, diff), offs in sorted(groups.items()):
+        buckets.append(Bucket(cat, diff, len(offsets), len(offs)))
+        offsets.extend(offs)
+    return buckets, offsets
+
+
+def _source_stamp(path: str) -> dict:
+    st = os.stat(path)
+    return {"magic": _MAGIC, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "order": sys.byteorder}
+
+
+def write_index(path: str, buckets: list[Bucket], offsets: array) -> None:
+    header = {**_source_stamp(path),
+              "buckets": [[b.category, b.difficulty, b.start, b.count] for b in buckets]}
+    head = json.dumps(header, ensure_ascii=False).encode()
+    # オフセット配列を 8 バイト境界から始める
+    head += b" " * (-(len(head) + 1) % 8) + b"\n"
+    tmp = f"{path}.idx.tmp"
+    with open(tmp, "wb") as f:
+        f.write(head)
+        f.write(offsets.tobytes())
+    os.replace(tmp, f"{path}.idx")
+
+
+class TopicPack:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lang = os.path.basename(path).split(".", 1)[0]
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._idx_file = None
+        self._idx_mm: mmap.mmap | None = None
+        self.buckets, self._offsets = self._open_index()
+
+    def _open_index(self) -> tuple[list[Bucket], "memoryview | array"]:
+        idx = f"{self.path}.idx"
+        stamp = _source_stamp(self.path)
+        try:
+            f = open(idx, "rb")
+        except FileNotFoundError:
+            f = None
+        if f is not None:
+            head = f.readline()
+            header = json.loads(head)
+            if all(header.get(k) == v for k, v in stamp.items()):
+                self._idx_file = f
+                self._idx_mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                buckets = [Bucket(c, d, s, n) for c, d, s, n in header["buckets"]]
+                return buckets, memoryview(self._idx_mm)[len(head):].cast("Q")
+            f.close()
+        buckets, offsets = build_index(self.path)
+        try:
+            write_index(self.path, buckets, offsets)
+        except OSError:
+            return buckets, offsets   # 書けない場所ならメモリ上の索引で動かす
+        return self._open_index()
+
+    def __len__(self) -> int:
+        return sum(b.count for b in self.buckets)
+
+    def pair(self, i: int) -> tuple[str, str]:
+        """索引上の i 番目のペア (topic, spy_topic)。"""
+        off = self._offsets[i]
+        end = self._mm.find(b"\n", off)
+        line = self._mm[off:end if end >= 0 else len(self._mm)].decode().rstrip("\r")
+        _, _, topic, spy_topic = line.split("\t")[:4]
+        return topic, spy_topic
+
+    def close(self) -> None:
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        if self._idx_mm is not None:
+            self._idx_mm.close()
+            self._idx_file.close()
+        self._mm.close()
+        self._file.close()
+
+
+class _Deck:
+    """1 バケットぶんの山札。引いた位置の入れ替えだけを覚える疎な Fisher–Yates。"""
+    __slots__ = ("drawn", "swaps")
+
+    def __init__(self) -> None:
+        self.drawn = 0
+        self.swaps: dict[int, int] = {}
+
+    def draw(self, n: int, rng: random.Random) -> int:
+        r = rng.randrange(self.drawn, n)
+        picked = self.swaps.get(r, r)
+        self.swaps[r] = self.swaps.pop(self.drawn, self.drawn)
+        self.drawn += 1
+        return picked
+
+
+class TopicDictionary:
+    def __init__(self, directory: str = TOPIC_DIR,
+                 category_weights: dict[str, float] | None = None,
+                 difficulty_weights: dict[str, float] | None = None,
+                 max_rooms: int = MAX_ROOMS) -> None:
+        self._dir = directory
+        self._cat_w = CATEGORY_WEIGHTS if category_weights is None else category_weights
+        self._diff_w = DIFFICULTY_WEIGHTS if difficulty_weights is None else difficulty_weights
+        self._max_rooms = max_rooms
+        self._packs: dict[str, TopicPack] = {}
+        self._decks: OrderedDict[str, tuple[str, list[_Deck]]] = OrderedDict()   # code -> (lang, 山札)
+        self._lock = threading.Lock()
+
+    def open(self) -> int:
+        """ディレクトリ内のパックを全部開く（起動時）。返り値はペアの総数。"""
+        for name in sorted(os.listdir(self._dir)):
+            if name.endswith(".tsv"):
+                self.pack(name[:-4])
+        return sum(len(p) for p in self._packs.values())
+
+    def languages(self) -> list[str]:
+        return sorted(self._packs)
+
+    def pack(self, lang: str) -> TopicPack:
+        if not lang.isalnum():
+            lang = DEFAULT_LANG   # Room.lang はファイル名に使うので英数字だけ
+        with self._lock:
+            p = self._packs.get(lang)
+            if p is None:
+                path = os.path.join(self._dir, f"{lang}.tsv")
+                if not os.path.exists(path):
+                    if lang == DEFAULT_LANG:
+                        raise FileNotFoundError(path)
+                    p = None
+                else:
+                    p = self._packs[lang] = TopicPack(path)
+        return p if p is not None else self.pack(DEFAULT_LANG)
+
+    def _weight(self, b: Bucket) -> float:
+        return self._cat_w.get(b.category, 1.0) * self._diff_w.get(str(b.difficulty), 1.0)
+
+    def draw(self, code: str, lang: str = DEFAULT_LANG, seen: set[str] | frozenset[str] = frozenset(),
+             rng: random.Random | None = None) -> tuple[str, str]:
+        """
+        部屋 code 用に 1 ペア引く (topic, spy_topic)。
+        seen（この部屋で出たお題）に含まれるペアは飛ばす。
+        """
+        rng = rng or random
+        pack = self.pack(lang)
+        with self._lock:
+            entry = self._decks.get(code)
+            if entry is None or entry[0] != pack.lang:
+                entry = self._decks[code] = (pack.lang, [_Deck() for _ in pack.buckets])
+                while len(self._decks) > self._max_rooms:
+                    self._decks.popitem(last=False)
+            self._decks.move_to_end(code)
+            decks = entry[1]
+
+            refilled = False
+            while True:
+                weights = [self._weight(b) * (b.count - d.drawn) for b, d in zip(pack.buckets, decks)]
+                total = sum(weights)
+                if total <= 0:
+                    if refilled or not len(pack):
+                        raise LookupError(f"no topics available for {pack.lang!r}")
+                    # 引き切った（または重み 0 のバケットしか残っていない）→ 山札を作り直す
+                    decks[:] = [_Deck() for _ in pack.buckets]
+                    if not any(self._weight(b) > 0 for b in pack.buckets):
+                        raise LookupError(f"all topic weights are zero for {pack.lang!r}")
+                    refilled, seen = True, frozenset()
+                    continue
+                x = rng.random() * total
+                for i, w in enumerate(weights):
+                    x -= w
+                    if x < 0 and w > 0:
+                        break
+                else:
+                    i = max(range(len(weights)), key=weights.__getitem__)
+                b = pack.buckets[i]
+                topic, spy_topic = pack.pair(b.start + decks[i].draw(b.count, rng))
+                if topic in seen or spy_topic in seen:
+                    continue
+                return topic, spy_topic
+
+    def forget(self, code: str) -> None:
+        with self._lock:
+            self._decks.pop(code, None)
+
+
+topics = TopicDictionary()
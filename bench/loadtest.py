@@ -0,0 +1,349 @@
+"""
+負荷試験ハーネス：N 部屋 × M 人で実際のゲーム進行を再現し、ルートごとのレイテンシを測る。
+
+    # アプリをプロセス内（ASGI 直結）で動かす。DB は一時ファイル
+    python -m bench.loadtest --rooms 20 --players 8 --rounds 2 --out bench_result.json
+
+    # 起動済みの uvicorn に対して
+    python -m bench.loadtest --base-url http://127.0.0.1:8000 --rooms 5
+
+クライアントの振る舞いはテンプレートの htmx 設定をなぞる：
+  --cadence current  いまのテンプレート（SSE イベントで取り直し＋低頻度フォールバック）
+  --cadence legacy   旧テンプレート（players 1s / phase 2s / hints 2s / clock 1s のポーリング）
+結果は route ごとの p50/p95/p99・件数・エラー数、全体の req/s、ロックエラー数を JSON で書き出す。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import httpx
+
+# 各ページで htmx が張るポーリング（path の {code} は部屋コード）: (path, 間隔秒)
+CADENCES: dict[str, dict[str, list[tuple[str, float]]]] = {
+    "legacy": {
+        "lobby": [("/rooms/{code}/players", 1), ("/rooms/{code}/phase?at=lobby", 2)],
+        "hint": [("/rooms/{code}/hints", 2), ("/rooms/{code}/clock", 1), ("/rooms/{code}/phase?at=hint", 2)],
+        "vote": [("/rooms/{code}/phase?at=vote", 2), ("/rooms/{code}/clock", 1), ("/rooms/{code}/phase?at=vote", 2)],
+        "result": [],
+    },
+    "current": {
+        "lobby": [("/rooms/{code}/players", 15), ("/rooms/{code}/phase?at=lobby", 10)],
+        "hint": [("/rooms/{code}/hints", 15), ("/rooms/{code}/phase?at=hint", 10)],
+        "vote": [("/rooms/{code}/phase?at=vote", 10)],
+        "result": [("/rooms/{code}/phase?at=result", 10)],
+    },
+}
+# current で SSE イベントを受けたときに htmx が取り直すもの
+ON_EVENT = {
+    "lobby": {"players": ["/rooms/{code}/players"], "phase": ["/rooms/{code}/phase?at=lobby"]},
+    "hint": {"hints": ["/rooms/{code}/hints"], "deadline": ["/rooms/{code}/clock"],
+             "phase": ["/rooms/{code}/phase?at=hint", "/rooms/{code}/clock"]},
+    "vote": {"deadline": ["/rooms/{code}/clock"],
+             "phase": ["/rooms/{code}/phase?at=vote", "/rooms/{code}/clock"]},
+    "result": {"phase": ["/rooms/{code}/phase?at=result"]},
+}
+
+PALETTE = list("🍜🍣🍛🍕🍔🍗🍤🐙🍝🍞☕🍵🥛🍎🍐🍓🍒🐱🐯🐶🐺🐧🦭🐘🦏🦒🦓🦁🐆🌊🏔🏜🌋🌈🌌⛄🚄✈🚁🚲")
+
+_CODE_RE = re.compile(r"^/rooms/[^/?]+")
+
+
+def route_of(method: str, url: str) -> str:
+    path = httpx.URL(url).path
+    return f"{method} {_CODE_RE.sub('/rooms/{code}', path)}"
+
+
+def pct(sorted_ms: list[float], p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    k = min(len(sorted_ms) - 1, max(0, round(p / 100 * (len(sorted_ms) - 1))))
+    return sorted_ms[k]
+
+
+@dataclass
+class Stats:
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    errors: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    statuses: dict[str, dict[int, int]] = field(default_factory=lambda: defaultdict(lambda: defaultdict(int)))
+    lock_errors: int = 0
+    games_finished: int = 0
+
+    def record(self, route: str, ms: float, status: int | None, error: str | None = None) -> None:
+        self.latencies[route].append(ms)
+        if status is not None:
+            self.statuses[route][status] += 1
+        if error or (status is not None and status >= 500):
+            self.errors[route] += 1
+        if error and "locked" in error:
+            self.lock_errors += 1
+
+    def report(self, elapsed: float, config: dict) -> dict:
+        routes = {}
+        total = 0
+        for route, ms in sorted(self.latencies.items()):
+            ms = sorted(ms)
+            total += len(ms)
+            routes[route] = {
+                "count": len(ms),
+                "rps": round(len(ms) / elapsed, 2) if elapsed else 0,
+                "p50_ms": round(pct(ms, 50), 2),
+                "p95_ms": round(pct(ms, 95), 2),
+                "p99_ms": round(pct(ms, 99), 2),
+                "mean_ms": round(statistics.fmean(ms), 2) if ms else 0,
+                "errors": self.errors.get(route, 0),
+                "statuses": {str(k): v for k, v in sorted(self.statuses[route].items())},
+            }
+        return {
+            "config": config,
+            "elapsed_s": round(elapsed, 3),
+            "requests": total,
+            "rps": round(total / elapsed, 2) if elapsed else 0,
+            "errors": sum(self.errors.values()),
+            "lock_errors": self.lock_errors,
+            "games_finished": self.games_finished,
+            "routes": routes,
+        }
+
+
+class Player:
+    def __init__(self, client: httpx.AsyncClient, stats: Stats, name: str, index: int) -> None:
+        self.client = client
+        self.stats = stats
+        self.name = name
+        self.index = index
+        self.phase_seen = asyncio.Event()
+        self.redirect: str | None = None
+
+    async def request(self, method: str, url: str, **kw) -> httpx.Response | None:
+        route = route_of(method, url)
+        t0 = time.perf_counter()
+        try:
+            r = await self.client.request(method, url, **kw)
+        except Exception as e:  # プロセス内実行ではアプリの例外がここに来る
+            self.stats.record(route, (time.perf_counter() - t0) * 1000, None, f"{type(e).__name__}: {e}")
+            return None
+        ms = (time.perf_counter() - t0) * 1000
+        err = None
+        if r.status_code >= 500 and "locked" in r.text:
+            err = "database is locked"
+        self.stats.record(route, ms, r.status_code, err)
+        if r.headers.get("HX-Redirect"):
+            self.redirect = r.headers["HX-Redirect"]
+            self.phase_seen.set()
+        return r
+
+    @property
+    def emoji(self) -> str:
+        i = self.index
+        s = PALETTE[i % len(PALETTE)]
+        if i >= len(PALETTE):
+            s += PALETTE[(i // len(PALETTE)) % len(PALETTE)]
+        return s
+
+
+class Room:
+    def __init__(self, players: list[Player], code: str, cadence: str,
+                 subscribe: Callable[[str], "asyncio.Queue"] | None) -> None:
+        self.players = players
+        self.code = code
+        self.cadence = cadence
+        self.subscribe = subscribe
+
+    @asynccontextmanager
+    async def page(self, p: Player, page: str):
+        """1人が1ページを開いている間の htmx の裏リクエストを再現する。"""
+        p.phase_seen.clear()
+        p.redirect = None
+        tasks = [asyncio.create_task(self._poll(p, path.format(code=self.code), every))
+                 for path, every in CADENCES[self.cadence][page]]
+        if self.cadence == "current" and self.subscribe:
+            tasks.append(asyncio.create_task(self._on_events(p, page)))
+        try:
+            yield
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _poll(self, p: Player, url: str, every: float) -> None:
+        await p.request("GET", url)   # hx-trigger="load"
+        while True:
+            await asyncio.sleep(every)
+            await p.request("GET", url)
+
+    async def _on_events(self, p: Player, page: str) -> None:
+        async for event in self.subscribe(self.code):
+            for path in ON_EVENT[page].get(event, ()):
+                await p.request("GET", path.format(code=self.code))
+
+    async def wait_for(self, p: Player, target: str, timeout: float) -> None:
+        suffix = "" if target == "lobby" else f"/{target}"
+        url = f"/rooms/{self.code}{suffix}"
+        deadline = time.monotonic() + timeout
+        while not (p.redirect and p.redirect.endswith(url)):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise TimeoutError(f"{p.name}: phase {target} not reached")
+            p.phase_seen.clear()
+            try:
+                await asyncio.wait_for(p.phase_seen.wait(), timeout=min(left, 0.5))
+            except asyncio.TimeoutError:
+                pass
+
+
+async def play_room(make_client: Callable[[], httpx.AsyncClient], stats: Stats, args,
+                    subscribe, room_no: int) -> None:
+    async with AsyncExitStack() as stack:
+        players = [
+            Player(await stack.enter_async_context(make_client()), stats, f"P{room_no}-{i}", i)
+            for i in range(args.players)
+        ]
+        host = players[0]
+        r = await host.request("POST", "/rooms", data={"name": host.name})
+        if r is None or r.status_code != 303:
+            return
+        code = r.headers["location"].rsplit("/", 1)[-1]
+        room = Room(players, code, args.cadence, subscribe)
+
+        async def lobby(p: Player) -> None:
+            if p is not host:
+                await asyncio.sleep(random.uniform(0, args.think))
+                await p.request("POST", "/join", data={"code": code, "name": p.name})
+            await p.request("GET", f"/rooms/{code}")
+            async with room.page(p, "lobby"):
+                await room.wait_for(p, "hint", args.timeout)
+
+        async def start_when_full() -> None:
+            await asyncio.sleep(args.think + 0.2)
+            await host.request("POST", f"/rooms/{code}/start")
+
+        await asyncio.gather(start_when_full(), *(lobby(p) for p in players))
+
+        for rnd in range(args.rounds):
+            await asyncio.gather(*(play_round(room, p, args) for p in players))
+            stats.games_finished += 1
+            if rnd + 1 < args.rounds:
+                await host.request("POST", f"/rooms/{code}/next_rounds")
+
+
+async def play_round(room: Room, p: Player, args) -> None:
+    code = room.code
+    # --- ヒント ---
+    await p.request("GET", f"/rooms/{code}/hint")
+    async with room.page(p, "hint"):
+        await asyncio.sleep(random.uniform(0, args.think))
+        await p.request("POST", f"/rooms/{code}/hint", data={"emoji": p.emoji})
+        await room.wait_for(p, "vote", args.timeout)
+    # --- 投票 ---
+    r = await p.request("GET", f"/rooms/{code}/vote")
+    options = re.findall(r'option value="(\d+)"', r.text) if r is not None else []
+    async with room.page(p, "vote"):
+        await asyncio.sleep(random.uniform(0, args.think))
+        if options:
+            await p.request("POST", f"/rooms/{code}/vote", data={"target_player_id": random.choice(options)})
+        await room.wait_for(p, "result", args.timeout)
+    await p.request("GET", f"/rooms/{code}/result")
+
+
+def _in_process_subscribe(hub):
+    async def subscribe(code: str):
+        async with hub.subscribe(code) as q:
+            while True:
+                event, _ = await q.get()
+                yield event
+    return subscribe
+
+
+def _http_subscribe(base_url: str):
+    async def subscribe(code: str):
+        async with httpx.AsyncClient(base_url=base_url, timeout=None) as c:
+            async with c.stream("GET", f"/rooms/{code}/events") as r:
+                async for line in r.aiter_lines():
+                    if line.startswith("event:"):
+                        yield line[6:].strip()
+    return subscribe
+
+
+async def run(args) -> dict:
+    stats = Stats()
+    config = {k: v for k, v in vars(args).items() if k != "out"}
+    async with AsyncExitStack() as stack:
+        if args.base_url:
+            def make_client():
+                return httpx.AsyncClient(base_url=args.base_url, follow_redirects=False, timeout=args.timeout)
+            subscribe = _http_subscribe(args.base_url)
+        else:
+            from app.main import app
+            from app.events import hub
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            transport = httpx.ASGITransport(app=app)
+
+            def make_client():
+                return httpx.AsyncClient(transport=transport, base_url="http://loadtest",
+                                         follow_redirects=False, timeout=args.timeout)
+            subscribe = _in_process_subscribe(hub)
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(
+            *(play_room(make_client, stats, args, subscribe, i) for i in range(args.rooms)),
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - t0
+    report = stats.report(elapsed, config)
+    report["room_failures"] = [repr(r) for r in results if isinstance(r, BaseException)]
+    return report
+
+
+def print_report(rep: dict) -> None:
+    print(f"{rep['requests']} requests in {rep['elapsed_s']}s  ({rep['rps']} req/s)  "
+          f"errors={rep['errors']} lock_errors={rep['lock_errors']} games={rep['games_finished']}")
+    print(f"{'route':<40} {'count':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5}")
+    for route, r in rep["routes"].items():
+        print(f"{route:<40} {r['count']:>7} {r['rps']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['errors']:>5}")
+    for f in rep["room_failures"]:
+        print("room failed:", f)
+
+
+def main(argv: list[str] | None = None) -> None:
+    ap = argparse.ArgumentParser(description="Emoji Charades load test")
+    ap.add_argument("--rooms", type=int, default=5)
+    ap.add_argument("--players", type=int, default=8, help="1部屋あたりの人数（ホスト含む）")
+    ap.add_argument("--rounds", type=int, default=1)
+    ap.add_argument("--think", type=float, default=2.0, help="投稿までの最大待ち秒（一様乱数）")
+    ap.add_argument("--cadence", choices=sorted(CADENCES), default="current")
+    ap.add_argument("--timeout", type=float, default=180.0)
+    ap.add_argument("--base-url", default=None, help="指定すると HTTP 経由、無ければプロセス内 ASGI")
+    ap.add_argument("--db", default=None, help="プロセス内実行時の DATABASE_URL（既定は一時ファイル）")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--out", default=None, help="結果 JSON の書き出し先")
+    args = ap.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    if not args.base_url:
+        # app.db の読み込み前に接続先を決める
+        os.environ["DATABASE_URL"] = args.db or f"sqlite:///{tempfile.mkdtemp(prefix='emoji-load-')}/load.db"
+        sys.path.insert(0, os.getcwd())
+
+    rep = asyncio.run(run(args))
+    print_report(rep)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+お題辞書のベンチマーク：パックの行数を増やしても、起動（パックを開く）時間とメモリが
+増えないことを確かめる。
+
+    python -m bench.topics_bench --sizes 1000 10000 100000 1000000 --out topics_bench.json
+
+行数ごとに合成パックを一時ディレクトリに作り、別プロセスで次を測る。
+  cold_open_ms  索引（.idx）が無い状態で開く時間（初回のみ。TSV を 1 回なめる）
+  open_ms       索引がある状態で開く時間（通常の起動）
+  rss_kb        開いた直後の常駐メモリ増分
+  draw_us       1 部屋から 1 ペア引く平均時間
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+CATEGORIES = ["food", "drink", "animal", "nature", "vehicle", "sport", "hobby", "place"]
+
+
+def make_pack(path: str, n: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# category\tdifficulty\ttopic\tspy_topic\n")
+        for i in range(n):
+            f.write(f"{rng.choice(CATEGORIES)}\t{rng.randint(1, 3)}\tお題{i:07d}\tウルフ{i:07d}\n")
+
+
+def _rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def probe(directory: str, draws: int) -> dict:
+    """子プロセス側：パックを開いて測る。"""
+    from app.topics import TopicDictionary
+
+    rss0 = _rss_kb()
+    t0 = time.perf_counter()
+    d = TopicDictionary(directory)
+    pairs = d.open()
+    open_ms = (time.perf_counter() - t0) * 1000
+    rss1 = _rss_kb()
+
+    t0 = time.perf_counter()
+    for i in range(draws):
+        d.draw(f"R{i % 100:04d}", "ja")
+    draw_us = (time.perf_counter() - t0) / draws * 1e6
+    return {"pairs": pairs, "open_ms": round(open_ms, 2), "rss_kb": rss1 - rss0,
+            "draw_us": round(draw_us, 2)}
+
+
+def _run_probe(directory: str, draws: int) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "bench.topics_bench", "--probe", directory, "--draws", str(draws)],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(out.stdout)
+
+
+def main(argv: list[str] | None = None) -> None:
+    ap = argparse.ArgumentParser(description="Emoji Charades topic dictionary benchmark")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    ap.add_argument("--draws", type=int, default=10000)
+    ap.add_argument("--out", default=None, help="結果 JSON の書き出し先")
+    ap.add_argument("--probe", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.probe:
+        print(json.dumps(probe(args.probe, args.draws)))
+        return
+
+    rows = []
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory(prefix="topics-") as tmp:
+            make_pack(os.path.join(tmp, "ja.tsv"), n)
+            cold = _run_probe(tmp, args.draws)
+            warm = _run_probe(tmp, args.draws)
+        rows.append({"pairs": n, "cold_open_ms": cold["open_ms"], "open_ms": warm["open_ms"],
+                     "rss_kb": warm["rss_kb"], "draw_us": warm["draw_us"]})
+
+    print(f"{'pairs':>10} {'cold_open_ms':>13} {'open_ms':>9} {'rss_kb':>8} {'draw_us':>8}")
+    for r in rows:
+        print(f"{r['pairs']:>10} {r['cold_open_ms']:>13} {r['open_ms']:>9} {r['rss_kb']:>8} {r['draw_us']:>8}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+// 締切ベースのカウントダウン。
+// _clock.html の data-deadline-ms（締切）と data-server-now-ms（描画時のサーバ時刻）から
+// 時計のずれを求め、あとはローカル時計だけで残り秒数を更新する。
+(function () {
+  var deadline = 0;
+  var offset = 0;   // サーバ時刻 - ローカル時刻
+
+  function sync(root) {
+    var el = (root || document).querySelector(".countdown[data-deadline-ms]");
+    if (!el) return;
+    deadline = Number(el.dataset.deadlineMs) || 0;
+    offset = (Number(el.dataset.serverNowMs) || Date.now()) - Date.now();
+    tick();
+  }
+
+  function tick() {
+    var el = document.querySelector(".countdown[data-deadline-ms] .countdown-remain");
+    if (!el) return;
+    var remain = deadline ? Math.max(0, Math.floor((deadline - (Date.now() + offset)) / 1000)) : 0;
+    if (el.textContent !== String(remain)) el.textContent = remain;
+  }
+
+  document.addEventListener("DOMContentLoaded", function () {
+    sync();
+    setInterval(tick, 250);
+  });
+  document.addEventListener("htmx:afterSwap", function (e) { sync(e.target); });
+})();
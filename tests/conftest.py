@@ -0,0 +1,37 @@
+"""
+app を import する前に DB を一時ファイルへ向ける（app.db は import 時に DATABASE_URL を読む）。
+"""
+import os
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix="emoji-charades-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/app.db"
+os.environ.pop("DATABASE_SHARDS", None)
+os.environ["ROOM_BUS"] = "local"
+
+
+@pytest.fixture
+def started_room():
+    """ホスト + (players - 1) 人でラウンドを始めた部屋を作る。clients[0] がホスト。"""
+    from types import SimpleNamespace
+
+    from fastapi.testclient import TestClient
+
+    from app.main import app, room_cache
+
+    def make(players: int = 3) -> SimpleNamespace:
+        host = TestClient(app)
+        with host:
+            res = host.post("/rooms", data={"name": "host"}, follow_redirects=False)
+            code = res.headers["location"].rstrip("/").split("/")[-1]
+            guests = [TestClient(app) for _ in range(players - 1)]
+            for i, c in enumerate(guests):
+                c.post("/join", data={"code": code, "name": f"p{i}"}, follow_redirects=False)
+            host.post(f"/rooms/{code}/start", follow_redirects=False)
+        room = room_cache.get(code)
+        return SimpleNamespace(code=code, round_id=room.current_round.id, spy_id=room.current_round.spy_player_id,
+                               player_ids=list(room.players), clients=[host, *guests])
+
+    return make
@@ -0,0 +1,41 @@
+"""
+観戦画面の一斉配信：投票が書き込まれたら（votes イベントで）観戦フレームが描き直されること。
+"""
+import asyncio
+
+import httpx
+from fastapi.testclient import TestClient
+from starlette.concurrency import run_in_threadpool
+
+
+def test_flushed_vote_refreshes_watch_frame():
+    from app.main import app, broadcaster, ingest, room_cache, _on_ingested
+
+    with TestClient(app) as host:
+        res = host.post("/rooms", data={"name": "host"}, follow_redirects=False)
+        code = res.headers["location"].rstrip("/").split("/")[-1]
+        guest = TestClient(app)
+        guest.post("/join", data={"code": code, "name": "guest"}, follow_redirects=False)
+        host.post(f"/rooms/{code}/start", follow_redirects=False)
+        host.post(f"/rooms/{code}/lock_hints", follow_redirects=False)
+        cookies = dict(guest.cookies)
+    host_id, _guest_id = room_cache.get(code).players
+
+    async def run():
+        async with broadcaster.watch(code) as ch:
+            assert await ch.wait(0, timeout=2)
+            before, seen = ch.frame, ch.seq
+            assert "🗳️" not in before
+
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test", cookies=cookies) as c:
+                res = await c.post(f"/rooms/{code}/vote", data={"target_player_id": host_id})
+            assert res.status_code == 303
+            # 裏のタスクの代わりに書き出す（コミット後に votes が流れる）
+            _on_ingested(await run_in_threadpool(ingest.flush_all))
+
+            assert await ch.wait(seen, timeout=2)
+            return ch.frame
+
+    after = asyncio.run(run())
+    assert "🗳️" in after
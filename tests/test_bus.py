@@ -0,0 +1,124 @@
+"""
+TableBus：同じ DB を中継にした 2 つのワーカーが互いのイベントを受け取り、
+他ワーカー発のイベントで手元の部屋キャッシュが捨てられること。
+request は心拍のある相手の ack を待つこと。
+"""
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.bus import TableBus
+from app.db import make_async_engine
+
+POLL = 0.02
+
+
+async def _settle() -> None:
+    await asyncio.sleep(POLL * 10)
+
+
+def test_table_buses_deliver_to_each_other(tmp_path):
+    async def run():
+        eng = make_async_engine(f"sqlite:///{tmp_path}/bus.db")
+        got = {"a": [], "b": []}
+        a = TableBus(lambda *ev: got["a"].append(ev), eng, poll=POLL)
+        b = TableBus(lambda *ev: got["b"].append(ev), eng, poll=POLL)
+        await a.start()
+        await b.start()
+        try:
+            a.publish("R1", "phase", "hint")
+            b.publish("R2", "players")
+            await _settle()
+        finally:
+            await a.stop()
+            await b.stop()
+            await eng.dispose()
+        return got
+
+    got = asyncio.run(run())
+    # 自分の分は publish 時に手元へ（remote=False）、相手の分は中継で（remote=True）1 回ずつ
+    assert got["a"] == [("R1", "phase", "hint", False), ("R2", "players", "", True)]
+    assert got["b"] == [("R2", "players", "", False), ("R1", "phase", "hint", True)]
+
+
+def test_remote_event_invalidates_room_cache(tmp_path):
+    from app.main import app, room_cache, _on_room_event
+
+    with TestClient(app) as client:
+        res = client.post("/rooms", data={"name": "host"}, follow_redirects=False)
+        code = res.headers["location"].rstrip("/").split("/")[-1]
+    cached = room_cache.get(code)
+    assert room_cache.get(code) is cached
+
+    async def run():
+        eng = make_async_engine(f"sqlite:///{tmp_path}/bus.db")
+        here = TableBus(_on_room_event, eng, poll=POLL)      # このワーカー
+        other = TableBus(lambda *ev: None, eng, poll=POLL)   # 別ワーカー
+        await here.start()
+        await other.start()
+        try:
+            other.publish(code, "players")
+            await _settle()
+        finally:
+            await here.stop()
+            await other.stop()
+            await eng.dispose()
+
+    asyncio.run(run())
+    assert room_cache.get(code) is not cached
+
+
+def test_request_waits_for_peer_ack(tmp_path):
+    async def run():
+        eng = make_async_engine(f"sqlite:///{tmp_path}/bus.db")
+        asked = []
+
+        def on_other(code, event, data, remote):
+            if event == "flush":
+                asked.append(code)
+                other.ack(data)
+
+        here = TableBus(lambda *ev: None, eng, poll=POLL)
+        other = TableBus(on_other, eng, poll=POLL)
+        await here.start()
+        await other.start()
+        try:
+            await asyncio.sleep(1.2)   # 心拍で互いを知るまで
+            ok = await asyncio.to_thread(here.request, "R1", "flush", 2)
+        finally:
+            await here.stop()
+            await other.stop()
+            await eng.dispose()
+        return ok, asked
+
+    ok, asked = asyncio.run(run())
+    assert ok
+    assert asked == ["R1"]
+
+
+def test_events_after_prune_are_still_delivered(tmp_path):
+    async def run():
+        eng = make_async_engine(f"sqlite:///{tmp_path}/bus.db")
+        got = []
+        a = TableBus(lambda *ev: None, eng, poll=POLL)
+        b = TableBus(lambda *ev: got.append(ev), eng, poll=POLL)
+        await a.start()
+        await b.start()
+        try:
+            for i in range(5):
+                a.publish("R1", "players", str(i))
+            await _settle()
+            # 暇な間に保持期間を過ぎた分を全部消す
+            a._retain, a._last_prune = 0, 0
+            await a._prune()
+            a.publish("R1", "phase", "hint")
+            await _settle()
+        finally:
+            await a.stop()
+            await b.stop()
+            await eng.dispose()
+        return got
+
+    got = asyncio.run(run())
+    assert got[-1] == ("R1", "phase", "hint", True)
+    assert len(got) == 6
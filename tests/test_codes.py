@@ -0,0 +1,54 @@
+"""
+部屋コードの払い出し（app/codes.py）：複数ワーカーから同時に取っても重ならず、
+回収されたコードは（二重に戻されても）次の補充で使い回されること。
+"""
+import threading
+
+from sqlmodel import SQLModel
+
+from app.codes import CodeAllocator, normalize_code
+from app.db import make_engine
+
+
+def _engine(tmp_path):
+    eng = make_engine(f"sqlite:///{tmp_path}/codes.db")
+    SQLModel.metadata.create_all(eng)
+    return eng
+
+
+def test_codes_are_unique_across_allocators(tmp_path):
+    eng = _engine(tmp_path)
+    # 2 つのワーカー × 4 スレッドで、補充を何度も挟むよう小さいブロックで取る
+    workers = [CodeAllocator(eng, [eng], block=8) for _ in range(2)]
+    got: list[str] = []
+    lock = threading.Lock()
+
+    def take(alloc):
+        codes = [alloc.allocate() for _ in range(25)]
+        with lock:
+            got.extend(codes)
+
+    threads = [threading.Thread(target=take, args=(w,)) for w in workers for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(got) == 200
+    assert len(set(got)) == 200
+    assert all(len(c) == 6 and normalize_code(c) == c for c in got)
+
+
+def test_released_codes_are_reused(tmp_path):
+    eng = _engine(tmp_path)
+    first = CodeAllocator(eng, [eng], block=4)
+    used = [first.allocate() for _ in range(4)]
+
+    # 同じコードを二度戻しても（回収が重なっても）失敗しない
+    first.release(used[:2])
+    first.release(used[:2])
+
+    second = CodeAllocator(eng, [eng], block=4)
+    assert sorted(second.allocate() for _ in range(2)) == sorted(used[:2])
+    # 空きを使い切ったらカウンタの続きから（既に払い出したものとは重ならない）
+    assert second.allocate() not in used
@@ -0,0 +1,46 @@
+"""
+既存 DB への列の追加（app/db.py の migrate）。
+"""
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import SQLModel
+
+from app import models  # noqa: F401  （metadata にテーブルを載せる）
+from app.db import _ADDED_COLUMNS, _added_column_ddl, make_engine, migrate
+
+
+def test_added_column_ddl_follows_the_dialect():
+    pg = {(t, c): _added_column_ddl(postgresql.dialect(), t, c, e) for t, c, e, _ in _ADDED_COLUMNS}
+    lite = {(t, c): _added_column_ddl(sqlite.dialect(), t, c, e) for t, c, e, _ in _ADDED_COLUMNS}
+    assert pg[("room", "last_activity_at")] == "TIMESTAMP WITHOUT TIME ZONE"
+    assert pg[("round", "scored_at")] == "TIMESTAMP WITHOUT TIME ZONE"
+    assert lite[("round", "scored_at")] == "DATETIME"
+    assert pg[("room", "member_version")] == "INTEGER NOT NULL DEFAULT 0"
+
+
+def test_migrate_adds_columns_to_an_old_database(tmp_path):
+    eng = make_engine(f"sqlite:///{tmp_path}/old.db")
+    with eng.begin() as conn:
+        # 列を足す前の room / round
+        conn.exec_driver_sql(
+            "CREATE TABLE room (code VARCHAR PRIMARY KEY, status VARCHAR NOT NULL, round INTEGER NOT NULL, "
+            "lang VARCHAR NOT NULL DEFAULT 'ja', hint_deadline DATETIME, vote_deadline DATETIME, created_at DATETIME)"
+        )
+        conn.exec_driver_sql(
+            "CREATE TABLE round (id INTEGER PRIMARY KEY, room_code VARCHAR NOT NULL, topic VARCHAR NOT NULL, "
+            "spy_topic VARCHAR NOT NULL, spy_player_id INTEGER, created_at DATETIME)"
+        )
+        conn.exec_driver_sql("INSERT INTO room VALUES ('OLD001', 'result', 1, 'ja', NULL, NULL, '2026-01-01 00:00:00')")
+        conn.exec_driver_sql("INSERT INTO round VALUES (1, 'OLD001', 'a', 'b', NULL, '2026-01-01 00:01:00')")
+    SQLModel.metadata.create_all(eng)
+
+    migrate(eng)
+    migrate(eng)   # 冪等
+
+    insp = inspect(eng)
+    cols = {t: {c["name"] for c in insp.get_columns(t)} for t in {t for t, _, _, _ in _ADDED_COLUMNS}}
+    for table, column, _, _ in _ADDED_COLUMNS:
+        assert column in cols[table]
+    with eng.connect() as conn:
+        row = conn.exec_driver_sql("SELECT current_round_id, last_activity_at, member_version FROM room").one()
+    assert row == (1, "2026-01-01 00:01:00", 0)
@@ -0,0 +1,58 @@
+"""
+絵文字の個数（app/emoji.py の count_emoji）：見た目の 1 文字＝書記素クラスタで数える。
+"""
+import pytest
+
+from app.emoji import EmojiError, count_emoji, validate_emoji_payload
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("🍣", 1),
+    ("🍣🍕🍔", 3),
+    # ZWJ で繋いだ家族・職業は 1 個
+    ("\U0001F468\u200d\U0001F469\u200d\U0001F467\u200d\U0001F466", 1),        # 家族（4 人）
+    ("\U0001F469\U0001F3FD\u200d\U0001F4BB", 1),                              # 肌色 + ZWJ（技術者）
+    ("\U0001F3F3\ufe0f\u200d\U0001F308", 1),                                  # 異体字セレクタ + ZWJ（虹の旗）
+    # 国旗は地域指示子 2 つで 1 個
+    ("\U0001F1EF\U0001F1F5", 1),                                              # 🇯🇵
+    ("\U0001F1EF\U0001F1F5\U0001F1FA\U0001F1F8", 2),                          # 🇯🇵🇺🇸
+    # キーキャップ（異体字セレクタあり・なし）
+    ("1\ufe0f\u20e3", 1),                                                     # 1 のキーキャップ
+    ("#\u20e3", 1),
+    ("1\ufe0f\u20e32\ufe0f\u20e3", 2),
+    # タグ列（イングランドの旗）
+    ("\U0001F3F4\U000E0067\U000E0062\U000E0065\U000E006E\U000E0067\U000E007F", 1),
+    # 肌色修飾・異体字セレクタは直前の絵文字に含める
+    ("\U0001F44D\U0001F3FD", 1),                                              # 👍🏽
+    ("❤\ufe0f", 1),                                                      # 赤いハート
+    ("\U0001F44D\U0001F3FB\U0001F44D\U0001F3FF", 2),
+])
+def test_count_emoji(text, expected):
+    assert count_emoji(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "abc",
+    "🍣a",
+    "寿司🍣",
+    "1",                                       # キーキャップでない素の数字
+    "🍣 🍕",                                   # 空白
+    "\U0001F3F4\U000E0067\U000E0062",          # 終端の無いタグ列
+])
+def test_count_emoji_rejects_non_emoji(text):
+    with pytest.raises(EmojiError):
+        count_emoji(text)
+
+
+@pytest.mark.parametrize("raw, error", [
+    ("  🍣🍕  ", None),
+    ("🍣🍕🍔🌮", "最大3つ"),
+    ("", "入力してください"),
+    ("ok", "絵文字のみ"),
+])
+def test_validate_emoji_payload(raw, error):
+    if error is None:
+        assert validate_emoji_payload(raw) == raw.strip()
+    else:
+        with pytest.raises(ValueError, match=error):
+            validate_emoji_payload(raw)
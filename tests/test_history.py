@@ -0,0 +1,53 @@
+"""
+履歴ページ：過去のラウンドは採点時の参加者（RoundResult）で表示し、今の参加者では並べない。
+"""
+from fastapi.testclient import TestClient
+
+from app.models import GameStatus, RoundResult
+from app.pages import LEFT_PLAYER, history_page_model
+from app.state import PlayerView, RoomState
+
+
+def test_player_who_joined_later_is_not_in_past_rounds(started_room):
+    from app.main import app
+
+    room = started_room(3)
+    host = room.clients[0]
+    host.post(f"/rooms/{room.code}/lock_hints", follow_redirects=False)
+    host.post(f"/rooms/{room.code}/close_vote", follow_redirects=False)
+
+    TestClient(app).post("/join", data={"code": room.code, "name": "latecomer"}, follow_redirects=False)
+
+    page = host.get(f"/rooms/{room.code}/history").text
+    leaderboard, _, rounds = page.partition("</ol>")
+    assert "latecomer" in leaderboard
+    assert "latecomer" not in rounds
+    assert "p0" in rounds and "p1" in rounds
+
+
+def _room_with(*players: tuple[int, str]) -> RoomState:
+    return RoomState(code="HIST01", status=GameStatus.result, round=2, lang="ja",
+                     hint_deadline=None, vote_deadline=None,
+                     players={pid: PlayerView(pid, "HIST01", name, False, 0) for pid, name in players})
+
+
+def test_rounds_use_their_own_participants():
+    result = RoundResult(round_id=1, room_code="HIST01", spy_player_id=2, wolf_won=False,
+                         tally=[[2, 2]], deltas=[[1, 1], [3, 1]], votes=[[1, 2], [3, 2], [2, 1]],
+                         hints=[[1, "🍣"], [2, "🍕"], [3, "🍔"]],
+                         players=[[1, "alice"], [2, "bob"], [3, "carol"]])
+    # carol は抜け、dave が後から来た
+    [rd] = history_page_model(_room_with((1, "alice"), (2, "bob"), (4, "dave")), [result])
+    assert rd["spy_name"] == "bob"
+    assert [(row["name"], row["hint"], row["votes"], row["delta"]) for row in rd["rows"]] == [
+        ("alice", "🍣", 0, 1), ("bob", "🍕", 2, None), ("carol", "🍔", 0, 1),
+    ]
+
+
+def test_results_without_a_roster_fall_back_to_the_round_data():
+    # 参加者を残す前の結果
+    result = RoundResult(round_id=1, room_code="HIST01", spy_player_id=3, wolf_won=True,
+                         tally=[[1, 1]], deltas=[[3, 3]], votes=[[2, 1]], hints=[[1, "🍣"]], players=None)
+    [rd] = history_page_model(_room_with((1, "alice"), (2, "bob"), (4, "dave")), [result])
+    assert [row["name"] for row in rd["rows"]] == ["alice", "bob", LEFT_PLAYER]
+    assert rd["spy_name"] == LEFT_PLAYER
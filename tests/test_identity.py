@@ -0,0 +1,56 @@
+"""
+署名つきの本人情報（app/identity.py）：部屋の参加者 version が変わったり、
+同じコードが別の部屋（新しい世代）に使い回されたりしたら、古いトークンは通らないこと。
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from app.identity import SESSION_KEY, issue, read, room_epoch
+from app.main import _identity_for
+
+CREATED = datetime(2026, 10, 1, 12, 0, 0, 123456)
+
+
+def _player(pid=7, code="ABC123", is_host=True):
+    return SimpleNamespace(id=pid, room_code=code, name="host", is_host=is_host)
+
+
+def _room(code="ABC123", created_at=CREATED, member_version=2):
+    return SimpleNamespace(code=code, created_at=created_at, member_version=member_version)
+
+
+def _request(session):
+    return SimpleNamespace(session=session)
+
+
+def test_token_round_trip():
+    session = {}
+    ident = issue(session, _player(), CREATED, 2)
+    assert read(session) == ident
+    assert ident.epoch == room_epoch(CREATED)
+    assert _identity_for(_room(), _request(session)) == ident
+
+
+def test_token_rejected_after_member_version_changes():
+    session = {}
+    issue(session, _player(), CREATED, 2)
+    # 誰かが参加・退出した → DB で確かめ直すまで信用しない
+    assert _identity_for(_room(member_version=3), _request(session)) is None
+
+
+def test_token_rejected_when_code_is_reused_by_a_new_room():
+    session = {}
+    issue(session, _player(), CREATED, 2)
+    # 回収されたコードで作られた新しい部屋（version が偶然同じでも世代が違う）
+    reused = _room(created_at=CREATED + timedelta(hours=3))
+    assert _identity_for(reused, _request(session)) is None
+    assert _identity_for(_room(code="XYZ789"), _request(session)) is None
+
+
+def test_tampered_token_is_ignored():
+    session = {}
+    issue(session, _player(is_host=False), CREATED, 2)
+    token = session[SESSION_KEY]
+    session[SESSION_KEY] = token[:-2] + ("AA" if not token.endswith("AA") else "BB")
+    assert read(session) is None
+    assert read({}) is None
@@ -0,0 +1,92 @@
+"""
+ヒント・票の書き出し（app/ingest.py）：制約違反・締め切り後の行は捨てて部屋を dropped で返し、
+ロック待ちの打ち切りでは捨てずに積み直すこと。
+"""
+import os
+import sqlite3
+
+from sqlalchemy import create_engine, func
+from sqlmodel import Session, select
+
+from app.db import engines, shard_of
+from app.ingest import IngestBuffer, provisional_hint_id
+from app.models import Hint, Vote
+from app.state import HintView, VoteView
+
+
+def _hint(rid: int, pid: int, emoji: str) -> HintView:
+    return HintView(provisional_hint_id(), rid, pid, emoji)
+
+
+def _count(model, round_id: int) -> int:
+    with Session(engines[0]) as s:
+        return s.exec(select(func.count()).select_from(model).where(model.round_id == round_id)).one()
+
+
+def test_duplicate_rows_are_dropped_and_reported(started_room):
+    room = started_room()
+    code, rid, (a, b, c) = room.code, room.round_id, room.player_ids
+    w1, w2 = IngestBuffer(engines, shard_of), IngestBuffer(engines, shard_of)
+
+    w1.add_hint(code, _hint(rid, a, "🍣"))
+    [(_, hints, _, dropped)] = w1.flush_all()
+    assert not dropped
+    assert [(h.player_id, h.content_emoji) for h in hints] == [(a, "🍣")]
+
+    # 別ワーカーが同じ絵文字を受け付けていた → 後着を落とす。同じ人の出し直しは後勝ちで 1 行
+    w2.add_hint(code, _hint(rid, b, "🍣"))
+    w2.add_hint(code, _hint(rid, c, "🍕"))
+    w2.add_hint(code, _hint(rid, c, "🍔"))
+    [(got_code, hints, votes, dropped)] = w2.flush_all()
+    assert got_code == code and dropped
+    assert [(h.player_id, h.content_emoji) for h in hints] == [(c, "🍔")]
+
+    # 存在しない参加者（外部キー違反）はその 1 件だけ落とし、同じバッチの他の行は書く
+    w1.add_hint(code, _hint(rid, 999_999, "🌮"))
+    w1.add_hint(code, _hint(rid, b, "🍜"))
+    [(_, hints, _, dropped)] = w1.flush_all()
+    assert dropped
+    assert [(h.player_id, h.content_emoji) for h in hints] == [(b, "🍜")]
+    assert _count(Hint, rid) == 3
+    assert w1.pending() == 0
+
+
+def test_late_rows_are_dropped_and_reported(started_room):
+    room = started_room()
+    code, rid, (a, b, _) = room.code, room.round_id, room.player_ids
+    w = IngestBuffer(engines, shard_of)
+
+    # ヒントのフェーズ中の票・古いラウンド（ここでは他の部屋のラウンド id）のヒントは書かない
+    before = _count(Hint, rid - 1)
+    w.add_vote(code, VoteView(rid, a, b))
+    w.add_hint(code, _hint(rid - 1, a, "🍣"))
+    assert w.flush_all() == [(code, [], [], True)]
+    assert _count(Vote, rid) == 0
+    assert _count(Hint, rid - 1) == before
+    assert w.pending() == 0
+
+
+def test_locked_database_requeues_instead_of_dropping(started_room):
+    room = started_room()
+    code, rid, (a, b, _) = room.code, room.round_id, room.player_ids
+    url = os.environ["DATABASE_URL"]
+    # ロック待ちを短くした同じ DB（既定の busy_timeout だと待ちが長い）
+    eng = create_engine(url, connect_args={"timeout": 0.05})
+    w = IngestBuffer([eng], lambda code: 0, flush_ms=1)
+
+    locker = sqlite3.connect(url.removeprefix("sqlite:///"))
+    locker.execute("BEGIN IMMEDIATE")
+    try:
+        w.add_hint(code, _hint(rid, a, "🍣"))
+        w.add_hint(code, _hint(rid, b, "🍕"))
+        assert w.flush_all() == []          # 捨てない・部屋も dropped にしない
+        assert w.pending() == 2
+    finally:
+        locker.rollback()
+        locker.close()
+
+    [(_, hints, _, dropped)] = w.flush_all()
+    assert not dropped
+    assert sorted(h.content_emoji for h in hints) == ["🍕", "🍣"]
+    assert w.pending() == 0
+    eng.dispose()
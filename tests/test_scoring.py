@@ -0,0 +1,85 @@
+"""
+採点（_tally_wordwolf_and_apply_scores）：ホストの close_vote とスケジューラが同じラウンドを
+同時に締めても加点は一度だけ（round.scored_at の印）。誰も当てられなければウルフに +3。
+"""
+import threading
+from datetime import timedelta
+
+from sqlmodel import Session, select, update
+
+from app.db import engines
+from app.models import Player, Room, RoundResult
+
+
+def _close_both_ways(room) -> None:
+    """締切を過ぎた扱いにして、close_vote とスケジューラの評価を同時に走らせる。"""
+    from app.main import _advance_due, _now
+
+    host = room.clients[0]
+    host.post(f"/rooms/{room.code}/lock_hints", follow_redirects=False)
+    with Session(engines[0]) as s:
+        s.exec(update(Room).where(Room.code == room.code).values(vote_deadline=_now() - timedelta(seconds=1)))
+        s.commit()
+
+    start = threading.Barrier(2)
+    errors = []
+
+    def run(fn):
+        start.wait()
+        try:
+            fn()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=run, args=(lambda: host.post(f"/rooms/{room.code}/close_vote", follow_redirects=False),)),
+        threading.Thread(target=run, args=(lambda: _advance_due(room.code),)),
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    # 後から評価し直されても（スケジューラの再実行）変わらない
+    _advance_due(room.code)
+
+
+def _scores(room) -> dict[int, int]:
+    with Session(engines[0]) as s:
+        return dict(s.exec(select(Player.id, Player.score).where(Player.room_code == room.code)).all())
+
+
+def _results(room) -> list[RoundResult]:
+    with Session(engines[0]) as s:
+        return s.exec(select(RoundResult).where(RoundResult.round_id == room.round_id)).all()
+
+
+def test_concurrent_close_scores_once(started_room):
+    room = started_room(4)
+    room.clients[0].post(f"/rooms/{room.code}/lock_hints", follow_redirects=False)
+    others = [pid for pid in room.player_ids if pid != room.spy_id]
+    # ウルフ以外は全員ウルフに、ウルフは誰か別の人に入れる
+    for client, pid in zip(room.clients, room.player_ids):
+        target = others[0] if pid == room.spy_id else room.spy_id
+        res = client.post(f"/rooms/{room.code}/vote", data={"target_player_id": target}, follow_redirects=False)
+        assert res.status_code == 303
+
+    _close_both_ways(room)
+
+    expected = {pid: (0 if pid == room.spy_id else 1) for pid in room.player_ids}
+    assert _scores(room) == expected
+    [result] = _results(room)
+    assert not result.wolf_won
+    assert sorted(result.deltas) == sorted([pid, 1] for pid in others)
+
+
+def test_round_without_votes_gives_wolf_three(started_room):
+    room = started_room(3)
+
+    _close_both_ways(room)
+
+    expected = {pid: (3 if pid == room.spy_id else 0) for pid in room.player_ids}
+    assert _scores(room) == expected
+    [result] = _results(room)
+    assert result.wolf_won
+    assert result.deltas == [[room.spy_id, 3]]
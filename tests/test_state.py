@@ -0,0 +1,36 @@
+"""
+部屋キャッシュ（app/state.py の RoomCache）の世代管理。
+"""
+from app.models import GameStatus
+from app.state import RoomCache, RoomState
+
+
+def _state(code: str) -> RoomState:
+    return RoomState(code=code, status=GameStatus.lobby, round=0, lang="ja",
+                     hint_deadline=None, vote_deadline=None)
+
+
+def test_generations_of_uncached_rooms_are_pruned():
+    cache = RoomCache(loader=_state, idle_seconds=60)
+    cache.get("KEEP01")
+    # 回収済みなど、キャッシュに載っていない部屋への invalidate / put_*
+    for i in range(100):
+        cache.invalidate(f"GONE{i:02d}")
+    assert cache.version_of("GONE00") != 0
+
+    cache.evict_idle()
+    assert cache.version_of("GONE00") == 0
+    assert cache.version_of("KEEP01") != 0      # 載っている部屋の世代は残す
+
+
+def test_uncached_fallback_gets_a_fresh_version():
+    def busy_loader(code):
+        # 読み込むたびに書き込みが割り込む部屋（キャッシュされずに返る）
+        cache.invalidate(code)
+        return _state(code)
+
+    cache = RoomCache(loader=busy_loader)
+    a = cache.get("BUSY01")
+    b = cache.get("BUSY01")
+    assert a.version != 0 and b.version != 0
+    assert a.version != b.version